@@ -2,45 +2,56 @@
 #
 # Interface between investor and exchange
 #
-# TODO1: check if trader ids are unique
 # TODO2: implement maker taker fee
-# TODO3: option to restrict short selling
 #
 #####################################################################
 
 import numpy as np
-import pandas as pd
-import random
-import string
 import math
+from time import perf_counter_ns
+
+from stop_orders import StopOrder
+from journal import STOP
+from orderbook import SIDES
+import instrumentation
 
 
 class Interface:
     
     def __init__(self):
         self.book = None
-        self.trader_ids = pd.DataFrame([], columns = ["trader", "trader_id"]).set_index("trader_id")
+        # trader ids are positions in this list, -1 is used by random traders
+        self.traders = []
         self.taker_fee = 0.0008
         self.maker_fee = 0.0005
         self.retail_limit_fee = 3
         self.retail_market_fee = 2
         self.retail_cancel_limit_fee = 0
+        # order id -> position in the batch that is currently submitted
+        self.batch_orders = None
+        # fills of non-random traders, delivered by flush once matching is done
+        self.pending_fills = []
+        self.market_data = None
+        # RiskManager that runs the pre-trade checks, None if orders are not checked
+        self.risk = None
+        # HistorySink that spills old trades, bars and fills to disk, None if all history stays in memory
+        self.history = None
     
     def connect_trader(self, traders):
         for trader in traders:
             new_ID = self.generate_trader_ID()
             trader.get_trader_id(new_ID)
-            self.trader_ids = pd.concat([self.trader_ids,
-                                             pd.DataFrame([[trader, new_ID]],
-                                                          columns = ["trader", "trader_id"]).set_index("trader_id")])
+            self.traders.append(trader)
+            if self.history is not None:
+                self.history.attach_trader(trader)
         print("Successfully connected %i traders to the exchange"%len(traders))
         return None
     
-    def generate_trader_ID(self, id_length=8):
-        all_char = string.ascii_uppercase + string.ascii_lowercase + string.digits
-        # TODO1 check if trader_ID is doubled
-        trader_ID = ''.join(random.choice(all_char) for _ in range(id_length))
-        return trader_ID
+    def generate_trader_ID(self):
+        """
+        returns the next free integer trader id
+        """
+        return len(self.traders)
     
     def connect_orderbook(self, orderbook):
         try:
@@ -50,6 +61,32 @@ class Interface:
             print("Could not connect to orderbook. Please try again.")
         return None
     
+    def connect_market_data(self, market_data):
+        try:
+            self.market_data = market_data
+            market_data.connect_interface(self)
+            print("Connection to market data bus successful.")
+        except:
+            print("Could not connect to market data bus. Please try again.")
+        return None
+    
+    def connect_history(self, history):
+        try:
+            self.history = history
+            history.connect_interface(self)
+            print("Connection to history sink successful.")
+        except:
+            print("Could not connect to history sink. Please try again.")
+        return None
+    
+    def connect_risk(self, risk):
+        """
+        switches the pre-trade risk checks on, or off with None
+        @param risk: risk.RiskManager or None
+        """
+        self.risk = risk
+        return None
+    
     def connect_trade_reporter(self, trade_reporter):
         try:
             self.trade_reporter = trade_reporter
@@ -66,23 +103,31 @@ class Interface:
         @param direction: string or None: only show bid or ask section of orderbook. Shows both if None
         """
         if stock in self.book.stock_list:
-            self.book.book[stock]["bid"].sort_values(["Price", "Quantity"],
-                                                     inplace = True,
-                                                     ascending = [False, False])
-            self.book.book[stock]["ask"].sort_values(["Price", "Quantity"],
-                                                     inplace = True,
-                                                     ascending = [True, False])
-            bid = self.book.book[stock]["bid"]
-            ask = self.book.book[stock]["ask"]
+            bid = self.book.book[stock]["bid"].to_frame()
+            ask = self.book.book[stock]["ask"].to_frame()
             return bid, ask
         
+    def depth(self, stock, levels=5):
+        """
+        aggregated price, quantity and order count of the best price levels of a stock.
+        The snapshot is only rebuilt after the book of the stock changed, so polling is cheap
+        @param stock: string: name of the stock of interest
+        @param levels: int or None: number of levels per side, all levels if None
+        @return: tuple: bid and ask depth as read-only structured arrays with fields
+                 Price, Quantity and Orders from best to worst price
+        """
+        if stock in self.book.stock_list:
+            return self.book.depth(stock, levels)
+        print("Invalid stock name.")
+        return None
+    
     def get_spread(self, stock):
         """
         get the bid/ask spread of a certain stock
         @param stock: string: name of the stock of interest
         """
-        ask = self.book.book[stock]["ask"].Price.min()
-        bid = self.book.book[stock]["bid"].Price.max()
+        ask = self.book.book[stock]["ask"].best_price()
+        bid = self.book.book[stock]["bid"].best_price()
         spread = ask-bid
         if abs(spread) < math.inf:
             return spread
@@ -92,88 +137,362 @@ class Interface:
     
     def limit_bid(self, stock, p, q, trader_id):
         """
-        checks validity of order and sends it to orderbook
+        checks validity of order and sends it to the matching engine, which fills the
+        marketable part and adds the rest to the orderbook
         @param stock: string: name of stock to be bought
         @param p: float: price at which order should be filled
         @param q: int: number of shares to be traded
-        @param trader_id: string: id of trader who sent the order
+        @param trader_id: int: id of trader who sent the order
+        @return: tuple: order id, executed quantity, average execution price
         """
         if q == 0:
             return None
         if not stock in self.book.stock_list:
             print("Invalid stock name. No order has been placed.")
             return None
-        best_ask = self.book.best_ask(stock)
-        if best_ask.Price <= p:
-            self.market_bid(stock, min(q, best_ask.Quantity), trader_id)
-            self.limit_bid(stock, p, q-min(q, best_ask.Quantity), trader_id)
-        else:
-            self.book.add_bid(stock, p, q, trader_id)
-        return True
+        return self.send_order(stock, "bid", q, trader_id, p)
         
     def limit_ask(self, stock, p, q, trader_id):
         """
-        checks validity of order and sends it to orderbook
+        checks validity of order and sends it to the matching engine, which fills the
+        marketable part and adds the rest to the orderbook
         @param stock: string: name of stock to be sold
         @param p: float: price at which order should be filled
         @param q: int: number of shares to be traded
-        @param trader_id: string: id of trader who sent the order
+        @param trader_id: int: id of trader who sent the order
+        @return: tuple: order id, executed quantity, average execution price
         """
         if q == 0:
             return None
         if not stock in self.book.stock_list:
             print("Invalid stock name. No order has been placed.")
             return None
-        best_bid = self.book.best_bid(stock)
-        if best_bid.Price >= p:
-            self.market_ask(stock, min(q, best_bid.Quantity), trader_id)
-            self.limit_ask(stock, p, q-min(q, best_bid.Quantity), trader_id)
-        else:
-            self.book.add_ask(stock, p, q, trader_id)
-        return True
+        return self.send_order(stock, "ask", q, trader_id, p)
     
     def market_bid(self, stock, q, trader_id):
         """
-        checks validity of market bid order and places the order if valid
+        checks validity of market bid order and sweeps the ask side if valid
+        @return: tuple: order id, executed quantity, average execution price
+                 or None if nothing could be traded
         """
         if not stock in self.book.stock_list:
             print("Invalid stock name. No order has been placed.")
             return None
-        q = min(q, self.book.book[stock]["ask"].Quantity.sum())
-        if q <= 0:
+        if q <= 0 or len(self.book.book[stock]["ask"]) == 0:
             return None
-        best_ask_index = self.book.book[stock]["ask"].Price.idxmin()
-        new_q = q - min(q, self.book.book[stock]["ask"].Quantity.loc[best_ask_index])
-        self.book.add_bid(stock,
-                          self.book.book[stock]["ask"].Price.loc[best_ask_index],
-                          min(q, self.book.book[stock]["ask"].Quantity.loc[best_ask_index]),
-                          trader_id)
-        self.market_bid(stock, new_q, trader_id)
-        return True
+        return self.send_order(stock, "bid", q, trader_id)
     
     def market_ask(self, stock, q, trader_id):
         """
-        checks validity of market ask order and places the order if valid
+        checks validity of market ask order and sweeps the bid side if valid
+        @return: tuple: order id, executed quantity, average execution price
+                 or None if nothing could be traded
         """
         if not stock in self.book.stock_list:
             print("Invalid stock name. No order has been placed.")
             return None
-        q = min(q, self.book.book[stock]["bid"].Quantity.sum())
-        if q <= 0:
+        if q <= 0 or len(self.book.book[stock]["bid"]) == 0:
             return None
-        best_bid_index = self.book.book[stock]["bid"].Price.idxmax()
-        new_q = q - min(q, self.book.book[stock]["bid"].Quantity.loc[best_bid_index])
-        self.book.add_ask(stock,
-                          self.book.book[stock]["bid"].Price.loc[best_bid_index],
-                          min(q, self.book.book[stock]["bid"].Quantity.loc[best_bid_index]),
-                          trader_id)
-        self.market_ask(stock, new_q, trader_id)
+        return self.send_order(stock, "ask", q, trader_id)
+    
+    def send_order(self, stock, side, q, trader_id, p=None, rest=True):
+        """
+        runs the pre-trade risk checks, sends the order to the matching engine and
+        books it in the exposure cache
+        @param p: float or None: limit price, None for market orders
+        @param rest: bool: add the rest of a limit order to the book
+        @return: tuple: order id, executed quantity, average execution price or None if rejected
+        """
+        risk = self.risk
+        if risk is None or trader_id < 0:
+            result = self.book.matching_engine.execute_order(stock, side, q, trader_id, p, rest)
+            self.flush()
+            return result
+        code = self.book.stock_index[stock]
+        price = math.nan if p is None else p
+        rests = rest and p is not None
+        reason = risk.check(trader_id, code, side, price, q, rests)
+        if reason is not None:
+            risk.rejected += 1
+            print("Order rejected by risk checks (%s). No order has been placed."%reason)
+            return None
+        risk.reserve(trader_id, code, side, price, q, rests)
+        result = self.book.matching_engine.execute_order(stock, side, q, trader_id, p, rest)
+        risk.settle(result[0], trader_id, code, side, price, q,
+                    self.resting_quantity(stock, side, result[0]) if rests else 0, rests)
+        self.flush()
+        return result
+    
+    def resting_quantity(self, stock, side, order_id):
+        """
+        quantity of an order that rests in the book, 0 if it is not in the book
+        """
+        book_side = self.book.book[stock][side]
+        return int(book_side.entry(order_id).Quantity) if order_id in book_side else 0
+    
+    def valid_order(self, stock, q):
+        if q <= 0:
+            return False
+        if not stock in self.book.stock_list:
+            print("Invalid stock name. No order has been placed.")
+            return False
         return True
     
-    def communicate_filled_order(self, order_id, stock, p, q, direction):
-        trader = self.book.order_trader.loc[order_id].trader_id
-        if trader == -1:
+    def ioc_bid(self, stock, p, q, trader_id):
+        """
+        immediate-or-cancel buy order: trades as much as possible up to price p,
+        the rest is cancelled and never enters the orderbook
+        @return: tuple: order id, executed quantity, average execution price
+        """
+        if not self.valid_order(stock, q):
+            return None
+        return self.send_order(stock, "bid", q, trader_id, p, rest=False)
+    
+    def ioc_ask(self, stock, p, q, trader_id):
+        """
+        immediate-or-cancel sell order: trades as much as possible down to price p,
+        the rest is cancelled and never enters the orderbook
+        @return: tuple: order id, executed quantity, average execution price
+        """
+        if not self.valid_order(stock, q):
+            return None
+        return self.send_order(stock, "ask", q, trader_id, p, rest=False)
+    
+    def fok_bid(self, stock, p, q, trader_id):
+        """
+        fill-or-kill buy order: trades the complete quantity up to price p or nothing
+        @return: tuple: order id, executed quantity, average execution price or None if killed
+        """
+        if not self.valid_order(stock, q):
+            return None
+        if self.book.matching_engine.available_quantity(stock, "bid", p) < q:
+            return None
+        return self.send_order(stock, "bid", q, trader_id, p, rest=False)
+    
+    def fok_ask(self, stock, p, q, trader_id):
+        """
+        fill-or-kill sell order: trades the complete quantity down to price p or nothing
+        @return: tuple: order id, executed quantity, average execution price or None if killed
+        """
+        if not self.valid_order(stock, q):
+            return None
+        if self.book.matching_engine.available_quantity(stock, "ask", p) < q:
             return None
-        trader = self.trader_ids.loc[trader].trader
-        trader.filled_order_info(stock, p, q, direction)
+        return self.send_order(stock, "ask", q, trader_id, p, rest=False)
+    
+    def stop_bid(self, stock, stop_p, q, trader_id, limit_p=None):
+        """
+        buy stop order: becomes a market order (or a limit order at limit_p) once a
+        trade happens at or above stop_p
+        @param stop_p: float: trigger price
+        @param limit_p: float or None: limit price of a stop limit order
+        @return: int: order id of the stop order
+        """
+        return self.stop_order(stock, "bid", stop_p, q, trader_id, limit_p)
+    
+    def stop_ask(self, stock, stop_p, q, trader_id, limit_p=None):
+        """
+        sell stop order: becomes a market order (or a limit order at limit_p) once a
+        trade happens at or below stop_p
+        @param stop_p: float: trigger price
+        @param limit_p: float or None: limit price of a stop limit order
+        @return: int: order id of the stop order
+        """
+        return self.stop_order(stock, "ask", stop_p, q, trader_id, limit_p)
+    
+    def stop_order(self, stock, side, stop_p, q, trader_id, limit_p=None):
+        """
+        adds a stop order to the stop book. Stops that are already crossed by the
+        last traded price are released immediately
+        """
+        if not self.valid_order(stock, q):
+            return None
+        risk = self.risk
+        if risk is not None and trader_id >= 0:
+            code = self.book.stock_index[stock]
+            price = math.nan if limit_p is None else limit_p
+            reason = risk.check(trader_id, code, side, price, q, limit_p is not None)
+            if reason is not None:
+                risk.rejected += 1
+                print("Order rejected by risk checks (%s). No order has been placed."%reason)
+                return None
+        order_id = self.book.register_order(trader_id, stock, side)
+        if risk is not None and trader_id >= 0:
+            risk.count(trader_id)
+            risk.track(order_id, trader_id, code, side, price, q)
+        if self.book.journal is not None:
+            self.book.journal.record(STOP, self.book.stock_index[stock], side, order_id, trader_id,
+                                     stop_p, q, math.nan if limit_p is None else limit_p)
+        self.book.stops.add(StopOrder(order_id, stock, side, stop_p, q, trader_id, limit_p))
+        self.book.stops.trigger(stock, self.trade_reporter.last_price(stock))
+        if self.book.stops.pending:
+            self.book.matching_engine.release_stops()
+        self.flush()
+        return order_id
+    
+    def cancel(self, order_id):
+        """
+        cancels a resting limit order or a pending stop order
+        @return: bool: True if the order was cancelled, False if it was not live
+        """
+        cancelled = self.book.cancel_order(order_id) is not None
+        if cancelled and self.risk is not None:
+            self.risk.release(order_id)
+        self.flush()
+        return cancelled
+    
+    def cancel_many(self, order_ids):
+        """
+        cancels many orders at once, order ids that appear more than once are cancelled once
+        @param order_ids: array-like: ids of the orders to be cancelled
+        @return: np.array: unique order ids and np.array of bools, True where the order was cancelled
+        """
+        order_ids = np.unique(np.asarray(order_ids, dtype=np.int64))
+        cancel_order = self.book.cancel_order
+        cancelled = np.fromiter((cancel_order(int(i)) is not None for i in order_ids),
+                                dtype=bool, count=len(order_ids))
+        if self.risk is not None:
+            for order_id in order_ids[cancelled].tolist():
+                self.risk.release(order_id)
+        self.flush()
+        return order_ids, cancelled
+    
+    def replace(self, order_id, new_p=None, new_q=None):
+        """
+        changes price and/or quantity of a resting limit order. Only lowering the quantity
+        keeps the time priority of the order
+        @return: order id or None if the order is not resting in the book
+        """
+        if new_p is not None and not new_p > 0:
+            print("Invalid price. The order has not been changed.")
+            return None
+        risk = self.risk
+        live = risk.live.get(order_id) if risk is not None else None
+        if live is not None:
+            trader_id, code, s, p, q = live
+            stock, side = self.book.stock_list[code], SIDES[s]
+            # pending stops are live but cannot be replaced, their reservation stays as it is
+            if order_id not in self.book.book[stock][side]:
+                return None
+            reason = risk.check(trader_id, code, side, p if new_p is None else new_p,
+                                q if new_q is None else new_q, True, replaces=order_id)
+            if reason is not None:
+                risk.rejected += 1
+                print("Modify rejected by risk checks (%s). The order has not been changed."%reason)
+                return None
+            risk.count(trader_id)
+            risk.release(order_id)
+        result = self.book.replace_order(order_id, new_p, new_q)
+        if live is not None:
+            rest = self.resting_quantity(stock, side, order_id)
+            if rest > 0:
+                risk.track(order_id, trader_id, code, side, self.book.book[stock][side].entry(order_id).Price, rest)
+        self.flush()
+        return result
+    
+    def submit_batch(self, stocks, sides, types, prices, quantities, trader_ids=-1):
+        """
+        checks validity of many orders at once and sends them to the orderbook grouped
+        by stock. The book of every stock is matched once after all its limit orders are
+        inserted, market orders are executed afterwards in the order they were sent
+        @param stocks: array-like: names of the stocks to be traded
+        @param sides: array-like: "bid" or "ask" per order
+        @param types: array-like: "limit" or "market" per order
+        @param prices: array-like: limit prices, ignored for market orders
+        @param quantities: array-like: number of shares to be traded
+        @param trader_ids: array-like or scalar: id of the trader who sent each order
+        scalars are used for every order of the batch
+        @return: tuple of np.arrays: order ids (-1 for rejected orders),
+                 filled quantities and average fill prices (nan if nothing was filled)
+        """
+        metrics = self.book.metrics
+        if metrics is not None:
+            start = perf_counter_ns()
+        stocks = np.asarray(stocks)
+        n = len(stocks)
+        sides = np.broadcast_to(sides, n)
+        types = np.broadcast_to(types, n)
+        prices = np.broadcast_to(np.asarray(prices, dtype=float), n)
+        quantities = np.broadcast_to(quantities, n)
+        trader_ids = np.broadcast_to(np.asarray(trader_ids, dtype=np.int64), n)
+        is_market = types == "market"
+        valid = (np.isin(stocks, self.book.stock_list)
+                 & np.isin(sides, ["bid", "ask"])
+                 & (is_market | (types == "limit"))
+                 & (quantities > 0)
+                 & (is_market | (np.isfinite(prices) & (prices > 0))))
+        risk = self.risk
+        if risk is not None:
+            checked = []
+            stock_index = self.book.stock_index
+            for i in np.flatnonzero(valid & (trader_ids >= 0)).tolist():
+                args = (int(trader_ids[i]), stock_index[stocks[i]], sides[i], prices[i], quantities[i], not is_market[i])
+                if risk.check(*args) is None:
+                    risk.reserve(*args)
+                    checked.append((i, args))
+                else:
+                    risk.rejected += 1
+                    valid[i] = False
+        order_ids = np.full(n, -1, dtype=np.int64)
+        filled = np.zeros(n)
+        notional = np.zeros(n)
+        self.batch_orders = {}
+        self.batch_fills = (filled, notional)
+        engine = self.book.matching_engine
+        idx = np.flatnonzero(valid)
+        idx = idx[np.argsort(stocks[idx], kind="stable")]
+        bounds = np.flatnonzero(stocks[idx][1:] != stocks[idx][:-1]) + 1
+        try:
+            for group in np.split(idx, bounds):
+                if len(group) == 0:
+                    continue
+                stock = stocks[group[0]]
+                for i in group[~is_market[group]]:
+                    order_ids[i] = self.book.insert_order(stock, sides[i], prices[i], quantities[i], trader_ids[i])
+                    self.batch_orders[order_ids[i]] = i
+                engine.check_trades(stock)
+                for i in group[is_market[group]]:
+                    order_ids[i], filled[i], avg_price = engine.execute_order(stock, sides[i], quantities[i], trader_ids[i])
+                    notional[i] = filled[i]*avg_price if filled[i] else 0.
+        finally:
+            self.batch_orders = None
+        if risk is not None:
+            for i, (trader_id, code, side, p, q, rests) in checked:
+                rest = self.resting_quantity(stocks[i], side, order_ids[i]) if rests else 0
+                risk.settle(int(order_ids[i]), trader_id, code, side, p, q, rest, rests)
+        self.flush()
+        avg_price = np.full(n, np.nan)
+        np.divide(notional, filled, out=avg_price, where=filled > 0)
+        if metrics is not None:
+            metrics.record(instrumentation.BATCH, -1, perf_counter_ns() - start)
+        return order_ids, filled, avg_price
+    
+    def communicate_filled_order(self, order_id, stock, p, q, direction):
+        if self.batch_orders is not None and order_id in self.batch_orders:
+            i = self.batch_orders[order_id]
+            self.batch_fills[0][i] += q
+            self.batch_fills[1][i] += p*q
+        trader = self.book.order_trader[order_id]
+        if trader != -1:
+            self.pending_fills.append((trader, stock, p, q, direction))
+            if self.risk is not None:
+                self.risk.fill(order_id, trader, self.book.stock_index[stock], q, direction)
+        return None
+    
+    def flush(self):
+        """
+        delivers the fills of the last order to the traders and publishes market data.
+        Called after every order, so no trader or subscriber code runs inside the matching loop
+        """
+        metrics = self.book.metrics
+        if metrics is not None:
+            start = perf_counter_ns()
+        if self.pending_fills:
+            fills, self.pending_fills = self.pending_fills, []
+            for trader, stock, p, q, direction in fills:
+                self.traders[trader].filled_order_info(stock, p, q, direction)
+        if self.market_data is not None:
+            self.market_data.publish()
+        if metrics is not None:
+            metrics.record(instrumentation.DELIVER, -1, perf_counter_ns() - start)
         return None
\ No newline at end of file
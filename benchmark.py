@@ -0,0 +1,262 @@
+#####################################################################
+#
+# Benchmark suite builds synthetic books and measures the hot paths
+# of the exchange (inserts, cancels, sweeps, matching, throughput and
+# memory per order) for every backend and matching algorithm.
+# Results are printed or written as JSON
+#
+# python benchmark.py --stocks 10 --depth 2000 --out results.json
+#
+#####################################################################
+
+import argparse
+import contextlib
+import io
+import json
+import platform
+import time
+import tracemalloc
+import numpy as np
+
+import sim_traders
+from exchange import build_exchange
+
+PERCENTILES = [50, 90, 99, 99.9]
+
+
+def latency_summary(ns):
+    """
+    @param ns: array-like: latencies in nanoseconds
+    @return: dict: count, mean, percentiles and max in microseconds
+    """
+    us = np.asarray(ns, dtype=np.float64)/1000
+    summary = {"n": int(len(us)), "mean_us": float(us.mean()) if len(us) else None}
+    for p in PERCENTILES:
+        summary["p%s_us"%str(p).replace(".", "")] = float(np.percentile(us, p)) if len(us) else None
+    summary["max_us"] = float(us.max()) if len(us) else None
+    return summary
+
+
+def synthetic_orders(rng, stocks, depth, levels, mid=100., tick=0.01):
+    """
+    draws depth resting orders per side and stock spread over levels price levels
+    below (bids) and above (asks) mid
+    @return: list of tuples: stock, side, price, quantity in random arrival order
+    """
+    orders = []
+    for stock in stocks:
+        for side, sign in [("bid", -1), ("ask", 1)]:
+            prices = mid + sign*tick*(1 + rng.integers(levels, size=depth))
+            quantities = rng.integers(10, 1001, size=depth)
+            orders += [(stock, side, p, q) for p, q in zip(prices.tolist(), quantities.tolist())]
+    rng.shuffle(orders)
+    return orders
+
+
+def synthetic_exchange(stocks, backend, algo, orders):
+    """
+    builds an exchange and fills its books with the synthetic orders without matching
+    """
+    interface = build_exchange(stocks, [100.]*len(stocks), backend, algo)
+    insert_order = interface.book.insert_order
+    for stock, side, p, q in orders:
+        insert_order(stock, side, p, q, -1)
+    return interface
+
+
+def refill(interface, stock, side, depth):
+    """
+    puts the aggregated levels of a depth snapshot back as one order per level
+    """
+    for price, quantity, _ in depth.tolist():
+        interface.book.insert_order(stock, side, price, quantity, -1)
+    return None
+
+
+def bench_insert(interface, rng, stocks, samples, levels, tick=0.01):
+    """
+    latency of add_bid/add_ask for orders that rest in the book without trading
+    """
+    book = interface.book
+    timer = time.perf_counter_ns
+    ns = np.empty(samples, dtype=np.int64)
+    codes = rng.integers(len(stocks), size=samples)
+    is_bid = rng.random(samples) < 0.5
+    offsets = tick*(1 + rng.integers(levels, size=samples))
+    quantities = rng.integers(10, 1001, size=samples).tolist()
+    for i in range(samples):
+        stock = stocks[codes[i]]
+        if is_bid[i]:
+            start = timer()
+            book.add_bid(stock, 100. - offsets[i], quantities[i], -1)
+        else:
+            start = timer()
+            book.add_ask(stock, 100. + offsets[i], quantities[i], -1)
+        ns[i] = timer() - start
+    return latency_summary(ns)
+
+
+def bench_cancel(interface, rng, samples):
+    """
+    latency of cancelling random live resting orders
+    """
+    book = interface.book
+    live = [order_id for stock in book.stock_list for side in ["bid", "ask"]
+            for order_id in book.book[stock][side].order_ids()]
+    order_ids = rng.choice(live, size=min(samples, len(live)), replace=False).tolist()
+    timer = time.perf_counter_ns
+    ns = np.empty(len(order_ids), dtype=np.int64)
+    for i, order_id in enumerate(order_ids):
+        start = timer()
+        book.cancel_order(order_id)
+        ns[i] = timer() - start
+    return latency_summary(ns)
+
+
+def bench_sweep(interface, rng, stocks, samples, sweep_levels):
+    """
+    cost of market orders that take exactly sweep_levels price levels. The swept
+    levels are put back untimed after every sample
+    """
+    book = interface.book
+    engine = book.matching_engine
+    timer = time.perf_counter_ns
+    ns = []
+    for i in range(samples):
+        stock = stocks[rng.integers(len(stocks))]
+        side = "bid" if rng.random() < 0.5 else "ask"
+        passive = "ask" if side == "bid" else "bid"
+        depth = book.book[stock][passive].depth(sweep_levels).copy()
+        if len(depth) == 0:
+            continue
+        start = timer()
+        engine.execute_order(stock, side, int(depth["Quantity"].sum()), -1)
+        ns.append(timer() - start)
+        refill(interface, stock, passive, depth)
+    summary = latency_summary(ns)
+    summary["levels"] = sweep_levels
+    return summary
+
+
+def bench_check_trades(interface, rng, stocks, samples, sweep_levels):
+    """
+    cost of check_trades for a book crossed by one limit order through sweep_levels levels
+    """
+    book = interface.book
+    engine = book.matching_engine
+    timer = time.perf_counter_ns
+    ns = []
+    for i in range(samples):
+        stock = stocks[rng.integers(len(stocks))]
+        side = "bid" if rng.random() < 0.5 else "ask"
+        passive = "ask" if side == "bid" else "bid"
+        depth = book.book[stock][passive].depth(sweep_levels).copy()
+        if len(depth) == 0:
+            continue
+        book.insert_order(stock, side, depth["Price"][-1], int(depth["Quantity"].sum()), -1)
+        start = timer()
+        engine.check_trades(stock)
+        ns.append(timer() - start)
+        refill(interface, stock, passive, depth)
+    summary = latency_summary(ns)
+    summary["levels"] = sweep_levels
+    return summary
+
+
+def bench_throughput(stocks, backend, algo, seed, periods, n_traders):
+    """
+    end-to-end orders per second of the random trader loop of 'trading_sim_tests.py'
+    """
+    interface = build_exchange(stocks, [100.]*len(stocks), backend, algo)
+    trade_sim = sim_traders.Random_Traders(n=n_traders, p_market=0.2, p_limit=0.7,
+                                           vectorized=True, rng=np.random.default_rng(seed))
+    with contextlib.redirect_stdout(io.StringIO()):
+        trade_sim.connect_interface(interface)
+    start = time.perf_counter()
+    for _ in range(periods):
+        trade_sim.limit_orders(vola=2.5)
+        trade_sim.market_orders()
+        trade_sim.delete_order()
+        interface.trade_reporter.end_period()
+    elapsed = time.perf_counter() - start
+    orders = len(interface.book.order_trader)
+    return {"orders": orders,
+            "trades": len(interface.trade_reporter.tape),
+            "seconds": elapsed,
+            "orders_per_sec": orders/elapsed if elapsed else None}
+
+
+def bench_memory(stocks, backend, algo, orders):
+    """
+    bytes allocated per resting order while the synthetic books are built
+    """
+    interface = build_exchange(stocks, [100.]*len(stocks), backend, algo)
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    for stock, side, p, q in orders:
+        interface.book.insert_order(stock, side, p, q, -1)
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return {"orders": len(orders), "bytes_per_order": (after - before)/len(orders)}
+
+
+def run(n_stocks=10, depth=2000, levels=50, samples=2000, sweep_levels=3, periods=100, n_traders=1000,
+        backends=("levels", "dataframe"), algos=("pro rata", "fifo"), seed=0):
+    """
+    runs all benchmarks for every combination of backend and matching algorithm.
+    All random numbers come from generators seeded with seed, so every combination
+    sees the same books and orders
+    @param n_stocks: int: number of synthetic stocks
+    @param depth: int: resting orders per side and stock
+    @param levels: int: price levels per side the resting orders are spread over
+    @param samples: int: timed calls per latency benchmark
+    @param sweep_levels: int: price levels taken by every sweep
+    @param periods: int: periods of the throughput benchmark
+    @param n_traders: int: random traders of the throughput benchmark
+    @return: dict: configuration and one result entry per backend and algorithm
+    """
+    stocks = ["S%i"%i for i in range(n_stocks)]
+    config = {"stocks": n_stocks, "depth": depth, "levels": levels, "samples": samples,
+              "sweep_levels": sweep_levels, "periods": periods, "traders": n_traders, "seed": seed}
+    report = {"config": config,
+              "python": platform.python_version(),
+              "numpy": np.__version__,
+              "results": []}
+    orders = synthetic_orders(np.random.default_rng(seed), stocks, depth, levels)
+    for backend in backends:
+        for algo in algos:
+            result = {"backend": backend, "algo": algo}
+            interface = synthetic_exchange(stocks, backend, algo, orders)
+            result["insert"] = bench_insert(interface, np.random.default_rng(seed + 1), stocks, samples, levels)
+            result["cancel"] = bench_cancel(interface, np.random.default_rng(seed + 2), samples)
+            interface = synthetic_exchange(stocks, backend, algo, orders)
+            result["sweep"] = bench_sweep(interface, np.random.default_rng(seed + 3), stocks, samples, sweep_levels)
+            result["check_trades"] = bench_check_trades(interface, np.random.default_rng(seed + 4), stocks,
+                                                        samples, sweep_levels)
+            result["throughput"] = bench_throughput(stocks, backend, algo, seed + 5, periods, n_traders)
+            result["memory"] = bench_memory(stocks, backend, algo, orders)
+            report["results"].append(result)
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks of the exchange hot paths.")
+    parser.add_argument("--stocks", type=int, default=10)
+    parser.add_argument("--depth", type=int, default=2000, help="resting orders per side and stock")
+    parser.add_argument("--levels", type=int, default=50, help="price levels per side")
+    parser.add_argument("--samples", type=int, default=2000, help="timed calls per latency benchmark")
+    parser.add_argument("--sweep-levels", type=int, default=3)
+    parser.add_argument("--periods", type=int, default=100)
+    parser.add_argument("--traders", type=int, default=1000)
+    parser.add_argument("--backends", nargs="+", default=["levels", "dataframe"])
+    parser.add_argument("--algos", nargs="+", default=["pro rata", "fifo"])
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default=None, help="JSON file, printed if not given")
+    args = parser.parse_args()
+    report = run(args.stocks, args.depth, args.levels, args.samples, args.sweep_levels, args.periods,
+                 args.traders, args.backends, args.algos, args.seed)
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
@@ -0,0 +1,231 @@
+#####################################################################
+#
+# Checkpoint saves the complete state of an exchange (books, stop
+# orders, order maps, trade reporter history and trader ledgers) to
+# one .npz file and restores it into a freshly built exchange
+#
+#####################################################################
+
+from array import array
+import numpy as np
+
+import risk
+import trader
+from exchange import build_exchange
+from stop_orders import StopOrder
+
+CHECKPOINT_VERSION = 1
+# resting orders of all books, Side is 0 for bid and 1 for ask
+ORDER_DTYPE = [("Order_ID", np.int64),
+               ("Stock", np.int32),
+               ("Side", np.int8),
+               ("Price", np.float64),
+               ("Quantity", np.int64)]
+# pending stop orders, Limit is nan for stop market orders
+STOP_DTYPE = [("Order_ID", np.int64),
+              ("Stock", np.int32),
+              ("Side", np.int8),
+              ("Trigger", np.float64),
+              ("Quantity", np.int64),
+              ("Trader_ID", np.int64),
+              ("Limit", np.float64)]
+# live orders in the exposure cache of the risk manager
+RISK_DTYPE = [("Order_ID", np.int64),
+              ("Trader_ID", np.int64),
+              ("Stock", np.int32),
+              ("Side", np.int8),
+              ("Price", np.float64),
+              ("Quantity", np.int64)]
+# arrays of the risk manager, one row per trader id
+RISK_ARRAYS = ["positions", "open", "open_notional", "orders", "short_selling",
+               "max_position", "max_open_notional", "max_orders"]
+SIDES = ["bid", "ask"]
+
+
+def book_orders(book):
+    """
+    collects the resting orders of all books into one structured array,
+    each side in the order its orders have to be added again
+    """
+    parts = []
+    for code, stock in enumerate(book.stock_list):
+        for side_code, side in enumerate(SIDES):
+            order_ids, prices, quantities = book.book[stock][side].resting_orders()
+            rows = np.empty(len(order_ids), dtype=ORDER_DTYPE)
+            rows["Order_ID"] = order_ids
+            rows["Stock"] = code
+            rows["Side"] = side_code
+            rows["Price"] = prices
+            rows["Quantity"] = quantities
+            parts.append(rows)
+    return np.concatenate(parts) if parts else np.empty(0, dtype=ORDER_DTYPE)
+
+
+def risk_state(risk):
+    """
+    arrays and live orders of a RiskManager, empty if the interface has no risk checks
+    """
+    if risk is None:
+        return {"risk": np.array(False)}
+    state = {"risk": np.array(True), "risk_rejected": np.array(risk.rejected)}
+    for name in RISK_ARRAYS:
+        state["risk_" + name] = getattr(risk, name)
+    live = np.empty(len(risk.live), dtype=RISK_DTYPE)
+    for i, (order_id, entry) in enumerate(risk.live.items()):
+        live[i] = (order_id, *entry)
+    state["risk_live"] = live
+    return state
+
+
+def restore_risk(interface, state):
+    """
+    connects a RiskManager with the saved exposure cache to the interface
+    """
+    if not bool(state.get("risk", False)):
+        return None
+    manager = risk.RiskManager(interface.book.stock_list)
+    for name in RISK_ARRAYS:
+        setattr(manager, name, state["risk_" + name].copy())
+    manager.rejected = int(state["risk_rejected"])
+    manager.live = {row[0]: list(row[1:]) for row in state["risk_live"].tolist()}
+    interface.connect_risk(manager)
+    return None
+
+
+def stop_orders(book):
+    stops = [stop for stock in book.stock_list for side in SIDES for stop in book.stops.orders[stock][side]]
+    rows = np.empty(len(stops), dtype=STOP_DTYPE)
+    for i, stop in enumerate(stops):
+        rows[i] = (stop.Order_ID, book.stock_index[stop.Stock], SIDES.index(stop.Side), stop.Trigger,
+                   stop.Quantity, stop.Trader_ID, np.nan if stop.Limit is None else stop.Limit)
+    return rows
+
+
+def save_checkpoint(interface, path):
+    """
+    writes the state of a connected exchange to an uncompressed .npz file.
+    Should be called between orders, not from inside a fill callback
+    @param interface: Interface: exchange to be saved
+    @param path: string: file name of the checkpoint
+    @return: None
+    """
+    book = interface.book
+    engine = book.matching_engine
+    trade_rep = interface.trade_reporter
+    bars = trade_rep.bars
+    traders = interface.traders
+    n_stocks = len(book.stock_list)
+    dirty = list(engine.dirty.items())
+    fills = [t.fills.view() for t in traders]
+    state = {"version": np.array(CHECKPOINT_VERSION),
+             "stocks": np.asarray(book.stock_list, dtype=str),
+             "backend": np.array(book.backend),
+             "decimals": np.array(book.decimals),
+             "algo": np.array(engine.algo),
+             "orders": book_orders(book),
+             "stops": stop_orders(book),
+             "order_trader": np.frombuffer(book.order_trader, dtype=np.int64).copy(),
+             "order_stock": np.frombuffer(book.order_stock, dtype=np.int32).copy(),
+             "order_side": np.frombuffer(book.order_side, dtype=np.int8).copy(),
+             "dirty_stock": np.array([book.stock_index[s] for s, _ in dirty], dtype=np.int32),
+             "dirty_side": np.array([SIDES.index(a) for _, a in dirty], dtype=np.int8),
+             "tape": trade_rep.tape.view(),
+             "bars": bars.buffer.view(),
+             "bar_open": bars.open,
+             "bar_high": bars.high,
+             "bar_low": bars.low,
+             "bar_close": bars.close,
+             "bar_volume": bars.volume,
+             "bar_notional": bars.notional,
+             "bar_trades": bars.trades,
+             "start_capital": np.array([t.start_capital for t in traders], dtype=np.float64),
+             "cash": np.array([t.cash for t in traders], dtype=np.float64),
+             "stock_value": np.array([t.stock_value for t in traders], dtype=np.float64),
+             "positions": np.array([t.positions for t in traders], dtype=np.int64).reshape(len(traders), n_stocks),
+             "marks": np.array([t.marks for t in traders], dtype=np.float64).reshape(len(traders), n_stocks),
+             "fill_counts": np.array([len(f) for f in fills], dtype=np.int64),
+             # rows spilled by a HistorySink before the saved windows
+             "tape_offset": np.array(trade_rep.tape.offset),
+             "bars_offset": np.array(bars.buffer.offset),
+             "fill_offsets": np.array([t.fills.offset for t in traders], dtype=np.int64),
+             "fills": np.concatenate(fills) if fills else np.empty(0, dtype=trader.FILL_DTYPE)}
+    state.update(risk_state(interface.risk))
+    # written through a file object, so np.savez does not append .npz to the name
+    with open(path, "wb") as f:
+        np.savez(f, **state)
+    return None
+
+
+def load_checkpoint(path, traders=None, backend=None, algo=None):
+    """
+    builds a new exchange and restores a checkpoint into it. Every call gives an
+    independent copy, so one warmed-up market can be forked into many experiments
+    @param path: string: file name of the checkpoint
+    @param traders: list or None: Trader objects that take over the saved ledgers in the
+                    order they were connected, new Trader objects are created if None
+    @param backend: string or None: orderbook backend, the saved one if None
+    @param algo: string or None: matching algorithm, the saved one if None
+    @return: Interface: connected interface of the restored exchange
+    """
+    with np.load(path) as data:
+        state = {name: data[name] for name in data.files}
+    if int(state["version"]) != CHECKPOINT_VERSION:
+        raise ValueError("Checkpoint version %i is not supported."%int(state["version"]))
+    stocks = state["stocks"].tolist()
+    n_traders = len(state["cash"])
+    if traders is None:
+        traders = [trader.Trader(start_capital) for start_capital in state["start_capital"].tolist()]
+    if len(traders) != n_traders:
+        raise ValueError("The checkpoint holds %i trader ledgers, got %i traders."%(n_traders, len(traders)))
+    interface = build_exchange(stocks, state["bars"]["Close"][0],
+                               backend or str(state["backend"]), algo or str(state["algo"]), traders,
+                               decimals=int(state["decimals"]))
+    book = interface.book
+    orders = state["orders"]
+    for code, stock in enumerate(stocks):
+        for side_code, side in enumerate(SIDES):
+            rows = orders[(orders["Stock"] == code) & (orders["Side"] == side_code)]
+            book.book[stock][side].load(rows["Order_ID"], rows["Price"], rows["Quantity"])
+    for row in state["stops"].tolist():
+        order_id, code, side_code, trigger, q, trader_id, limit = row
+        book.stops.add(StopOrder(order_id, stocks[code], SIDES[side_code], trigger, q, trader_id,
+                                 None if np.isnan(limit) else limit))
+    book.order_trader = array("q", state["order_trader"].tobytes())
+    book.order_stock = array("i", state["order_stock"].tobytes())
+    book.order_side = array("b", state["order_side"].tobytes())
+    for code, side_code in zip(state["dirty_stock"].tolist(), state["dirty_side"].tolist()):
+        book.matching_engine.dirty[stocks[code]] = SIDES[side_code]
+
+    trade_rep = interface.trade_reporter
+    tape = state["tape"]
+    trade_rep.tape.extend({name: tape[name] for name in tape.dtype.names}, len(tape))
+    trade_rep.tape.offset = int(state.get("tape_offset", 0))
+    bars = trade_rep.bars
+    bars.buffer.clear()
+    saved_bars = state["bars"]
+    bars.buffer.extend({name: saved_bars[name] for name in saved_bars.dtype.names}, len(saved_bars))
+    bars.buffer.offset = int(state.get("bars_offset", 0))
+    # last_prices of the trade reporter is the close array of the bar store, it is filled in place
+    bars.close[:] = state["bar_close"]
+    bars.open = state["bar_open"].copy()
+    bars.high = state["bar_high"].copy()
+    bars.low = state["bar_low"].copy()
+    bars.volume = state["bar_volume"].copy()
+    bars.notional = state["bar_notional"].copy()
+    bars.trades = state["bar_trades"].copy()
+
+    bounds = np.concatenate([[0], np.cumsum(state["fill_counts"])])
+    fills = state["fills"]
+    for i, t in enumerate(traders):
+        t.start_capital = float(state["start_capital"][i])
+        t.cash = float(state["cash"][i])
+        t.stock_value = float(state["stock_value"][i])
+        t.positions[:] = state["positions"][i]
+        t.marks[:] = state["marks"][i]
+        t.fills.clear()
+        part = fills[bounds[i]:bounds[i+1]]
+        t.fills.extend({name: part[name] for name in part.dtype.names}, len(part))
+        if "fill_offsets" in state:
+            t.fills.offset = int(state["fill_offsets"][i])
+    restore_risk(interface, state)
+    return interface
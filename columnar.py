@@ -0,0 +1,120 @@
+#####################################################################
+#
+# Append-only columnar buffer backed by a typed NumPy structured
+# array that doubles its capacity whenever it runs full, or hands its
+# oldest rows to a writer if it is bounded
+#
+#####################################################################
+
+import numpy as np
+
+
+class ColumnBuffer:
+
+    def __init__(self, dtype, capacity=1024):
+        """
+        growable table with fixed column types
+        @param dtype: list of (name, type) tuples or np.dtype: columns of the buffer
+        @param capacity: int: number of rows allocated up front
+        """
+        self.dtype = np.dtype(dtype)
+        self.data = np.empty(max(int(capacity), 1), dtype=self.dtype)
+        self.n = 0
+        # rows dropped from the front, row i of the buffer is row offset + i of the whole table
+        self.offset = 0
+        # callable that takes the oldest rows of a full bounded buffer, None if the buffer grows
+        self.writer = None
+        self.window = None
+
+    def __len__(self):
+        return self.n
+
+    def reserve(self, n):
+        """
+        makes room for n more rows, doubling the capacity (amortized O(1) per row).
+        A full bounded buffer first writes and drops all but its newest window rows
+        """
+        needed = self.n + n
+        if needed > len(self.data) and self.writer is not None and self.n > self.window:
+            spilled = self.n - self.window
+            self.writer(self.data[:spilled])
+            self.drop(spilled)
+            needed = self.n + n
+        if needed > len(self.data):
+            data = np.empty(max(2*len(self.data), needed), dtype=self.dtype)
+            data[:self.n] = self.data[:self.n]
+            self.data = data
+        return None
+
+    def append(self, row):
+        """
+        appends one row
+        @param row: tuple: one value per column in column order
+        """
+        if self.n == len(self.data):
+            self.reserve(1)
+        self.data[self.n] = row
+        self.n += 1
+        return None
+
+    def extend(self, columns, n=None):
+        """
+        appends many rows at once
+        @param columns: dict: column name -> array-like or scalar, missing columns are set to 0
+        @param n: int: number of rows, taken from the first array column if None
+        """
+        if n is None:
+            n = next(len(v) for v in columns.values() if np.ndim(v) > 0)
+        if n == 0:
+            return None
+        self.reserve(n)
+        rows = self.data[self.n:self.n+n]
+        for name in self.dtype.names:
+            rows[name] = columns.get(name, 0)
+        self.n += n
+        return None
+
+    def view(self):
+        """
+        returns the filled rows as structured array without copying.
+        The view is only valid until the next append that grows the buffer
+        """
+        return self.data[:self.n]
+
+    def column(self, name):
+        return self.data[name][:self.n]
+
+    def clear(self):
+        self.n = 0
+        return None
+
+    def drop(self, n):
+        """
+        removes the oldest n rows
+        """
+        self.data[:self.n-n] = self.data[n:self.n]
+        self.n -= n
+        self.offset += n
+        return None
+
+    def bound(self, writer, window, chunk):
+        """
+        keeps at most window + chunk rows in memory. Once the buffer is full, all but the
+        newest window rows are handed to writer in one chunk and dropped
+        @param writer: callable: takes a structured array of the oldest rows, e.g. a SegmentWriter
+        @param window: int: newest rows that always stay in memory
+        @param chunk: int: rows written at once
+        """
+        data = np.empty(max(window + chunk, self.n), dtype=self.dtype)
+        data[:self.n] = self.data[:self.n]
+        self.data = data
+        self.writer = writer
+        self.window = window
+        return None
+
+    def to_frame(self):
+        """
+        copies the filled rows into a pandas DataFrame
+        """
+        import pandas as pd
+        return pd.DataFrame(self.view())
@@ -0,0 +1,53 @@
+#####################################################################
+#
+# Builds and connects all exchange components (orderbook, matching
+# engine, trade reporter, trader-exchange interface) in one call
+#
+#####################################################################
+
+import contextlib
+import io
+
+import matching_engine
+import orderbook
+import TE_interface
+import trade_reporter
+
+
+def build_exchange(stocks, starting_prices, backend="levels", algo="pro rata", traders=(), verbose=False, decimals=4):
+    """
+    creates orderbook, matching engine, trade reporter and interface and connects them
+    the same way as the 'trading_sim_tests.py' script does
+    @param stocks: array-like: names of all traded stocks
+    @param starting_prices: array-like: price of each stock before the first trade
+    @param backend: string: orderbook backend, "levels" or "dataframe"
+    @param algo: string: matching algorithm, "pro rata" or "fifo"
+    @param traders: list: Trader objects to connect to the interface
+    @param verbose: bool: show the connection messages of the components
+    @param decimals: int: number of decimals prices are rounded to (levels backend)
+    @return: Interface: connected interface, the other components are reachable through it
+    """
+    stocks = list(stocks)
+    out = contextlib.nullcontext() if verbose else contextlib.redirect_stdout(io.StringIO())
+    with out:
+        me = matching_engine.Matching_Engine(algo)
+        ob = orderbook.Orderbook(stocks, decimals=decimals, backend=backend)
+        trade_rep = trade_reporter.TradeReporter(stocks, starting_prices)
+        interface = TE_interface.Interface()
+
+        interface.connect_orderbook(ob)
+        interface.connect_trade_reporter(trade_rep)
+        for trader in traders:
+            trader.connect_interface(interface)
+        if traders:
+            interface.connect_trader(list(traders))
+
+        ob.connect_matching_engine(me)
+        ob.connect_trade_reporter(trade_rep)
+
+        me.connect_orderbook(ob)
+        me.connect_interface(interface)
+        me.connect_trade_reporter(trade_rep)
+
+        trade_rep.connect_interface(interface)
+    return interface
@@ -0,0 +1,179 @@
+#####################################################################
+#
+# DataFrame book side keeps the resting orders of one side of one
+# stock in a pandas DataFrame (original orderbook layout)
+#
+#####################################################################
+
+import numpy as np
+import pandas as pd
+import math
+
+from price_levels import BookEntry, DEPTH_DTYPE
+
+
+class FrameSide:
+
+    def __init__(self, side, decimals=4):
+        """
+        one side of the orderbook of one stock stored as DataFrame with
+        a sentinel row (Order_ID -1) at -inf (bid) or inf (ask)
+        @param side: string: "bid" or "ask"
+        @param decimals: int: unused, prices are stored as sent
+        """
+        if side not in ["bid", "ask"]:
+            raise ValueError("Invalid side %s. Use 'bid' or 'ask'."%side)
+        self.side = side
+        self.decimals = decimals
+        self.empty_price = -math.inf if side == "bid" else math.inf
+        self.frame = pd.DataFrame([[self.empty_price, 0, -1]],
+                                  columns = ["Price",
+                                             "Quantity",
+                                             "Order_ID"]).set_index("Order_ID")
+        # cached best price, None after the best order may have left the book
+        self._best = self.empty_price
+        # counts changes of the side, the depth snapshot is rebuilt only after a change
+        self.version = 0
+        self._depth = None
+        self._depth_version = -1
+
+    def __len__(self):
+        return len(self.frame) - 1
+
+    def __contains__(self, order_id):
+        return order_id != -1 and order_id in self.frame.index
+
+    def add(self, order_id, price, quantity):
+        new_order = pd.DataFrame([[price, quantity, order_id]],
+                                 columns = ["Price", "Quantity", "Order_ID"]).set_index("Order_ID")
+        self.frame = pd.concat([self.frame, new_order])
+        self.version += 1
+        if self._best is not None:
+            self._best = max(self._best, price) if self.side == "bid" else min(self._best, price)
+        return None
+
+    def best_index(self):
+        if self.side == "bid":
+            return self.frame.Price.idxmax()
+        return self.frame.Price.idxmin()
+
+    def best_price(self):
+        if self._best is None:
+            self._best = self.frame.Price.max() if self.side == "bid" else self.frame.Price.min()
+        return self._best
+
+    def best(self):
+        order_id = self.best_index()
+        return BookEntry(order_id,
+                         self.frame.loc[order_id, "Price"],
+                         self.frame.loc[order_id, "Quantity"])
+
+    def best_level_quantity(self):
+        if len(self) == 0:
+            return 0
+        return self.frame.Quantity[self.frame.Price == self.best_price()].sum()
+
+    def total_quantity(self):
+        return self.frame.Quantity.sum()
+
+    def quantity_through(self, price):
+        if self.side == "bid":
+            return self.frame.Quantity[self.frame.Price >= price].sum()
+        return self.frame.Quantity[self.frame.Price <= price].sum()
+
+    def order_ids(self):
+        return list(self.frame.index[self.frame.index != -1])
+
+    def fill(self, order_id, quantity):
+        self.frame.loc[order_id, "Quantity"] -= quantity
+        self.version += 1
+        if self.frame.loc[order_id, "Quantity"] == 0 and order_id != -1:
+            self.frame.drop(order_id, inplace = True)
+            self._best = None
+        return None
+
+    def entry(self, order_id):
+        return BookEntry(order_id,
+                         self.frame.loc[order_id, "Price"],
+                         self.frame.loc[order_id, "Quantity"])
+
+    def level_orders(self, price):
+        level = self.frame[(self.frame.Price == price) & (self.frame.index != -1)]
+        return list(level.index), level.Quantity.values.copy()
+
+    def fill_level(self, price, order_ids, fills):
+        self.frame.loc[order_ids, "Quantity"] -= fills
+        self.version += 1
+        done = [order_ids[i] for i in np.flatnonzero(self.frame.loc[order_ids, "Quantity"].values == 0)]
+        if done:
+            self.frame.drop(done, inplace = True)
+            self._best = None
+        return None
+
+    def remove(self, order_id):
+        if order_id not in self:
+            return None
+        entry = self.entry(order_id)
+        self.frame.drop(order_id, inplace = True)
+        self.version += 1
+        self._best = None
+        return entry
+
+    def modify(self, order_id, price=None, quantity=None):
+        if order_id not in self:
+            return None
+        self.version += 1
+        if price is not None:
+            self.frame.loc[order_id, "Price"] = price
+            self._best = None
+        if quantity is not None:
+            self.frame.loc[order_id, "Quantity"] = quantity
+        return None
+
+    def resting_orders(self):
+        """
+        returns all live orders in time priority
+        @return: tuple of np.arrays: order ids, prices, quantities
+        """
+        live = self.frame.index.values != -1
+        return (self.frame.index.values[live].astype(np.int64),
+                self.frame.Price.values[live].astype(np.float64),
+                self.frame.Quantity.values[live].astype(np.int64))
+
+    def load(self, order_ids, prices, quantities):
+        """
+        adds many orders in the given order with one concat
+        """
+        new_orders = pd.DataFrame({"Price": prices, "Quantity": quantities,
+                                   "Order_ID": order_ids}).set_index("Order_ID")
+        self.frame = pd.concat([self.frame, new_orders])
+        self.version += 1
+        self._best = None
+        return None
+
+    def depth(self, levels=None):
+        """
+        aggregated quantity and order count per price level, cached until the side changes
+        @param levels: int or None: number of levels from the best price, all levels if None
+        @return: np.array: read-only structured array with DEPTH_DTYPE rows from best to worst price
+        """
+        if self._depth_version != self.version:
+            live = self.frame.index.values != -1
+            prices, inverse = np.unique(self.frame.Price.values[live], return_inverse=True)
+            depth = np.empty(len(prices), dtype=DEPTH_DTYPE)
+            depth["Price"] = prices
+            depth["Quantity"] = np.bincount(inverse, self.frame.Quantity.values[live], len(prices))
+            depth["Orders"] = np.bincount(inverse, minlength=len(prices))
+            if self.side == "bid":
+                depth = depth[::-1]
+            depth.flags.writeable = False
+            self._depth = depth
+            self._depth_version = self.version
+        return self._depth[:levels]
+
+    def to_frame(self):
+        """
+        returns a copy of the side sorted by price, the stored frame keeps its time priority
+        """
+        ascending = [self.side == "ask", False]
+        return self.frame.sort_values(["Price", "Quantity"], ascending = ascending)
@@ -0,0 +1,391 @@
+#####################################################################
+#
+# Gateway lets agents in other processes trade over TCP or Unix
+# sockets. It speaks a framed binary protocol, collects the orders of
+# all connected clients into micro-batches for the interface and
+# pushes fills back to the clients
+#
+#####################################################################
+
+import asyncio
+import contextlib
+import io
+import itertools
+import struct
+import numpy as np
+
+import trader
+
+# every frame is one message type byte followed by the fixed-size body of that type
+LOGIN = 1        # start capital
+LOGIN_ACK = 2    # trader id, number of stocks
+ORDER = 3        # client reference, stock index, side (0 bid, 1 ask), type (0 limit, 1 market), price, quantity
+ACK = 4          # client reference, order id (-1 if rejected), filled quantity, average fill price
+CANCEL = 5       # client reference, order id
+CANCEL_ACK = 6   # client reference, order id, 1 if cancelled
+FILL = 7         # stock index, direction (1 buy, -1 sell), price, quantity
+MESSAGES = {LOGIN: struct.Struct("<d"),
+            LOGIN_ACK: struct.Struct("<qi"),
+            ORDER: struct.Struct("<Iibbdq"),
+            ACK: struct.Struct("<Iqqd"),
+            CANCEL: struct.Struct("<Iq"),
+            CANCEL_ACK: struct.Struct("<Iqb"),
+            FILL: struct.Struct("<ibdq")}
+SIDES = np.array(["bid", "ask", ""])
+TYPES = np.array(["limit", "market", ""])
+DIRECTIONS = {"buy": 1, "sell": -1}
+
+
+def pack(message, *fields):
+    return bytes([message]) + MESSAGES[message].pack(*fields)
+
+
+async def read_message(reader):
+    """
+    reads one frame
+    @return: tuple: message type and tuple of fields
+    """
+    message = (await reader.readexactly(1))[0]
+    if message not in MESSAGES:
+        raise ValueError("Unknown message type %i."%message)
+    return message, MESSAGES[message].unpack(await reader.readexactly(MESSAGES[message].size))
+
+
+class RemoteTrader(trader.Trader):
+    """
+    ledger of an agent connected through the gateway. Fills are booked like for
+    every Trader and written to the socket of the agent
+    """
+
+    def __init__(self, session, start_capital=1000000):
+        super().__init__(start_capital)
+        self.session = session
+
+    def filled_order_info(self, stock, p, q, direction):
+        super().filled_order_info(stock, p, q, direction)
+        self.session.send(pack(FILL, self.stock_index[stock], DIRECTIONS[direction], p, q))
+        return None
+
+
+class Session:
+
+    def __init__(self, gateway, writer):
+        self.gateway = gateway
+        self.writer = writer
+        self.trader = None
+        self.task = None
+        # ids of the limit orders of the session that may still rest in the book
+        self.orders = set()
+        # size of orders after which the filled and cancelled orders are dropped
+        self.live_orders = 64
+
+    def send(self, frame):
+        """
+        writes a frame without waiting. Clients that do not read their messages are
+        disconnected once max_buffer bytes wait for them, so they never block the exchange
+        """
+        if self.writer is None or self.writer.transport.is_closing():
+            return None
+        self.writer.write(frame)
+        if self.writer.transport.get_write_buffer_size() > self.gateway.max_buffer:
+            self.close()
+        return None
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+        return None
+
+
+class Gateway:
+
+    def __init__(self, interface, batch_size=4096, batch_interval=0.001, max_buffer=1 << 20):
+        """
+        @param interface: Interface: connected exchange
+        @param batch_size: int: maximum number of orders per batch
+        @param batch_interval: float: seconds the gateway waits for more orders once
+                               the first order of a batch arrived
+        @param max_buffer: int: bytes of unsent messages after which a client is disconnected
+        """
+        self.interface = interface
+        self.batch_size = batch_size
+        self.batch_interval = batch_interval
+        self.max_buffer = max_buffer
+        self.orders = []
+        self.cancels = []
+        self.arrived = None
+        self.servers = []
+        self.sessions = set()
+        self.batcher = None
+        self.batches = 0
+
+    async def start(self, host="127.0.0.1", port=0, path=None, backlog=4096):
+        """
+        starts listening on a TCP port or, if path is given, on a Unix socket
+        @param port: int: TCP port, 0 picks a free port
+        @param backlog: int: connections that may wait to be accepted, thousands of
+                        agents starting at once need a long queue
+        @return: asyncio.Server
+        """
+        if path is not None:
+            server = await asyncio.start_unix_server(self.handle_client, path, backlog=backlog)
+        else:
+            server = await asyncio.start_server(self.handle_client, host, port, backlog=backlog)
+        self.servers.append(server)
+        if self.batcher is None:
+            self.arrived = asyncio.Event()
+            self.batcher = asyncio.ensure_future(self.run_batches())
+        return server
+
+    async def close(self):
+        for server in self.servers:
+            server.close()
+            await server.wait_closed()
+        tasks = [session.task for session in self.sessions if session.task is not None]
+        for session in list(self.sessions):
+            session.close()
+        # the client handlers see the closed sockets and cancel the orders of their sessions
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if self.batcher is not None:
+            self.batcher.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self.batcher
+            self.batcher = None
+        return None
+
+    async def handle_client(self, reader, writer):
+        session = Session(self, writer)
+        session.task = asyncio.current_task()
+        self.sessions.add(session)
+        try:
+            while session.writer is not None:
+                message, fields = await read_message(reader)
+                if message == LOGIN:
+                    self.login(session, *fields)
+                elif session.trader is None:
+                    break
+                elif message == ORDER:
+                    self.orders.append((session,) + fields)
+                    self.arrived.set()
+                elif message == CANCEL:
+                    self.cancels.append((session,) + fields)
+                    self.arrived.set()
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            self.sessions.discard(session)
+            session.close()
+            self.disconnect(session)
+        return None
+
+    def disconnect(self, session):
+        """
+        drops the orders of a disconnected session that wait for the next batch and
+        cancels its resting orders, so no orders of an agent that is gone stay live
+        """
+        self.orders = [order for order in self.orders if order[0] is not session]
+        self.cancels = [cancel for cancel in self.cancels if cancel[0] is not session]
+        if session.orders:
+            self.interface.cancel_many(list(session.orders))
+            session.orders.clear()
+        return None
+
+    def login(self, session, start_capital):
+        """
+        registers a new trader for the session, every login gets a new trader id
+        """
+        if session.trader is None:
+            remote = RemoteTrader(session, start_capital)
+            with contextlib.redirect_stdout(io.StringIO()):
+                remote.connect_interface(self.interface)
+                self.interface.connect_trader([remote])
+            session.trader = remote
+        session.send(pack(LOGIN_ACK, session.trader.trader_id, len(self.interface.book.stock_list)))
+        return None
+
+    async def run_batches(self):
+        """
+        waits for orders, gives late orders batch_interval seconds to join the batch
+        and sends everything that arrived to the exchange at once
+        """
+        while True:
+            await self.arrived.wait()
+            if len(self.orders) < self.batch_size:
+                await asyncio.sleep(self.batch_interval)
+            self.arrived.clear()
+            try:
+                self.process_batch()
+            except Exception as e:
+                print("Batch %i failed: %r"%(self.batches, e))
+        return None
+
+    def process_batch(self):
+        """
+        cancels first, then all new orders as one submit_batch. Results are sent as
+        acknowledgements, fills are written by the RemoteTrader ledgers during matching.
+        If the exchange raises, the error is printed and the cancels that were not done
+        are refused. Orders of the batch that already entered the book are cancelled
+        again before all orders of the batch are rejected, so no rejected order stays live
+        """
+        cancels, self.cancels = self.cancels, []
+        orders, self.orders = self.orders[:self.batch_size], self.orders[self.batch_size:]
+        if self.orders:
+            self.arrived.set()
+        book = self.interface.book
+        self.batches += 1
+        done = []
+        try:
+            for session, ref, order_id in cancels:
+                own = 0 <= order_id < len(book.order_trader) and book.order_trader[order_id] == session.trader.trader_id
+                done.append(bool(own and self.interface.cancel(order_id)))
+                if done[-1]:
+                    session.orders.discard(order_id)
+        except Exception as e:
+            print("Batch %i failed, its remaining cancels are refused: %r"%(self.batches, e))
+        for (session, ref, order_id), cancelled in itertools.zip_longest(cancels, done, fillvalue=False):
+            session.send(pack(CANCEL_ACK, ref, order_id, int(cancelled)))
+        if not orders:
+            return None
+        first = len(book.order_trader)
+        try:
+            results = self.submit_orders(orders)
+        except Exception as e:
+            print("Batch %i failed, its orders are rejected: %r"%(self.batches, e))
+            self.withdraw(orders, first)
+            results = [-1]*len(orders), [0]*len(orders), [float("nan")]*len(orders)
+        for (session, ref, code, side, order_type, p, quantity), order_id, q, avg in zip(orders, *results):
+            if order_id >= 0 and order_type == 0 and q < quantity:
+                self.track(session, order_id)
+            session.send(pack(ACK, ref, order_id, int(q), avg))
+        return None
+
+    def withdraw(self, orders, first):
+        """
+        cancels the orders of a failed batch that were registered from order id first on
+        """
+        traders = {session.trader.trader_id for session, *_ in orders}
+        order_trader = self.interface.book.order_trader
+        order_ids = [i for i in range(first, len(order_trader)) if order_trader[i] in traders]
+        if order_ids:
+            self.interface.cancel_many(order_ids)
+        return None
+
+    def track(self, session, order_id):
+        """
+        remembers a resting order of a session. Orders that were filled or cancelled in
+        the meantime are dropped whenever the set has doubled, so it stays as large as
+        the number of live orders of the session
+        """
+        session.orders.add(order_id)
+        if len(session.orders) > session.live_orders:
+            book = self.interface.book
+            live = set()
+            for i in session.orders:
+                stock, side = book.locate_order(i)
+                if i in book.book[stock][side]:
+                    live.add(i)
+            session.orders = live
+            session.live_orders = max(2*len(live), 64)
+        return None
+
+    def submit_orders(self, orders):
+        """
+        sends the orders of a batch to the exchange as one submit_batch
+        @return: tuple of lists: order ids, filled quantities and average fill prices
+        """
+        book = self.interface.book
+        sessions, refs, codes, sides, types, prices, quantities = zip(*orders)
+        codes = np.array(codes)
+        valid = (codes >= 0) & (codes < len(book.stock_list))
+        stocks = np.where(valid, np.asarray(book.stock_list)[np.where(valid, codes, 0)], "")
+        # unknown codes map to "" and are rejected by submit_batch
+        sides = SIDES[np.where(np.isin(sides, [0, 1]), sides, 2)]
+        types = TYPES[np.where(np.isin(types, [0, 1]), types, 2)]
+        trader_ids = [s.trader.trader_id for s in sessions]
+        order_ids, filled, avg_price = self.interface.submit_batch(stocks, sides, types, np.array(prices),
+                                                                   np.array(quantities), trader_ids)
+        return order_ids.tolist(), filled.tolist(), avg_price.tolist()
+
+
+class GatewayClient:
+    """
+    minimal client of the gateway protocol, e.g. as stand-in for an agent process in tests
+    """
+
+    def __init__(self):
+        self.reader = None
+        self.writer = None
+        self.trader_id = None
+        self.n_stocks = None
+        self.fills = asyncio.Queue()
+        self.pending = {}
+        self.refs = itertools.count()
+        self.listener = None
+
+    async def connect(self, host="127.0.0.1", port=None, path=None, start_capital=1000000):
+        """
+        connects over TCP or a Unix socket and logs in
+        @return: int: trader id on the exchange
+        """
+        if path is not None:
+            self.reader, self.writer = await asyncio.open_unix_connection(path)
+        else:
+            self.reader, self.writer = await asyncio.open_connection(host, port)
+        self.writer.write(pack(LOGIN, start_capital))
+        message, fields = await read_message(self.reader)
+        if message != LOGIN_ACK:
+            raise ConnectionError("Expected a login acknowledgement, got message type %i."%message)
+        self.trader_id, self.n_stocks = fields
+        self.listener = asyncio.ensure_future(self.listen())
+        return self.trader_id
+
+    async def listen(self):
+        try:
+            while True:
+                message, fields = await read_message(self.reader)
+                if message == FILL:
+                    self.fills.put_nowait(fields)
+                elif message in (ACK, CANCEL_ACK):
+                    future = self.pending.pop(fields[0], None)
+                    if future is not None and not future.done():
+                        future.set_result(fields[1:])
+        except (asyncio.IncompleteReadError, ConnectionError):
+            for future in self.pending.values():
+                if not future.done():
+                    future.set_exception(ConnectionError("Gateway closed the connection."))
+        return None
+
+    def request(self, message, *fields):
+        ref = next(self.refs) & 0xFFFFFFFF
+        future = asyncio.get_running_loop().create_future()
+        self.pending[ref] = future
+        self.writer.write(pack(message, ref, *fields))
+        return future
+
+    def order(self, stock, side, q, p=float("nan"), order_type="limit"):
+        """
+        sends an order without waiting for the batch
+        @param stock: int: index of the stock
+        @param side: string: "bid" or "ask"
+        @return: asyncio.Future: resolves to (order id, filled quantity, average fill price)
+        """
+        return self.request(ORDER, stock, 0 if side == "bid" else 1,
+                            0 if order_type == "limit" else 1, p, q)
+
+    def cancel(self, order_id):
+        """
+        @return: asyncio.Future: resolves to (order id, 1 if cancelled else 0)
+        """
+        return self.request(CANCEL, order_id)
+
+    async def close(self):
+        if self.listener is not None:
+            self.listener.cancel()
+        if self.writer is not None:
+            self.writer.close()
+            try:
+                await self.writer.wait_closed()
+            except ConnectionError:
+                pass
+        return None
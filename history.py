@@ -0,0 +1,156 @@
+#####################################################################
+#
+# History sink keeps a bounded window of the trade tape, the period
+# bars and the fills of every trader in memory and spills older rows
+# in chunks to .npy segments with a JSON index, so memory stays flat
+# however long a run is. Segments are read back memory-mapped
+#
+#####################################################################
+
+import json
+import os
+import numpy as np
+
+
+def index_path(directory, name):
+    return os.path.join(directory, "%s.index.json"%name)
+
+
+def read_index(directory, name):
+    """
+    @return: list of dicts: file, first row and number of rows of every segment of a table
+    """
+    path = index_path(directory, name)
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return json.load(f)["segments"]
+
+
+def iter_history(directory, name, mmap=True):
+    """
+    streams a spilled table segment by segment
+    @param mmap: bool: memory-map the segments instead of reading them into memory
+    @return: generator of structured np.arrays
+    """
+    for segment in read_index(directory, name):
+        yield np.load(os.path.join(directory, segment["file"]), mmap_mode="r" if mmap else None)
+
+
+def read_history(directory, name, start=0, stop=None):
+    """
+    reads rows [start, stop) of a spilled table, only the segments that overlap are opened
+    @return: structured np.array
+    """
+    parts = []
+    for segment in read_index(directory, name):
+        first, rows = segment["start"], segment["rows"]
+        if first + rows <= start or (stop is not None and first >= stop):
+            continue
+        data = np.load(os.path.join(directory, segment["file"]), mmap_mode="r")
+        end = rows if stop is None else min(rows, stop - first)
+        parts.append(data[max(start - first, 0):end])
+    if not parts:
+        return None
+    return np.concatenate(parts)
+
+
+class SegmentWriter:
+
+    def __init__(self, directory, name, start=0):
+        """
+        writes chunks of one table as numbered .npy segments. The index is rewritten after
+        every segment, so a crashed run leaves a readable history behind
+        @param directory: string: directory of the segments
+        @param name: string: name of the table, e.g. "trades"
+        @param start: int: number of the first row that is written
+        """
+        self.directory = directory
+        self.name = name
+        self.segments = []
+        self.rows = start
+
+    def __call__(self, rows):
+        """
+        @param rows: structured np.array: next rows of the table
+        """
+        file = "%s-%06i.npy"%(self.name, len(self.segments))
+        np.save(os.path.join(self.directory, file), rows)
+        self.segments.append({"file": file, "start": self.rows, "rows": len(rows)})
+        self.rows += len(rows)
+        path = index_path(self.directory, self.name)
+        with open(path + ".tmp", "w") as f:
+            json.dump({"name": self.name, "rows": self.rows, "segments": self.segments}, f)
+        os.replace(path + ".tmp", path)
+        return None
+
+
+class HistorySink:
+
+    def __init__(self, directory, window=65536, chunk=65536, bar_window=256, bar_chunk=256):
+        """
+        tables: "trades" (trade tape), "bars" (period bars, row 0 holds the starting prices)
+        and "fills_<trader id>" (fills of one trader)
+        @param directory: string: directory of the segments, created if missing
+        @param window: int: newest trades and fills per trader that stay in memory
+        @param chunk: int: trades or fills per segment
+        @param bar_window: int: newest periods that stay in memory, at least as many as
+                           the traders look back with last_bars
+        @param bar_chunk: int: periods per segment
+        """
+        self.directory = directory
+        self.window = window
+        self.chunk = chunk
+        self.bar_window = bar_window
+        self.bar_chunk = bar_chunk
+        self.buffers = {}
+        os.makedirs(directory, exist_ok=True)
+
+    def connect_interface(self, interface):
+        try:
+            self.interface = interface
+            trade_rep = interface.trade_reporter
+            self.attach("trades", trade_rep.tape, self.window, self.chunk)
+            self.attach("bars", trade_rep.bars.buffer, self.bar_window, self.bar_chunk)
+            for trader in interface.traders:
+                self.attach_trader(trader)
+            print("Connection to trader-exchange interface successful.")
+        except:
+            print("Could not connect to trader-exchange interface. Please try again.")
+        return None
+
+    def attach(self, name, buffer, window, chunk):
+        buffer.bound(SegmentWriter(self.directory, name, buffer.offset), window, chunk)
+        self.buffers[name] = buffer
+        return None
+
+    def attach_trader(self, trader):
+        self.attach("fills_%i"%trader.trader_id, trader.fills, self.window, self.chunk)
+        return None
+
+    def close(self):
+        """
+        spills everything that is still in memory, e.g. at the end of a run. The in-memory
+        windows are empty afterwards, so the exchange should not continue trading
+        """
+        for buffer in self.buffers.values():
+            if len(buffer):
+                buffer.writer(buffer.view())
+                buffer.drop(len(buffer))
+        return None
+
+    def read(self, name, start=0, stop=None):
+        """
+        rows [start, stop) of a table from the segments on disk and the window in memory
+        @return: structured np.array
+        """
+        buffer = self.buffers[name]
+        stop = buffer.offset + len(buffer) if stop is None else stop
+        parts = []
+        if start < buffer.offset:
+            spilled = read_history(self.directory, name, start, min(stop, buffer.offset))
+            if spilled is not None:
+                parts.append(spilled)
+        if stop > buffer.offset:
+            parts.append(buffer.view()[max(start - buffer.offset, 0):stop - buffer.offset])
+        return np.concatenate(parts) if parts else buffer.view()[:0]
@@ -0,0 +1,128 @@
+#####################################################################
+#
+# Metrics keep log-bucketed latency histograms per stage and stock
+# and counters of the exchange hot path. They are switched on by
+# connecting them to the orderbook and cost one None check when off
+#
+#####################################################################
+
+import json
+import numpy as np
+
+# stages, the latency of every call lands in bucket ns.bit_length(), i.e. [2^(b-1), 2^b) ns
+INSERT = 0
+EXECUTE_ORDER = 1
+EXECUTE_TRADE = 2
+REPORT = 3
+DELIVER = 4
+BATCH = 5
+STAGES = ["insert", "execute_order", "execute_trade", "report", "deliver", "batch"]
+BUCKETS = 64
+# counters per stock
+ORDERS = 0
+CANCELS = 1
+LEVELS_SWEPT = 2
+FILLS = 3
+COUNTERS = ["orders", "cancels", "levels_swept", "fills"]
+
+
+def bucket_percentile(buckets, p):
+    """
+    upper bound in ns of the bucket that holds the p-th percentile
+    """
+    total = buckets.sum()
+    if total == 0:
+        return None
+    b = int(np.searchsorted(np.cumsum(buckets), p/100*total))
+    return 2**b
+
+
+class Metrics:
+
+    def __init__(self, stocks, path=None):
+        """
+        @param stocks: array-like: names of all traded stocks
+        @param path: string or None: file that gets one JSON line per period snapshot
+        """
+        self.stocks = list(stocks)
+        # the extra last row collects stages that are not bound to one stock (index -1)
+        self.rows = len(self.stocks) + 1
+        # flat Python lists are cheaper to increment than NumPy arrays, they are
+        # only turned into arrays for snapshots
+        self.hist = [0]*(len(STAGES)*self.rows*BUCKETS)
+        self.counters = [0]*(len(COUNTERS)*self.rows)
+        self.path = path
+        self.period = 0
+        self.snapshots = []
+
+    def record(self, stage, code, ns):
+        """
+        @param stage: int: stage constant
+        @param code: int: index of the stock, -1 if the call is not bound to one stock
+        @param ns: int: latency in nanoseconds
+        """
+        self.hist[(stage*self.rows + code % self.rows)*BUCKETS + ns.bit_length()] += 1
+        return None
+
+    def count(self, counter, code, n=1):
+        self.counters[counter*self.rows + code] += n
+        return None
+
+    def reset(self):
+        self.hist = [0]*len(self.hist)
+        self.counters = [0]*len(self.counters)
+        return None
+
+    def histograms(self):
+        """
+        @return: np.array: bucket counts per stage, stock (last row: not bound to a stock) and bucket
+        """
+        return np.array(self.hist, dtype=np.int64).reshape(len(STAGES), self.rows, BUCKETS)
+
+    def stage_summary(self, buckets):
+        return {"count": int(buckets.sum()),
+                "p50_ns": bucket_percentile(buckets, 50),
+                "p90_ns": bucket_percentile(buckets, 90),
+                "p99_ns": bucket_percentile(buckets, 99),
+                "max_ns": 2**int(np.flatnonzero(buckets)[-1]) if buckets.any() else None}
+
+    def snapshot(self, book=None):
+        """
+        histograms and counters since the last reset as JSON-ready dict
+        @param book: Orderbook or None: adds the number of resting orders per side and stock
+        """
+        histograms = self.histograms()
+        counters = np.array(self.counters, dtype=np.int64).reshape(len(COUNTERS), self.rows)
+        stages = {}
+        for s, name in enumerate(STAGES):
+            hist = histograms[s]
+            if not hist.any():
+                continue
+            stage = self.stage_summary(hist.sum(axis=0))
+            stage["buckets"] = hist.sum(axis=0).tolist()
+            stage["stocks"] = {self.stocks[c]: self.stage_summary(hist[c])
+                               for c in np.flatnonzero(hist[:-1].any(axis=1)).tolist()}
+            stages[name] = stage
+        snapshot = {"period": self.period,
+                    "stages": stages,
+                    "counters": {name: dict(zip(self.stocks, counters[c, :-1].tolist()))
+                                 for c, name in enumerate(COUNTERS)}}
+        if book is not None:
+            snapshot["depth"] = {stock: {"bid_orders": len(book.book[stock]["bid"]),
+                                         "ask_orders": len(book.book[stock]["ask"])}
+                                 for stock in self.stocks}
+        return snapshot
+
+    def end_period(self, book=None):
+        """
+        stores the snapshot of the period, writes it to the JSON lines file and starts a new period
+        @return: dict: snapshot of the period
+        """
+        snapshot = self.snapshot(book)
+        self.snapshots.append(snapshot)
+        if self.path is not None:
+            with open(self.path, "a") as f:
+                f.write(json.dumps(snapshot) + "\n")
+        self.reset()
+        self.period += 1
+        return snapshot
@@ -0,0 +1,203 @@
+#####################################################################
+#
+# Event journal writes every accepted order, cancel, modify, fill and
+# period end as fixed-size binary record to an append-only file and
+# replays a journal through the orderbook and matching engine
+#
+#####################################################################
+
+import math
+import numpy as np
+
+# event codes
+LIMIT = 1
+MARKET = 2
+IOC = 3
+INSERT = 4
+STOP = 5
+MATCH = 6
+CANCEL = 7
+MODIFY = 8
+FILL = 9
+END_PERIOD = 10
+
+# one record per event. Side is 1 for bid/buy and -1 for ask/sell. Limit is the limit price of
+# stop limit orders, Taker_ID the aggressive order of a fill (Order_ID is the resting one)
+JOURNAL_DTYPE = np.dtype([("Seq", np.int64),
+                          ("Event", np.int8),
+                          ("Side", np.int8),
+                          ("Stock", np.int32),
+                          ("Order_ID", np.int64),
+                          ("Trader_ID", np.int64),
+                          ("Price", np.float64),
+                          ("Quantity", np.int64),
+                          ("Limit", np.float64),
+                          ("Taker_ID", np.int64)])
+MAGIC = b"MXJRNL01"
+HEADER_DTYPE = np.dtype([("Magic", "S8"), ("Record_Size", np.int32), ("Stocks", np.int32)])
+SIDE_CODES = {"bid": 1, "buy": 1, "ask": -1, "sell": -1}
+SIDES = {1: "bid", -1: "ask"}
+
+
+class EventJournal:
+
+    def __init__(self, path, n_stocks, buffer_size=65536):
+        """
+        opens a new journal file. Records are collected in a NumPy buffer and
+        written to the file in one call whenever the buffer runs full
+        @param path: string: file name of the journal
+        @param n_stocks: int: number of stocks of the orderbook, checked on replay
+        @param buffer_size: int: number of records written at once
+        """
+        self.path = path
+        self.file = open(path, "wb")
+        header = np.array([(MAGIC, JOURNAL_DTYPE.itemsize, n_stocks)], dtype=HEADER_DTYPE)
+        self.file.write(header.tobytes())
+        self.buffer = np.empty(max(int(buffer_size), 1), dtype=JOURNAL_DTYPE)
+        self.n = 0
+        self.seq = 0
+
+    def __len__(self):
+        return self.seq
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+    def record(self, event, stock=-1, side=0, order_id=-1, trader_id=-1,
+               price=math.nan, quantity=0, limit=math.nan, taker_id=-1):
+        """
+        appends one event
+        @param stock: int: index of the stock, -1 if the event is not bound to a stock
+        @param side: string or int: "bid"/"ask"/"buy"/"sell" or 1/-1
+        """
+        if self.n == len(self.buffer):
+            self.flush()
+        self.buffer[self.n] = (self.seq, event, SIDE_CODES.get(side, side), stock, order_id,
+                               trader_id, price, quantity, limit, taker_id)
+        self.n += 1
+        self.seq += 1
+        return None
+
+    def record_fills(self, stock, price, quantities, side, maker_ids, taker_id):
+        """
+        appends the fills of one aggressive order against one price level at once
+        @param quantities: np.array: traded quantity per resting order
+        @param maker_ids: array-like: order ids of the resting orders
+        """
+        n = len(quantities)
+        if self.n + n > len(self.buffer):
+            self.flush()
+        if n > len(self.buffer):
+            self.buffer = np.empty(n, dtype=JOURNAL_DTYPE)
+        rows = self.buffer[self.n:self.n+n]
+        rows["Seq"] = np.arange(self.seq, self.seq + n)
+        rows["Event"] = FILL
+        rows["Side"] = SIDE_CODES.get(side, side)
+        rows["Stock"] = stock
+        rows["Order_ID"] = maker_ids
+        rows["Trader_ID"] = -1
+        rows["Price"] = price
+        rows["Quantity"] = quantities
+        rows["Limit"] = math.nan
+        rows["Taker_ID"] = taker_id
+        self.n += n
+        self.seq += n
+        return None
+
+    def flush(self):
+        """
+        writes all buffered records to the file
+        """
+        if self.n:
+            self.file.write(self.buffer[:self.n].tobytes())
+            self.n = 0
+        self.file.flush()
+        return None
+
+    def close(self):
+        if not self.file.closed:
+            self.flush()
+            self.file.close()
+        return None
+
+
+def read_journal(path):
+    """
+    memory-maps a journal file without reading it
+    @return: np.memmap: structured array of all records with JOURNAL_DTYPE
+    """
+    header = np.fromfile(path, dtype=HEADER_DTYPE, count=1)
+    if len(header) == 0 or header["Magic"][0] != MAGIC or header["Record_Size"][0] != JOURNAL_DTYPE.itemsize:
+        raise ValueError("%s is not an event journal of this version."%path)
+    return np.memmap(path, dtype=JOURNAL_DTYPE, mode="r", offset=HEADER_DTYPE.itemsize)
+
+
+def journal_stocks(path):
+    """
+    returns the number of stocks of the orderbook that wrote a journal
+    """
+    return int(np.fromfile(path, dtype=HEADER_DTYPE, count=1)["Stocks"][0])
+
+
+def replay(path, interface, on_period=None, keep_trader_ids=False, chunk_size=65536):
+    """
+    drives orderbook and matching engine of a freshly built exchange with the order flow
+    of a journal. Fills are not replayed, they follow from matching the same orders again.
+    Journal order ids are mapped to the ids handed out during the replay, so other traders
+    can send orders while the journal is replayed
+    @param path: string: file name of the journal
+    @param interface: Interface: connected exchange with the same stocks as the recorded one
+    @param on_period: callable or None: called with the period number after every end of period
+    @param keep_trader_ids: bool: send the orders under their recorded trader ids, otherwise
+                            all replayed orders are sent as random trader orders (-1)
+    @param chunk_size: int: records that are read from the journal at a time
+    @return: int: number of replayed periods
+    """
+    records = read_journal(path)
+    if journal_stocks(path) != len(interface.book.stock_list):
+        raise ValueError("The journal was recorded with %i stocks, the orderbook has %i."
+                         %(journal_stocks(path), len(interface.book.stock_list)))
+    book = interface.book
+    engine = book.matching_engine
+    stocks = book.stock_list
+    ids = np.full(int(records["Order_ID"].max(initial=0)) + 1, -1, dtype=np.int64)
+    periods = 0
+    for start in range(0, len(records), chunk_size):
+        chunk = records[start:start + chunk_size]
+        # plain Python lists are faster to walk record by record than the memory map,
+        # only one chunk is converted at a time so memory stays flat for long journals
+        columns = [chunk[name].tolist() for name in
+                   ["Event", "Side", "Stock", "Order_ID", "Trader_ID", "Price", "Quantity", "Limit"]]
+        for event, side, code, order_id, trader_id, price, q, limit in zip(*columns):
+            if event == FILL:
+                continue
+            if not keep_trader_ids:
+                trader_id = -1
+            if event == LIMIT:
+                ids[order_id] = engine.execute_order(stocks[code], SIDES[side], q, trader_id, price)[0]
+            elif event == MARKET:
+                ids[order_id] = engine.execute_order(stocks[code], SIDES[side], q, trader_id)[0]
+            elif event == IOC:
+                ids[order_id] = engine.execute_order(stocks[code], SIDES[side], q, trader_id, price, rest=False)[0]
+            elif event == INSERT:
+                ids[order_id] = book.insert_order(stocks[code], SIDES[side], price, q, trader_id)
+            elif event == STOP:
+                ids[order_id] = interface.stop_order(stocks[code], SIDES[side], price, q, trader_id,
+                                                     None if math.isnan(limit) else limit)
+            elif event == MATCH:
+                engine.check_trades(stocks[code] if code >= 0 else None)
+            elif event == CANCEL:
+                book.cancel_order(int(ids[order_id]))
+            elif event == MODIFY:
+                book.replace_order(int(ids[order_id]), None if math.isnan(price) else price, None if q < 0 else q)
+            elif event == END_PERIOD:
+                interface.trade_reporter.end_period()
+                periods += 1
+                if on_period is not None:
+                    on_period(periods)
+            interface.flush()
+    return periods
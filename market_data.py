@@ -0,0 +1,137 @@
+#####################################################################
+#
+# Market data bus publishes top of book, trades and depth of every
+# stock to its subscribers once the matching engine is done with an
+# order. Slow subscribers only keep the latest book update
+#
+#####################################################################
+
+from collections import deque, namedtuple
+import numpy as np
+
+TOPICS = ["top", "trades", "depth"]
+TopOfBook = namedtuple("TopOfBook", ["Bid", "Bid_Quantity", "Ask", "Ask_Quantity", "Last"])
+
+
+class Subscriber:
+
+    def __init__(self, topic, stock, callback=None, conflate=True, maxlen=None):
+        """
+        receives the updates of one topic of one stock, either through a callback or
+        through a queue that is read with poll
+        @param topic: string: "top", "trades" or "depth"
+        @param callback: callable or None: called with topic, stock and update
+        @param conflate: bool: keep only the latest update in the queue (book topics only,
+                         trades are never conflated)
+        @param maxlen: int or None: maximum number of queued trade updates, the oldest are dropped
+        """
+        self.topic = topic
+        self.stock = stock
+        self.callback = callback
+        self.conflate = conflate and topic != "trades"
+        self.queue = deque(maxlen=maxlen)
+        self.latest = None
+
+    def deliver(self, update):
+        if self.callback is not None:
+            self.callback(self.topic, self.stock, update)
+        elif self.conflate:
+            self.latest = update
+        else:
+            self.queue.append(update)
+        return None
+
+    def poll(self):
+        """
+        returns and removes all waiting updates
+        @return: list: updates in the order they were published, at most one if conflated
+        """
+        if self.conflate:
+            latest, self.latest = self.latest, None
+            return [] if latest is None else [latest]
+        updates = list(self.queue)
+        self.queue.clear()
+        return updates
+
+
+class MarketDataBus:
+
+    def __init__(self, depth_levels=5):
+        """
+        per stock topics for top of book, trades and depth. Updates are collected
+        from the trade tape and the book versions when the interface flushes after
+        an order, never from inside the matching loop
+        @param depth_levels: int: price levels per side in depth updates
+        """
+        self.depth_levels = depth_levels
+        self.subscribers = {topic: {} for topic in TOPICS}
+        self.published = 0
+        # (bid version, ask version) per stock at the last book update
+        self.versions = {topic: {} for topic in ["top", "depth"]}
+
+    def connect_interface(self, interface):
+        try:
+            self.interface = interface
+            self.published = interface.trade_reporter.tape.offset + len(interface.trade_reporter.tape)
+            print("Connection to trader-exchange interface successful.")
+        except:
+            print("Could not connect to trader-exchange interface. Please try again.")
+        return None
+
+    def subscribe(self, topic, stock, callback=None, conflate=True, maxlen=None):
+        """
+        @return: Subscriber: handle to poll updates and to unsubscribe
+        """
+        if topic not in TOPICS:
+            raise ValueError("Unknown topic %s. Choose from %s."%(topic, TOPICS))
+        if stock not in self.interface.book.stock_list:
+            raise ValueError("Unknown stock %s."%stock)
+        subscriber = Subscriber(topic, stock, callback, conflate, maxlen)
+        self.subscribers[topic].setdefault(stock, []).append(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        subscribers = self.subscribers[subscriber.topic].get(subscriber.stock, [])
+        if subscriber in subscribers:
+            subscribers.remove(subscriber)
+        if not subscribers:
+            self.subscribers[subscriber.topic].pop(subscriber.stock, None)
+            self.versions.get(subscriber.topic, {}).pop(subscriber.stock, None)
+        return None
+
+    def publish(self):
+        """
+        sends new trades and changed books to the subscribers of the stocks
+        """
+        book = self.interface.book
+        trade_rep = self.interface.trade_reporter
+        # published counts all trades ever reported, the tape may have spilled older ones
+        reported = trade_rep.tape.offset + len(trade_rep.tape)
+        if self.subscribers["trades"] and reported > self.published:
+            trades = trade_rep.trades()[max(self.published - trade_rep.tape.offset, 0):]
+            stocks = trade_rep.stocks
+            for code in np.unique(trades["Stock"]).tolist():
+                subscribers = self.subscribers["trades"].get(stocks[code])
+                if subscribers:
+                    update = trades[trades["Stock"] == code]
+                    for subscriber in subscribers:
+                        subscriber.deliver(update)
+        self.published = reported
+        for topic in ["top", "depth"]:
+            versions = self.versions[topic]
+            for stock, subscribers in self.subscribers[topic].items():
+                bid = book.book[stock]["bid"]
+                ask = book.book[stock]["ask"]
+                version = (bid.version, ask.version)
+                if versions.get(stock) == version:
+                    continue
+                versions[stock] = version
+                if topic == "top":
+                    update = TopOfBook(bid.best_price(), bid.best_level_quantity(),
+                                       ask.best_price(), ask.best_level_quantity(),
+                                       trade_rep.last_price(stock))
+                else:
+                    update = (bid.depth(self.depth_levels), ask.depth(self.depth_levels))
+                for subscriber in subscribers:
+                    subscriber.deliver(update)
+        return None
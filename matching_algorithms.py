@@ -0,0 +1,73 @@
+#####################################################################
+#
+# Matching algorithms split the quantity of an aggressive order over
+# all resting orders of one price level in a single vectorized step
+#
+#####################################################################
+
+import numpy as np
+
+
+class MatchingAlgorithm:
+    """
+    base class of all matching algorithms. allocate gets the resting
+    quantities of one price level in time priority and the quantity of
+    the aggressor and returns the fill of every resting order
+    """
+    name = None
+
+    def allocate(self, quantities, q):
+        raise NotImplementedError
+
+
+class FIFO(MatchingAlgorithm):
+    """
+    price-time priority: the oldest order at a level is filled first
+    """
+    name = "fifo"
+
+    def allocate(self, quantities, q):
+        """
+        @param quantities: np.array: resting quantities in time priority
+        @param q: int: quantity of the aggressive order
+        """
+        filled_before = np.cumsum(quantities) - quantities
+        return np.clip(q - filled_before, 0, quantities)
+
+
+class ProRata(MatchingAlgorithm):
+    """
+    pro rata: every order at a level gets a share of the aggressor that
+    is proportional to its size. Lots left over from rounding down go one
+    by one to the orders in time priority
+    """
+    name = "pro rata"
+
+    def allocate(self, quantities, q):
+        """
+        @param quantities: np.array: resting quantities in time priority
+        @param q: int: quantity of the aggressive order
+        """
+        total = quantities.sum()
+        if q >= total:
+            return quantities.copy()
+        fills = quantities*q//total
+        rest = q - fills.sum()
+        if rest > 0:
+            fills[np.flatnonzero(fills < quantities)[:int(rest)]] += 1
+        return fills
+
+
+ALGORITHMS = {algo.name: algo for algo in [FIFO, ProRata]}
+
+
+def get_algorithm(algo):
+    """
+    returns a matching algorithm instance
+    @param algo: string or MatchingAlgorithm: name of the algorithm ("fifo", "pro rata") or an instance
+    """
+    if isinstance(algo, MatchingAlgorithm):
+        return algo
+    if algo not in ALGORITHMS:
+        raise ValueError("Unknown matching algorithm %s. Choose from %s."%(algo, list(ALGORITHMS)))
+    return ALGORITHMS[algo]()
@@ -7,15 +7,25 @@
 #####################################################################
 
 import numpy as np
-import pandas as pd
 import math
+from time import perf_counter_ns
 
+from matching_algorithms import get_algorithm
+from journal import LIMIT, MARKET, IOC, MATCH
+import instrumentation
 
 
 class Matching_Engine:
     
     def __init__(self, algo="pro rata"):
-        self.algo = algo
+        """
+        @param algo: string or MatchingAlgorithm: "pro rata" or "fifo" or a custom algorithm
+        """
+        self.allocator = get_algorithm(algo)
+        self.algo = self.allocator.name
+        # stocks whose book may be crossed since the last matching run -> aggressor side
+        self.dirty = {}
+        self.releasing_stops = False
         
     def connect_orderbook(self, orderbook):
         try:
@@ -41,61 +51,181 @@ class Matching_Engine:
             print("Could not connect to trader-exchange interface. Please try again.")
         return None
     
-    def check_trades(self, stock=None):
+    def is_crossed(self, stock):
+        """
+        checks with the cached top of book if the best bid reaches the best ask.
+        Orders priced at +-inf (market orders) only cross a non-empty opposite side
+        """
+        bid = self.book.book[stock]["bid"].best_price()
+        ask = self.book.book[stock]["ask"].best_price()
+        return bid >= ask and bid > -math.inf and ask < math.inf
+    
+    def mark_dirty(self, stock, aggressor):
+        """
+        flags the book of a stock for matching if it got crossed by an added or
+        altered order. The first side that crossed the book stays the aggressor
+        until the book is matched
+        @param aggressor: string: side of the book that received the order
+        """
+        if self.is_crossed(stock):
+            self.dirty.setdefault(stock, aggressor)
+        return None
+    
+    def check_trades(self, stock=None, aggressor="bid"):
         """
         checks if orders can be matched and calls order execution
+        only books flagged by mark_dirty are checked if no stock is given
+        @param aggressor: string: side of the book that received the incoming order
         """
+        journal = self.book.journal
+        if journal is not None and (stock or self.dirty):
+            journal.record(MATCH, self.book.stock_index[stock] if stock else -1)
         if stock:
-            if self.book.book[stock]["bid"].Price.max() >= self.book.book[stock]["ask"].Price.min():
-                self.execute_trade(stock)
+            aggressor = self.dirty.pop(stock, aggressor)
+            if self.is_crossed(stock):
+                self.execute_trade(stock, aggressor)
         else:
-            for stock in self.book.stock_list:
-                if self.book.book[stock]["bid"].Price.max() >= self.book.book[stock]["ask"].Price.min():
-                    self.execute_trade(stock)
+            while self.dirty:
+                stock, aggressor = self.dirty.popitem()
+                if self.is_crossed(stock):
+                    self.execute_trade(stock, aggressor)
+        if self.book.stops.pending and not self.releasing_stops:
+            self.release_stops()
         return None
     
     def communicate_filled_order(self, order_id, stock, price, quantity, direction):
         """
-        sends order information of filled order to interface and trade reporter
+        sends order information of filled order to interface
         """
-        self.trade_reporter.new_filled_order(stock, price, quantity)
         self.interface.communicate_filled_order(order_id, stock, price, quantity, direction)
         return None
     
-    def update_orderbook(self, stock, q, ask_ID, bid_ID):
-        """
-        reduces quantity of bid and ask side for a given stock by the traded amount of units
-        """
-        self.book.book[stock]["ask"].loc[ask_ID, "Quantity"] -= q
-        self.book.book[stock]["bid"].loc[bid_ID, "Quantity"] -= q
-        if self.book.book[stock]["ask"].loc[ask_ID, "Quantity"] == 0:
-            if self.book.book[stock]["ask"].loc[ask_ID, "Price"] < math.inf:
-                self.book.book[stock]["ask"].drop(ask_ID, inplace = True)
-        if self.book.book[stock]["bid"].loc[bid_ID, "Quantity"] == 0:
-            if self.book.book[stock]["bid"].loc[bid_ID, "Price"] > -math.inf:
-                self.book.book[stock]["bid"].drop(bid_ID, inplace = True)
-        return None
+    def fill_against_level(self, stock, aggressor, taker_id, q):
+        """
+        fills q units of an aggressive order against the best price level of the opposite
+        side. The quantity is allocated over all resting orders of the level by the matching
+        algorithm and filled in bulk
+        @param aggressor: string: side of the aggressive order, "bid" or "ask"
+        @param taker_id: order id of the aggressive order
+        @param q: int: quantity to trade, at most the quantity of the level
+        @return: float: price of the level
+        """
+        passive = "ask" if aggressor == "bid" else "bid"
+        maker_side = self.book.book[stock][passive]
+        p = maker_side.best_price()
+        order_ids, quantities = maker_side.level_orders(p)
+        fills = self.allocator.allocate(quantities, q)
+        maker_side.fill_level(p, order_ids, fills)
+        # send trade info to trade reporter and interface
+        maker_direction = "sell" if passive == "ask" else "buy"
+        taker_direction = "buy" if aggressor == "bid" else "sell"
+        filled = np.flatnonzero(fills)
+        metrics = self.book.metrics
+        if metrics is not None:
+            code = self.book.stock_index[stock]
+            metrics.count(instrumentation.LEVELS_SWEPT, code)
+            metrics.count(instrumentation.FILLS, code, len(filled) + 1)
+        self.trade_reporter.new_filled_orders(stock, p, fills[filled], taker_direction,
+                                              [order_ids[i] for i in filled], taker_id)
+        for i in filled:
+            self.communicate_filled_order(order_ids[i], stock, p, fills[i], maker_direction)
+        self.communicate_filled_order(taker_id, stock, p, q, taker_direction)
+        return p
+    
+    def match_level(self, stock, aggressor):
+        """
+        matches the first order of the aggressor side against the complete best
+        price level of the opposite side
+        @param aggressor: string: "bid" or "ask"
+        @return: int: traded quantity
+        """
+        passive = "ask" if aggressor == "bid" else "bid"
+        taker_side = self.book.book[stock][aggressor]
+        taker = taker_side.best()
+        q = min(taker.Quantity, self.book.book[stock][passive].best_level_quantity())
+        self.fill_against_level(stock, aggressor, taker.Order_ID, q)
+        taker_side.fill(taker.Order_ID, q)
+        return q
         
-    def execute_trade(self, stock):
+    def execute_trade(self, stock, aggressor="bid"):
         """
         matches tradable orders, reduces quantities and send info to interface and trade reporter
+        trades happen at the price of the resting orders, one iteration per swept price level
+        @param aggressor: string: side of the book that received the incoming order
         """
-        while self.book.book[stock]["bid"].Price.max() >= self.book.book[stock]["ask"].Price.min():
-            # get filled trade info
-            ask_orderID = self.book.book[stock]["ask"].Price.idxmin()
-            bid_orderID = self.book.book[stock]["bid"].Price.idxmax()
-            q = min(self.book.book[stock]["ask"].loc[ask_orderID, "Quantity"],
-                    self.book.book[stock]["bid"].loc[bid_orderID, "Quantity"])
-            p = self.book.book[stock]["ask"].loc[ask_orderID, "Price"]
-            # send trade info to interface
-            self.communicate_filled_order(ask_orderID, stock, p, q, "sell")
-            self.communicate_filled_order(bid_orderID, stock, p, q, "buy")
-            # update orderbook
-            self.update_orderbook(stock, q, ask_orderID, bid_orderID)
+        metrics = self.book.metrics
+        if metrics is not None:
+            start = perf_counter_ns()
+        while self.is_crossed(stock):
+            self.match_level(stock, aggressor)
+        if metrics is not None:
+            metrics.record(instrumentation.EXECUTE_TRADE, self.book.stock_index[stock], perf_counter_ns() - start)
         return None
-            
-
-
-
     
-    
\ No newline at end of file
+    def execute_order(self, stock, side, q, trader_id, limit_price=None, rest=True, order_id=None):
+        """
+        executes an incoming order directly against the opposite side. The levels are walked
+        once from the best price until the order is filled, the limit price is reached or
+        the opposite side is empty. The rest of a limit order is added to the book, the rest
+        of a market order (no limit price) is dropped
+        @param side: string: "bid" or "ask"
+        @param q: int: number of shares
+        @param limit_price: float or None: worst acceptable price, None for market orders
+        @param rest: bool: add the rest of a limit order to the book, False for immediate-or-cancel
+        @param order_id: int or None: order id handed out before (stop orders), a new one if None
+        @return: tuple: order id, executed quantity, volume weighted average price (nan if nothing traded)
+        """
+        metrics = self.book.metrics
+        if metrics is not None:
+            start = perf_counter_ns()
+        if order_id is None:
+            order_id = self.book.register_order(trader_id, stock, side)
+            if self.book.journal is not None:
+                event = MARKET if limit_price is None else (LIMIT if rest else IOC)
+                self.book.journal.record(event, self.book.stock_index[stock], side, order_id, trader_id,
+                                         math.nan if limit_price is None else limit_price, q)
+        maker_side = self.book.book[stock]["ask" if side == "bid" else "bid"]
+        if limit_price is None:
+            limit_price = math.inf if side == "bid" else -math.inf
+        else:
+            # compare and rest at the price the book side stores, else the rest can cross the book
+            limit_price = round(limit_price, self.book.decimals)
+        sign = 1 if side == "bid" else -1
+        executed = 0
+        notional = 0.
+        while q > executed and len(maker_side) and sign*maker_side.best_price() <= sign*limit_price:
+            take = min(q - executed, maker_side.best_level_quantity())
+            p = self.fill_against_level(stock, side, order_id, take)
+            executed += take
+            notional += take*p
+        if rest and q > executed and abs(limit_price) < math.inf:
+            self.book.book[stock][side].add(order_id, limit_price, q - executed)
+        if self.book.stops.pending and not self.releasing_stops:
+            self.release_stops()
+        vwap = notional/executed if executed else math.nan
+        if metrics is not None:
+            metrics.record(instrumentation.EXECUTE_ORDER, self.book.stock_index[stock], perf_counter_ns() - start)
+        return order_id, executed, vwap
+    
+    def available_quantity(self, stock, side, limit_price):
+        """
+        quantity an incoming order of a side could trade up to its limit price
+        """
+        return self.book.book[stock]["ask" if side == "bid" else "bid"].quantity_through(round(limit_price, self.book.decimals))
+    
+    def release_stops(self):
+        """
+        executes triggered stop orders one after another. Stops triggered by these
+        executions are queued and released in the same loop
+        """
+        self.releasing_stops = True
+        pending = self.book.stops.pending
+        while pending:
+            stop = pending.popleft()
+            self.execute_order(stop.Stock, stop.Side, stop.Quantity, stop.Trader_ID,
+                               stop.Limit, order_id=stop.Order_ID)
+            # the rest of a stop market order is dropped and no longer open
+            if stop.Limit is None and self.interface.risk is not None:
+                self.interface.risk.release(stop.Order_ID)
+        self.releasing_stops = False
+        return None
\ No newline at end of file
@@ -5,36 +5,57 @@
 #
 #####################################################################
 
-import numpy as np
-import pandas as pd
-import csv
+from array import array
+import importlib
 import math
-import string
-import random
+from time import perf_counter_ns
 
+from stop_orders import StopBook
+from journal import INSERT, CANCEL, MODIFY
+import instrumentation
+
+# backend -> module and class of a book side, modules are imported on first use so
+# the pandas based backend does not load pandas unless it is chosen
+BACKENDS = {"dataframe": ("frame_side", "FrameSide"), "levels": ("price_levels", "PriceLevelSide")}
+SIDES = ["bid", "ask"]
+
+
+def backend_class(backend):
+    module, name = BACKENDS[backend]
+    return getattr(importlib.import_module(module), name)
 
 
 class Orderbook:
     
-    def __init__(self, stocks, decimals=4):
+    def __init__(self, stocks, decimals=4, backend="levels"):
         """
         orderbook class with all needed information
         orderbook has three entries per order per stock:
-        list fo ask orders, list of bid orders, 8 digit unique order ID
+        list fo ask orders, list of bid orders, unique integer order ID
         @param stocks: array-like: list of stock names traded in the index
+        @param decimals: int: number of decimals prices are rounded to (levels backend)
+        @param backend: string: "levels" keeps price levels in a heap with FIFO queues per level,
+                        "dataframe" keeps each side in a pandas DataFrame
         """
+        if backend not in BACKENDS:
+            raise ValueError("Unknown orderbook backend %s. Choose from %s."%(backend, list(BACKENDS)))
         self.stock_list = stocks
         self.decimals = decimals
-        self.book = {s: {"bid": pd.DataFrame([[-math.inf, 0, -1]],
-                                             columns = ["Price",
-                                                        "Quantity",
-                                                        "Order_ID"]).set_index("Order_ID"),
-                         "ask": pd.DataFrame([[math.inf, 0, -1]],
-                                             columns = ["Price",
-                                                        "Quantity",
-                                                        "Order_ID"]).set_index("Order_ID")}
+        self.backend = backend
+        side = backend_class(backend)
+        self.book = {s: {"bid": side("bid", decimals),
+                         "ask": side("ask", decimals)}
                      for s in stocks}
-        self.order_trader = pd.DataFrame([], columns = ["order_id", "trader_id"]).set_index("order_id")
+        self.stock_index = {s: i for i, s in enumerate(stocks)}
+        self.stops = StopBook(stocks)
+        # order ids count up from 0, per order id the arrays hold trader id, stock index and side (0 bid, 1 ask)
+        self.order_trader = array("q")
+        self.order_stock = array("i")
+        self.order_side = array("b")
+        # EventJournal that records order entry events, None if nothing is recorded
+        self.journal = None
+        # Metrics of the hot path, None if instrumentation is switched off
+        self.metrics = None
     
     def connect_trade_reporter(self, trade_reporter):
         try:
@@ -52,15 +73,68 @@ class Orderbook:
             print("Could not connect to matching engine. Please try again.")
         return None
     
-    def generate_order_id(self, length=8):
+    def connect_journal(self, journal):
         """
-        generates 12-digit order id to identfy trades
+        records all orders, cancels, modifies and fills in an EventJournal from now on
+        @param journal: EventJournal or None to stop recording
         """
-        new_order_id = ''.join(random.choice(string.digits) for _ in range(length))
-        if not new_order_id in self.order_trader.index:
-            return new_order_id
-        else:
-            return self.generate_order_id()
+        self.journal = journal
+        if journal is not None:
+            print("Connection to event journal successful. Events are written to %s."%journal.path)
+        return None
+    
+    def connect_metrics(self, metrics):
+        """
+        switches the hot path instrumentation on, or off with None, at any time
+        @param metrics: instrumentation.Metrics or None
+        """
+        self.metrics = metrics
+        return None
+    
+    def generate_order_id(self):
+        """
+        returns the next free integer order id to identfy trades
+        """
+        return len(self.order_trader)
+    
+    def register_order(self, trader_id, stock, side):
+        """
+        hands out a new order id and links it to the trader, stock and side of the order
+        """
+        new_order_id = self.generate_order_id()
+        self.order_trader.append(trader_id)
+        self.order_stock.append(self.stock_index[stock])
+        self.order_side.append(SIDES.index(side))
+        if self.metrics is not None:
+            self.metrics.count(instrumentation.ORDERS, self.stock_index[stock])
+        return new_order_id
+    
+    def locate_order(self, order_id):
+        """
+        returns stock and side of an order id or None if the id was never handed out
+        """
+        if not 0 <= order_id < len(self.order_trader):
+            return None
+        return self.stock_list[self.order_stock[order_id]], SIDES[self.order_side[order_id]]
+    
+    def insert_order(self, stock, side, price, quantity, trader_id):
+        """
+        adds order to one side of the orderbook and flags the book for the matching
+        engine without running it
+        @param side: string: "bid" or "ask"
+        @return: order id of the new order
+        """
+        metrics = self.metrics
+        if metrics is not None:
+            start = perf_counter_ns()
+        new_order_id = self.register_order(trader_id, stock, side)
+        if self.journal is not None:
+            self.journal.record(INSERT, self.stock_index[stock], side, new_order_id, trader_id, price, quantity)
+        self.book[stock][side].add(new_order_id, price, quantity)
+        self.matching_engine.mark_dirty(stock, side)
+        if metrics is not None:
+            metrics.record(instrumentation.INSERT, self.stock_index[stock], perf_counter_ns() - start)
+        return new_order_id
     
     def add_bid(self, stock, price, quantity, trader_id):
         """
@@ -69,14 +143,9 @@ class Orderbook:
         @param quantity: int: number of shares to trade
         @param order_id: int: unique identifier of order
         """
-        new_order_id = self.generate_order_id()
-        new_order = pd.DataFrame([[price, quantity, new_order_id]],
-                                 columns = ["Price", "Quantity", "Order_ID"]).set_index("Order_ID")
-        self.book[stock]["bid"] = pd.concat([self.book[stock]["bid"], new_order])
-        self.order_trader = pd.concat([self.order_trader,
-                                       pd.DataFrame([[new_order_id, trader_id]],
-                                                    columns = ["order_id", "trader_id"]).set_index("order_id")])
+        self.insert_order(stock, "bid", price, quantity, trader_id)
         self.matching_engine.check_trades()
+        self.flush()
         return None
     
     def add_ask(self, stock, price, quantity, trader_id):
@@ -86,48 +155,97 @@ class Orderbook:
         @param quantity: int: number of shares to trade
         @param order_id: int: unique identifier of order
         """
-        new_order_id = self.generate_order_id()
-        new_order = pd.DataFrame([[price, quantity, new_order_id]],
-                                 columns = ["Price", "Quantity", "Order_ID"]).set_index("Order_ID")
-        self.book[stock]["ask"] = pd.concat([self.book[stock]["ask"], new_order])
-        self.order_trader = pd.concat([self.order_trader,
-                                       pd.DataFrame([[new_order_id, trader_id]],
-                                                    columns = ["order_id", "trader_id"]).set_index("order_id")])
+        self.insert_order(stock, "ask", price, quantity, trader_id)
         self.matching_engine.check_trades()
+        self.flush()
+        return None
+    
+    def cancel_order(self, order_id):
+        """
+        removes a resting order or a pending stop order. Resting orders are looked up
+        through the order id index and dropped lazily from their price level
+        @return: BookEntry or StopOrder of the cancelled order, None if it is not live
+        """
+        location = self.locate_order(order_id)
+        if location is None:
+            return None
+        stock, side = location
+        entry = self.book[stock][side].remove(order_id)
+        if entry is None:
+            entry = self.stops.remove(order_id)
+        if entry is not None and self.journal is not None:
+            self.journal.record(CANCEL, self.stock_index[stock], side, order_id)
+        if entry is not None and self.metrics is not None:
+            self.metrics.count(instrumentation.CANCELS, self.stock_index[stock])
+        return entry
+    
+    def replace_order(self, order_id, new_p=None, new_q=None):
+        """
+        changes price and/or quantity of a resting order. Reducing only the quantity keeps
+        the place in the queue, a new price or a larger quantity sends the order to the
+        matching engine again under the same order id and puts it at the end of the queue
+        @return: order id or None if the order is not resting in the book
+        """
+        location = self.locate_order(order_id)
+        if location is None:
+            return None
+        stock, side = location
+        book_side = self.book[stock][side]
+        if order_id not in book_side:
+            return None
+        entry = book_side.entry(order_id)
+        if self.journal is not None:
+            self.journal.record(MODIFY, self.stock_index[stock], side, order_id, self.order_trader[order_id],
+                                math.nan if new_p is None else new_p, -1 if new_q is None else new_q)
+        if new_q is not None and new_q <= 0:
+            book_side.remove(order_id)
+        elif (new_p is None or new_p == entry.Price) and (new_q is None or new_q <= entry.Quantity):
+            book_side.modify(order_id, quantity=new_q)
+        else:
+            book_side.remove(order_id)
+            self.matching_engine.execute_order(stock, side,
+                                               entry.Quantity if new_q is None else new_q,
+                                               self.order_trader[order_id],
+                                               entry.Price if new_p is None else new_p,
+                                               order_id=order_id)
+        self.flush()
+        return order_id
+    
+    def flush(self):
+        """
+        delivers the fills of matching started from the orderbook to the traders, the same
+        way the interface does after its orders
+        """
+        self.matching_engine.interface.flush()
         return None
     
     def alter_bid(self, stock, order_id, new_q=None, new_p=None):
         """
         changes the price and the quantity of a given order_id
         """
-        if not new_p:
-            self.book[stock]["bid"].loc[order_id, "Price"] = new_p
-        if not new_q:
-            self.book[stock]["bid"].loc[order_id, "Quantity"] = new_q
-        self.matching_engine.check_trades()
-        return None
+        return self.replace_order(order_id, new_p, new_q)
     
     def alter_ask(self, stock, order_id, new_q=None, new_p=None):
         """
         changes the price and the quantity of a given order_id
         """
-        if not new_p:
-            self.book[stock]["ask"].loc[order_id, "Price"] = new_p
-        if not new_q:
-            self.book[stock]["ask"].loc[order_id, "Quantity"] = new_q
-        self.matching_engine.check_trades()
-        return None
+        return self.replace_order(order_id, new_p, new_q)
     
     def best_bid(self, stock):
         """
         returns complete orderbook entry of best bid order
         """
-        return self.book[stock]["bid"].loc[self.book[stock]["bid"].Price.idxmax()]
+        return self.book[stock]["bid"].best()
     
     def best_ask(self, stock):
         """
         returns complete orderbook entry of best ask order
         """
-        return self.book[stock]["ask"].loc[self.book[stock]["ask"].Price.idxmin()]
-        
-
+        return self.book[stock]["ask"].best()
+    
+    def depth(self, stock, levels=None):
+        """
+        aggregated price levels of both sides, see PriceLevelSide.depth
+        @return: tuple: bid and ask depth as read-only structured arrays
+        """
+        return self.book[stock]["bid"].depth(levels), self.book[stock]["ask"].depth(levels)
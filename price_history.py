@@ -0,0 +1,108 @@
+#####################################################################
+#
+# Bar store keeps open/high/low/close/volume/vwap/trade count of
+# every stock per period and updates the running bar with each fill
+#
+#####################################################################
+
+import numpy as np
+
+from columnar import ColumnBuffer
+
+BAR_FIELDS = [("Open", np.float64),
+              ("High", np.float64),
+              ("Low", np.float64),
+              ("Close", np.float64),
+              ("Volume", np.int64),
+              ("VWAP", np.float64),
+              ("Trades", np.int64)]
+
+
+class BarStore:
+
+    def __init__(self, stocks, starting_prices, capacity=1024):
+        """
+        one row per period with one entry per stock in every field. Row 0 holds the
+        starting prices, every end_period appends the running bar of the period
+        @param stocks: array-like: names of all traded stocks
+        @param starting_prices: array-like: price of each stock before the first trade
+        @param capacity: int: number of periods allocated up front
+        """
+        self.stocks = stocks
+        n = len(stocks)
+        self.buffer = ColumnBuffer([(name, dtype, (n,)) for name, dtype in BAR_FIELDS], capacity)
+        self.close = np.array([float(p) for p in starting_prices])
+        self.buffer.append((self.close, self.close, self.close, self.close, 0, self.close, 0))
+        self.reset()
+
+    def __len__(self):
+        return len(self.buffer)
+
+    def reset(self):
+        """
+        starts a new running bar
+        """
+        n = len(self.close)
+        self.open = np.full(n, np.nan)
+        self.high = np.full(n, -np.inf)
+        self.low = np.full(n, np.inf)
+        self.volume = np.zeros(n, dtype=np.int64)
+        self.notional = np.zeros(n)
+        self.trades = np.zeros(n, dtype=np.int64)
+        return None
+
+    def update(self, code, price, quantity, count=1):
+        """
+        adds trades of one stock at one price to the running bar
+        @param code: int: index of the stock
+        @param quantity: int: total traded quantity
+        @param count: int: number of trades
+        """
+        if self.trades[code] == 0:
+            self.open[code] = price
+        if price > self.high[code]:
+            self.high[code] = price
+        if price < self.low[code]:
+            self.low[code] = price
+        self.close[code] = price
+        self.volume[code] += quantity
+        self.notional[code] += price*quantity
+        self.trades[code] += count
+        return None
+
+    def end_period(self):
+        """
+        appends the running bar. Stocks without trades get a flat bar at the last close
+        """
+        traded = self.trades > 0
+        vwap = self.close.copy()
+        np.divide(self.notional, self.volume, out=vwap, where=self.volume > 0)
+        self.buffer.append((np.where(traded, self.open, self.close),
+                            np.where(traded, self.high, self.close),
+                            np.where(traded, self.low, self.close),
+                            self.close,
+                            self.volume,
+                            vwap,
+                            self.trades))
+        self.reset()
+        return None
+
+    def column(self, field="Close"):
+        """
+        returns all bars of one field as (periods, stocks) array without copying
+        """
+        return self.buffer.column(field)
+
+    def last(self, k, field="Close"):
+        """
+        returns the last k bars of one field as (k, stocks) array without copying
+        """
+        return self.buffer.column(field)[-k:]
+
+    def to_frame(self, field="Close"):
+        """
+        bars of one field in memory as DataFrame indexed by period
+        """
+        import pandas as pd
+        return pd.DataFrame(self.column(field), columns = self.stocks,
+                            index = np.arange(self.buffer.offset, self.buffer.offset + len(self.buffer)))
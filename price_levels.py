@@ -0,0 +1,328 @@
+#####################################################################
+#
+# Price level book side keeps the resting orders of one side of one
+# stock in price levels with FIFO queues and an order handle index
+#
+#####################################################################
+
+from collections import deque, namedtuple
+import numpy as np
+import heapq
+import math
+
+
+BookEntry = namedtuple("BookEntry", ["Order_ID", "Price", "Quantity"])
+# one row per price level from best to worst price
+DEPTH_DTYPE = [("Price", np.float64),
+               ("Quantity", np.int64),
+               ("Orders", np.int64)]
+
+
+class OrderHandle:
+    """
+    resting order inside a price level. A quantity of 0 marks a dead handle
+    that is skipped and dropped lazily once it reaches the front of its queue
+    """
+    __slots__ = ("order_id", "price", "quantity", "level")
+
+    def __init__(self, order_id, price, quantity, level):
+        self.order_id = order_id
+        self.price = price
+        self.quantity = quantity
+        self.level = level
+
+
+class PriceLevel:
+    """
+    all resting orders of one price in time priority
+    """
+    __slots__ = ("price", "queue", "quantity", "count")
+
+    def __init__(self, price):
+        self.price = price
+        self.queue = deque()
+        self.quantity = 0
+        self.count = 0
+
+    def front(self):
+        """
+        returns the first live order handle of the level
+        """
+        queue = self.queue
+        while queue[0].quantity == 0:
+            queue.popleft()
+        return queue[0]
+
+    def compact(self):
+        """
+        drops dead handles once they make up most of the queue
+        """
+        if len(self.queue) > 2*self.count + 8:
+            self.queue = deque(h for h in self.queue if h.quantity > 0)
+        return None
+
+
+class PriceLevelSide:
+
+    def __init__(self, side, decimals=4):
+        """
+        one side of the orderbook of one stock
+        price levels are kept in a heap (negated prices for the bid side),
+        each level holds a FIFO queue of order handles and every order id
+        maps to its handle, so inserts are O(log n), top of book and
+        cancels are O(1)
+        @param side: string: "bid" or "ask"
+        @param decimals: int: number of decimals prices are rounded to
+        """
+        if side not in ["bid", "ask"]:
+            raise ValueError("Invalid side %s. Use 'bid' or 'ask'."%side)
+        self.side = side
+        self.decimals = decimals
+        self.sign = -1 if side == "bid" else 1
+        self.empty_price = -math.inf if side == "bid" else math.inf
+        self.levels = {}
+        self.orders = {}
+        self.quantity = 0
+        self._heap = []
+        self._in_heap = set()
+        # counts changes of the side, the depth snapshot is rebuilt only after a change
+        self.version = 0
+        self._depth = None
+        self._depth_version = -1
+
+    def __len__(self):
+        return len(self.orders)
+
+    def __contains__(self, order_id):
+        return order_id in self.orders
+
+    def add(self, order_id, price, quantity):
+        """
+        appends an order to the end of the queue of its price level
+        @param order_id: unique identifier of the order
+        @param price: float: limit price of the order
+        @param quantity: int: number of shares
+        """
+        price = round(price, self.decimals)
+        level = self.levels.get(price)
+        if level is None:
+            level = PriceLevel(price)
+            self.levels[price] = level
+            if price not in self._in_heap:
+                heapq.heappush(self._heap, self.sign*price)
+                self._in_heap.add(price)
+        handle = OrderHandle(order_id, price, quantity, level)
+        level.queue.append(handle)
+        level.quantity += quantity
+        level.count += 1
+        self.orders[order_id] = handle
+        self.quantity += quantity
+        self.version += 1
+        return handle
+
+    def best_level(self):
+        """
+        returns the best price level or None if the side is empty
+        """
+        heap = self._heap
+        while heap:
+            price = self.sign*heap[0]
+            level = self.levels.get(price)
+            if level is not None:
+                return level
+            heapq.heappop(heap)
+            self._in_heap.discard(price)
+        return None
+
+    def best_price(self):
+        """
+        returns the best price, -inf (bid) or inf (ask) if the side is empty
+        """
+        level = self.best_level()
+        if level is None:
+            return self.empty_price
+        return level.price
+
+    def best(self):
+        """
+        returns the first order at the best price level
+        """
+        level = self.best_level()
+        if level is None:
+            return BookEntry(-1, self.empty_price, 0)
+        handle = level.front()
+        return BookEntry(handle.order_id, handle.price, handle.quantity)
+
+    def best_level_quantity(self):
+        level = self.best_level()
+        return 0 if level is None else level.quantity
+
+    def total_quantity(self):
+        return self.quantity
+
+    def quantity_through(self, price):
+        """
+        resting quantity at all levels from the best price up to a price
+        """
+        bound = self.sign*price
+        return sum(level.quantity for level in self.levels.values() if self.sign*level.price <= bound)
+
+    def order_ids(self):
+        return list(self.orders)
+
+    def _unlink(self, handle, quantity):
+        """
+        takes quantity of a handle off its level and drops empty levels
+        """
+        level = handle.level
+        handle.quantity -= quantity
+        level.quantity -= quantity
+        self.quantity -= quantity
+        self.version += 1
+        if handle.quantity == 0:
+            del self.orders[handle.order_id]
+            level.count -= 1
+            if level.count == 0:
+                del self.levels[level.price]
+            else:
+                level.compact()
+        return None
+
+    def fill(self, order_id, quantity):
+        """
+        reduces the quantity of an order by a traded amount and removes
+        it from the book once it is completely filled
+        """
+        self._unlink(self.orders[order_id], quantity)
+        return None
+
+    def entry(self, order_id):
+        handle = self.orders[order_id]
+        return BookEntry(order_id, handle.price, handle.quantity)
+
+    def level_orders(self, price):
+        """
+        returns order ids and quantities of all live orders at a price level in time priority
+        @return: tuple: list of order ids, np.array of quantities
+        """
+        handles = [h for h in self.levels[price].queue if h.quantity > 0]
+        quantities = np.fromiter((h.quantity for h in handles), dtype=np.int64, count=len(handles))
+        return [h.order_id for h in handles], quantities
+
+    def fill_level(self, price, order_ids, fills):
+        """
+        applies the fills of one price level in bulk
+        @param order_ids: list: order ids as returned by level_orders
+        @param fills: np.array: traded quantity per order
+        """
+        level = self.levels[price]
+        total = int(fills.sum())
+        done = 0
+        orders = self.orders
+        for i in np.flatnonzero(fills):
+            handle = orders[order_ids[i]]
+            handle.quantity -= int(fills[i])
+            if handle.quantity == 0:
+                del orders[handle.order_id]
+                done += 1
+        level.quantity -= total
+        level.count -= done
+        self.quantity -= total
+        self.version += 1
+        if level.count == 0:
+            del self.levels[price]
+        else:
+            level.compact()
+        return None
+
+    def remove(self, order_id):
+        """
+        removes an order from the book. The handle stays in its queue as
+        a dead entry until it reaches the front
+        @return: BookEntry of the removed order or None if it is not in the book
+        """
+        handle = self.orders.get(order_id)
+        if handle is None:
+            return None
+        entry = BookEntry(order_id, handle.price, handle.quantity)
+        self._unlink(handle, handle.quantity)
+        return entry
+
+    def modify(self, order_id, price=None, quantity=None):
+        """
+        changes price and/or quantity of a resting order. The order keeps
+        its place in the queue if only the quantity changes
+        """
+        handle = self.orders.get(order_id)
+        if handle is None:
+            return None
+        if price is not None and round(price, self.decimals) != handle.price:
+            removed = self.remove(order_id)
+            if quantity is None:
+                quantity = removed.Quantity
+            return self.add(order_id, price, quantity)
+        if quantity is not None:
+            delta = handle.quantity - quantity
+            if quantity <= 0:
+                self.remove(order_id)
+                return None
+            handle.quantity -= delta
+            handle.level.quantity -= delta
+            self.quantity -= delta
+            self.version += 1
+        return handle
+
+    def sorted_levels(self):
+        """
+        returns the live price levels from best to worst price
+        """
+        return sorted(self.levels.values(), key=lambda level: self.sign*level.price)
+
+    def resting_orders(self):
+        """
+        returns all live orders, every price level in time priority
+        @return: tuple of np.arrays: order ids, prices, quantities
+        """
+        handles = [h for level in self.levels.values() for h in level.queue if h.quantity > 0]
+        n = len(handles)
+        return (np.fromiter((h.order_id for h in handles), dtype=np.int64, count=n),
+                np.fromiter((h.price for h in handles), dtype=np.float64, count=n),
+                np.fromiter((h.quantity for h in handles), dtype=np.int64, count=n))
+
+    def load(self, order_ids, prices, quantities):
+        """
+        adds many orders in the given order, e.g. the output of resting_orders
+        """
+        for order_id, price, quantity in zip(order_ids.tolist(), prices.tolist(), quantities.tolist()):
+            self.add(order_id, price, quantity)
+        return None
+
+    def depth(self, levels=None):
+        """
+        aggregated quantity and order count per price level, cached until the side changes
+        @param levels: int or None: number of levels from the best price, all levels if None
+        @return: np.array: read-only structured array with DEPTH_DTYPE rows from best to worst price
+        """
+        if self._depth_version != self.version:
+            n = len(self.levels)
+            depth = np.empty(n, dtype=DEPTH_DTYPE)
+            depth["Price"] = np.fromiter(self.levels, dtype=np.float64, count=n)
+            depth["Quantity"] = np.fromiter((level.quantity for level in self.levels.values()), dtype=np.int64, count=n)
+            depth["Orders"] = np.fromiter((level.count for level in self.levels.values()), dtype=np.int64, count=n)
+            depth = depth[np.argsort(self.sign*depth["Price"], kind="stable")]
+            depth.flags.writeable = False
+            self._depth = depth
+            self._depth_version = self.version
+        return self._depth[:levels]
+
+    def to_frame(self):
+        """
+        returns the side as DataFrame sorted by price-time priority in the
+        layout of the dataframe backend
+        """
+        import pandas as pd
+        rows = [[h.order_id, h.price, h.quantity]
+                for level in self.sorted_levels()
+                for h in level.queue if h.quantity > 0]
+        rows.append([-1, self.empty_price, 0])
+        return pd.DataFrame(rows, columns = ["Order_ID", "Price", "Quantity"]).set_index("Order_ID")
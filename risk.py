@@ -0,0 +1,203 @@
+#####################################################################
+#
+# Pre-trade risk controls per trader: short-sale restriction, maximum
+# position, maximum notional of open orders and maximum orders per
+# period. Checks read an exposure cache that is updated on accept,
+# fill and cancel, the book and the fills are never scanned
+#
+#####################################################################
+
+import math
+import numpy as np
+
+SIDES = {"bid": 0, "ask": 1}
+DIRECTIONS = {"buy": 1, "sell": -1}
+
+
+class RiskManager:
+
+    def __init__(self, stocks, capacity=16):
+        """
+        per trader id the cache holds positions and open (unfilled) buy and sell quantities
+        per stock, the notional of resting orders and the orders sent in the current period.
+        Random traders (trader id -1) are neither checked nor tracked
+        @param stocks: array-like: names of all traded stocks
+        @param capacity: int: number of trader ids the arrays are allocated for, they grow on demand
+        """
+        self.stocks = list(stocks)
+        self.positions = np.zeros((capacity, len(self.stocks)), dtype=np.int64)
+        # open quantities per side (0 bid, 1 ask), trader and stock
+        self.open = np.zeros((2, capacity, len(self.stocks)), dtype=np.int64)
+        self.open_notional = np.zeros(capacity)
+        self.orders = np.zeros(capacity, dtype=np.int64)
+        # limits per trader, inf/True means no limit
+        self.short_selling = np.ones(capacity, dtype=bool)
+        self.max_position = np.full(capacity, np.inf)
+        self.max_open_notional = np.full(capacity, np.inf)
+        self.max_orders = np.full(capacity, np.inf)
+        # order id -> [trader id, stock index, side, limit price, open quantity] of live orders
+        self.live = {}
+        self.rejected = 0
+
+    def ensure(self, trader_id):
+        """
+        grows all arrays so trader_id is a valid row
+        """
+        capacity = len(self.orders)
+        if trader_id < capacity:
+            return None
+        new = max(2*capacity, trader_id + 1)
+        self.positions = np.concatenate([self.positions, np.zeros((new - capacity, len(self.stocks)), dtype=np.int64)])
+        self.open = np.concatenate([self.open, np.zeros((2, new - capacity, len(self.stocks)), dtype=np.int64)], axis=1)
+        self.open_notional = np.concatenate([self.open_notional, np.zeros(new - capacity)])
+        self.orders = np.concatenate([self.orders, np.zeros(new - capacity, dtype=np.int64)])
+        self.short_selling = np.concatenate([self.short_selling, np.ones(new - capacity, dtype=bool)])
+        self.max_position = np.concatenate([self.max_position, np.full(new - capacity, np.inf)])
+        self.max_open_notional = np.concatenate([self.max_open_notional, np.full(new - capacity, np.inf)])
+        self.max_orders = np.concatenate([self.max_orders, np.full(new - capacity, np.inf)])
+        return None
+
+    def set_limits(self, trader_id, short_selling=True, max_position=None, max_open_notional=None, max_orders=None):
+        """
+        @param short_selling: bool: False rejects sells that could take the position below zero
+        @param max_position: int or None: maximum absolute position per stock incl. open orders
+        @param max_open_notional: float or None: maximum price times quantity of all resting orders
+        @param max_orders: int or None: maximum number of orders and modifies per period
+        """
+        self.ensure(trader_id)
+        self.short_selling[trader_id] = short_selling
+        self.max_position[trader_id] = np.inf if max_position is None else max_position
+        self.max_open_notional[trader_id] = np.inf if max_open_notional is None else max_open_notional
+        self.max_orders[trader_id] = np.inf if max_orders is None else max_orders
+        return None
+
+    def check(self, trader_id, code, side, p, q, rests, replaces=None):
+        """
+        checks a new order against the limits of its trader. Buys count the position and all
+        open buys, sells the position and all open sells, so the order is safe however the
+        open orders are filled
+        @param code: int: index of the stock
+        @param side: string: "bid" or "ask"
+        @param p: float: limit price, nan for market orders
+        @param rests: bool: the rest of the order can rest in the book (counts as open notional)
+        @param replaces: int or None: live order id that the order replaces, its exposure is not counted
+        @return: string: reason of the rejection or None if the order passes
+        """
+        if trader_id < 0:
+            return None
+        self.ensure(trader_id)
+        s = SIDES[side]
+        open_q = self.open[s, trader_id, code]
+        open_notional = self.open_notional[trader_id]
+        old = self.live.get(replaces) if replaces is not None else None
+        if old is not None:
+            open_q -= old[4]
+            open_notional -= old[3]*old[4]
+        if self.orders[trader_id] >= self.max_orders[trader_id]:
+            return "order rate limit"
+        position = self.positions[trader_id, code]
+        if s == 0:
+            if position + open_q + q > self.max_position[trader_id]:
+                return "maximum position"
+        else:
+            after = position - open_q - q
+            if after < 0 and not self.short_selling[trader_id]:
+                return "short sale restriction"
+            if -after > self.max_position[trader_id]:
+                return "maximum position"
+        if rests and open_notional + p*q > self.max_open_notional[trader_id]:
+            return "maximum open notional"
+        return None
+
+    def reserve(self, trader_id, code, side, p, q, rests):
+        """
+        books an accepted order that is about to be matched as open
+        """
+        if trader_id < 0:
+            return None
+        self.count(trader_id)
+        self.open[SIDES[side], trader_id, code] += q
+        if rests:
+            self.open_notional[trader_id] += p*q
+        return None
+
+    def count(self, trader_id):
+        """
+        counts an order or modify towards the order rate limit of the period
+        """
+        self.orders[trader_id] += 1
+        return None
+
+    def settle(self, order_id, trader_id, code, side, p, q, rest, rests):
+        """
+        releases the reservation of an order once matching is done. Its fills are in the
+        positions already, the quantity rest that rests in the book stays open under its order id
+        @param rest: int: quantity of the order resting in the book
+        """
+        if trader_id < 0:
+            return None
+        self.open[SIDES[side], trader_id, code] -= q - rest
+        if rests:
+            self.open_notional[trader_id] -= p*(q - rest)
+        if rest > 0:
+            self.live[order_id] = [trader_id, code, SIDES[side], p, rest]
+        return None
+
+    def track(self, order_id, trader_id, code, side, p, q):
+        """
+        books a live order that is not matched right away, e.g. a stop order or a modified
+        order, as open. Orders without a limit price add no open notional
+        """
+        if trader_id < 0:
+            return None
+        self.ensure(trader_id)
+        p = 0. if math.isnan(p) else p
+        self.open[SIDES[side], trader_id, code] += q
+        self.open_notional[trader_id] += p*q
+        self.live[order_id] = [trader_id, code, SIDES[side], p, q]
+        return None
+
+    def fill(self, order_id, trader_id, code, q, direction):
+        """
+        moves a fill from the open quantity of its order into the position
+        """
+        self.ensure(trader_id)
+        self.positions[trader_id, code] += DIRECTIONS[direction]*q
+        entry = self.live.get(order_id)
+        if entry is not None:
+            q = min(q, entry[4])
+            entry[4] -= q
+            self.open[entry[2], trader_id, code] -= q
+            self.open_notional[trader_id] -= entry[3]*q
+            if entry[4] == 0:
+                del self.live[order_id]
+        return None
+
+    def release(self, order_id):
+        """
+        removes the open quantity of a cancelled or dropped order
+        """
+        entry = self.live.pop(order_id, None)
+        if entry is not None:
+            trader_id, code, s, p, q = entry
+            self.open[s, trader_id, code] -= q
+            self.open_notional[trader_id] -= p*q
+        return None
+
+    def end_period(self):
+        """
+        starts a new order rate window
+        """
+        self.orders[:] = 0
+        return None
+
+    def exposure(self, trader_id):
+        """
+        @return: dict: positions, open buy and sell quantities per stock, open notional and orders of the period
+        """
+        self.ensure(trader_id)
+        return {"positions": dict(zip(self.stocks, self.positions[trader_id].tolist())),
+                "open_buy": dict(zip(self.stocks, self.open[0, trader_id].tolist())),
+                "open_sell": dict(zip(self.stocks, self.open[1, trader_id].tolist())),
+                "open_notional": float(self.open_notional[trader_id]),
+                "orders": int(self.orders[trader_id])}
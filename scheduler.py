@@ -0,0 +1,354 @@
+#####################################################################
+#
+# Discrete-event scheduler runs the exchange in continuous time.
+# Orders, cancels and callbacks (agent wake-ups, market data
+# deliveries) carry timestamps, agents get modeled latencies and all
+# events of one timestamp are sent to the exchange as one batch
+#
+#####################################################################
+
+import heapq
+import itertools
+import math
+import numpy as np
+
+ORDER = 0
+CANCEL = 1
+CALLBACK = 2
+# orders of a flow that are converted to Python lists at a time when a flow is drained
+CHUNK = 4096
+
+
+def constant(value):
+    """
+    latency distributions take a generator and a number of draws and return latencies
+    """
+    return lambda rng, n: np.full(n, float(value))
+
+
+def exponential(mean):
+    return lambda rng, n: rng.exponential(mean, n)
+
+
+def lognormal(median, sigma):
+    return lambda rng, n: median*np.exp(sigma*rng.standard_normal(n))
+
+
+class OrderFlow:
+    """
+    pre-generated orders sorted by arrival time, read in slices by the scheduler
+    instead of pushing every order through the heap
+    """
+
+    def __init__(self, times, codes, sides, types, prices, quantities, trader_ids, relative):
+        order = np.argsort(times, kind="stable")
+        self.times = times[order]
+        self.codes = codes[order]
+        self.sides = sides[order]
+        self.types = types[order]
+        self.prices = prices[order]
+        self.quantities = quantities[order]
+        self.trader_ids = trader_ids[order]
+        self.relative = relative
+        self.cursor = 0
+        # arrival time of the next order as Python float, inf once the flow is exhausted
+        self.next = float(self.times[0]) if len(self.times) else math.inf
+
+    def take(self, t):
+        """
+        returns the index slice of all orders that arrive at time t
+        """
+        end = self.cursor + 1
+        if end < len(self.times) and self.times[end] == t:
+            end = int(np.searchsorted(self.times, t, side="right"))
+        part = slice(self.cursor, end)
+        self.cursor = end
+        self.next = float(self.times[end]) if end < len(self.times) else math.inf
+        return part
+
+
+class Scheduler:
+
+    def __init__(self, interface, rng=None, tick=None):
+        """
+        @param interface: Interface: connected exchange
+        @param rng: np.random.Generator or None: draws the latencies
+        @param tick: float or None: timestamps are rounded up to multiples of tick, so all
+                     events within one tick are matched as one batch
+        """
+        self.interface = interface
+        self.rng = rng if rng is not None else np.random.default_rng()
+        self.tick = tick
+        self.now = 0.
+        self.heap = []
+        self.seq = itertools.count()
+        self.flows = []
+        # agent -> latency distribution, agents without one act without delay
+        self.latencies = {}
+        self.stock_names = np.asarray(interface.book.stock_list)
+        self.events = 0
+        self.batches = 0
+
+    def set_latency(self, agent, distribution):
+        """
+        @param agent: hashable: id of the agent, e.g. its trader id
+        @param distribution: callable: (rng, n) -> np.array of n latencies
+        """
+        self.latencies[agent] = distribution
+        return None
+
+    def arrival(self, agent, at=None, n=None):
+        """
+        time(s) at which n events sent by an agent at time at reach the exchange
+        """
+        at = self.now if at is None else at
+        distribution = self.latencies.get(agent)
+        if distribution is not None:
+            at = at + distribution(self.rng, 1 if n is None else n)
+            if n is None:
+                at = float(at[0])
+        if self.tick is not None:
+            at = np.ceil(np.asarray(at)/self.tick - 1e-9)*self.tick
+            if n is None:
+                at = float(at)
+        return at
+
+    def push(self, time, kind, payload):
+        heapq.heappush(self.heap, (time, next(self.seq), kind, payload))
+        return None
+
+    def schedule(self, time, callback, *args):
+        """
+        calls callback(*args) at time, e.g. to wake up an agent or to end a period
+        """
+        if self.tick is not None:
+            time = math.ceil(time/self.tick - 1e-9)*self.tick
+        self.push(time, CALLBACK, (callback, args))
+        return None
+
+    def every(self, interval, callback, start=None, end=math.inf):
+        """
+        calls callback() every interval from start (now + interval if None) until end.
+        Without an end, run needs an until to return
+        """
+        def repeat():
+            callback()
+            if self.now + interval <= end:
+                self.schedule(self.now + interval, repeat)
+        self.schedule(self.now + interval if start is None else start, repeat)
+        return None
+
+    def submit(self, agent, stock, side, q, p=math.nan, order_type="limit", trader_id=-1, on_ack=None):
+        """
+        sends one order that reaches the exchange after the latency of the agent
+        @param on_ack: callable or None: called with order id, filled quantity and average
+                       fill price once the batch of the order is matched
+        """
+        self.push(self.arrival(agent), ORDER, (stock, side, order_type, p, q, trader_id, on_ack))
+        return None
+
+    def cancel(self, agent, order_id):
+        self.push(self.arrival(agent), CANCEL, order_id)
+        return None
+
+    def add_flow(self, times, stocks, sides, types, prices, quantities, trader_ids=-1,
+                 agent=None, relative=False):
+        """
+        adds many orders at once, e.g. the orders of all random traders of a whole run.
+        They are kept as sorted arrays and merged with the other events by time
+        @param times: array-like: send times of the orders, the latency of agent is added
+        @param stocks: array-like: stock indices
+        @param relative: bool: prices are offsets to the last traded price at arrival
+        """
+        times = np.asarray(times, dtype=np.float64)
+        n = len(times)
+        times = self.arrival(agent, times, n) if agent is not None or self.tick is not None else times
+        columns = [np.broadcast_to(c, n).copy() for c in (stocks, sides, types)]
+        self.flows.append(OrderFlow(times, *columns,
+                                    np.broadcast_to(np.asarray(prices, dtype=np.float64), n).copy(),
+                                    np.broadcast_to(quantities, n).copy(),
+                                    np.broadcast_to(np.asarray(trader_ids, dtype=np.int64), n).copy(),
+                                    relative))
+        return None
+
+    def run(self, until=math.inf):
+        """
+        processes all events up to time until. Per timestamp cancels are applied first,
+        then all orders go to the exchange as one batch (a single order is sent directly),
+        then the callbacks run in the order they were scheduled
+        @return: int: number of processed events
+        """
+        heap = self.heap
+        heappop = heapq.heappop
+        processed = self.events
+        while True:
+            t = heap[0][0] if heap else math.inf
+            # horizon is the earliest time of all events that are not in the leading flow
+            horizon = t
+            lead = None
+            flows = self.flows
+            for flow in flows:
+                if flow.next < t:
+                    horizon, t, lead = t, flow.next, flow
+                elif flow.next < horizon:
+                    horizon = flow.next
+            if t > until or t == math.inf:
+                break
+            if lead is not None:
+                # nothing else happens before horizon, the orders of the flow are sent in one go
+                self.drain(lead, horizon, until)
+                if lead.next == math.inf:
+                    self.flows = [flow for flow in flows if flow is not lead]
+                continue
+            self.now = t
+            orders = []
+            cancels = []
+            callbacks = []
+            while heap and heap[0][0] == t:
+                _, _, kind, payload = heappop(heap)
+                if kind == CALLBACK:
+                    callbacks.append(payload)
+                elif kind == ORDER:
+                    orders.append(payload)
+                else:
+                    cancels.append(payload)
+            n = len(orders) + len(cancels) + len(callbacks)
+            parts = []
+            exhausted = False
+            for flow in flows:
+                if flow.next == t:
+                    part = flow.take(t)
+                    parts.append((flow, part))
+                    n += part.stop - part.start
+                    exhausted = exhausted or flow.next == math.inf
+            if exhausted:
+                self.flows = [flow for flow in flows if flow.next < math.inf]
+            if cancels:
+                self.interface.cancel_many(cancels)
+            if n - len(cancels) - len(callbacks) == 1:
+                self.submit_single(orders, parts)
+            elif orders or parts:
+                self.submit_batch(orders, parts)
+            for callback, args in callbacks:
+                callback(*args)
+            self.events += n
+        self.flows = [flow for flow in self.flows if flow.cursor < len(flow.times)]
+        if until < math.inf:
+            self.now = max(self.now, until)
+        return self.events - processed
+
+    def submit_batch(self, orders, parts):
+        """
+        sends the orders of one timestamp from the heap and from the order flows as one batch
+        """
+        last_prices = self.interface.trade_reporter.last_prices
+        columns = [[], [], [], [], [], []]
+        for flow, part in parts:
+            codes = flow.codes[part]
+            prices = flow.prices[part]
+            if flow.relative:
+                prices = prices + last_prices[codes]
+            for column, values in zip(columns, (self.stock_names[codes], flow.sides[part], flow.types[part],
+                                                prices, flow.quantities[part], flow.trader_ids[part])):
+                column.append(values)
+        if orders:
+            stocks, sides, types, prices, quantities, trader_ids, _ = zip(*orders)
+            for column, values in zip(columns, (stocks, sides, types, prices, quantities, trader_ids)):
+                column.append(np.asarray(values))
+        stocks, sides, types, prices, quantities, trader_ids = [np.concatenate(c) for c in columns]
+        order_ids, filled, avg_price = self.interface.submit_batch(stocks, sides, types, prices,
+                                                                   quantities, trader_ids)
+        self.batches += 1
+        if orders:
+            offset = len(order_ids) - len(orders)
+            for i, order in enumerate(orders):
+                if order[-1] is not None:
+                    order[-1](int(order_ids[offset + i]), filled[offset + i], avg_price[offset + i])
+        return None
+
+    def drain(self, flow, horizon, until):
+        """
+        sends all orders of a flow that arrive before horizon and not after until, one
+        timestamp after another. The columns are read as Python lists chunk by chunk,
+        single orders go straight to the exchange and orders that share a timestamp as a batch
+        """
+        times = flow.times
+        end = int(np.searchsorted(times, horizon, side="left"))
+        if until < horizon:
+            end = min(end, int(np.searchsorted(times, until, side="right")))
+        last_prices = self.interface.trade_reporter.last_prices
+        names = self.stock_names
+        start = flow.cursor
+        while start < end:
+            stop = min(end, start + CHUNK)
+            if stop < end and times[stop] == times[stop - 1]:
+                stop = int(np.searchsorted(times, times[stop - 1], side="right"))
+            part = slice(start, stop)
+            chunk = times[part]
+            bounds = [0] + (np.flatnonzero(chunk[1:] != chunk[:-1]) + 1).tolist() + [stop - start]
+            chunk = chunk.tolist()
+            codes = flow.codes[part].tolist()
+            sides = flow.sides[part].tolist()
+            types = flow.types[part].tolist()
+            prices = flow.prices[part].tolist()
+            quantities = flow.quantities[part].tolist()
+            trader_ids = flow.trader_ids[part].tolist()
+            for a, b in zip(bounds, bounds[1:]):
+                self.now = chunk[a]
+                if b - a == 1:
+                    code = codes[a]
+                    p = prices[a] + last_prices[code] if flow.relative else prices[a]
+                    self.send(names[code], sides[a], types[a], p, quantities[a], trader_ids[a])
+                    self.batches += 1
+                else:
+                    self.submit_batch([], [(flow, slice(start + a, start + b))])
+            start = stop
+        self.events += end - flow.cursor
+        flow.cursor = end
+        flow.next = float(times[end]) if end < len(times) else math.inf
+        return None
+
+    def send(self, stock, side, order_type, p, q, trader_id):
+        """
+        sends one order straight to the matching engine. Invalid orders are rejected
+        the same way submit_batch rejects them
+        @return: tuple: order id, filled quantity and average fill price, None if rejected
+        """
+        is_market = order_type == "market"
+        if (stock in self.interface.book.stock_index and side in ("bid", "ask")
+                and (is_market or order_type == "limit") and q > 0
+                and (is_market or (math.isfinite(p) and p > 0))):
+            return self.interface.send_order(str(stock), str(side), int(q), int(trader_id),
+                                             None if is_market else float(p))
+        return None
+
+    def submit_single(self, orders, parts):
+        """
+        sends the only order of a timestamp straight to the matching engine, a batch
+        of one order would pay for the grouping of submit_batch
+        """
+        if orders:
+            stock, side, order_type, p, q, trader_id, on_ack = orders[0]
+        else:
+            flow, part = parts[0]
+            i = part.start
+            code = flow.codes[i]
+            stock, side, order_type = self.stock_names[code], flow.sides[i], flow.types[i]
+            p, q, trader_id, on_ack = flow.prices[i], flow.quantities[i], flow.trader_ids[i], None
+            if flow.relative:
+                p = p + self.interface.trade_reporter.last_prices[code]
+        result = self.send(stock, side, order_type, p, q, trader_id)
+        self.batches += 1
+        if on_ack is not None:
+            on_ack(*((-1, 0., math.nan) if result is None else (int(result[0]), result[1], result[2])))
+        return None
+
+    def deliver(self, agent, callback):
+        """
+        wraps a callback for the market data bus, so updates reach the agent
+        after its latency instead of immediately
+        @return: callable: callback to subscribe with
+        """
+        def delayed(topic, stock, update):
+            self.schedule(self.arrival(agent), callback, topic, stock, update)
+        return delayed
@@ -0,0 +1,270 @@
+#####################################################################
+#
+# Sharded exchange partitions the stocks over worker processes. Each
+# worker owns the orderbook, matching engine, trade reporter and
+# interface of its stocks, a coordinator routes batched orders by
+# stock and gathers fills and end of period prices
+#
+#####################################################################
+
+import multiprocessing
+import os
+import numpy as np
+
+from columnar import ColumnBuffer
+from exchange import build_exchange
+
+# fills of non-random traders, Direction is 1 for buy and -1 for sell
+FILL_DTYPE = [("Order_ID", np.int64),
+              ("Trader_ID", np.int64),
+              ("Stock", np.int32),
+              ("Direction", np.int8),
+              ("Price", np.float64),
+              ("Quantity", np.int64)]
+
+
+def collect_fills(interface, start):
+    """
+    returns the fills of non-random traders among the trades recorded on the
+    trade tape of an exchange since row start
+    """
+    trades = interface.trade_reporter.trades()[max(start - interface.trade_reporter.tape.offset, 0):]
+    if len(trades) == 0:
+        return np.empty(0, dtype=FILL_DTYPE)
+    order_ids = np.concatenate([trades["Maker_ID"], trades["Taker_ID"]])
+    order_trader = np.frombuffer(interface.book.order_trader, dtype=np.int64)
+    trader_ids = order_trader[order_ids]
+    del order_trader
+    keep = trader_ids != -1
+    fills = np.empty(np.count_nonzero(keep), dtype=FILL_DTYPE)
+    fills["Order_ID"] = order_ids[keep]
+    fills["Trader_ID"] = trader_ids[keep]
+    fills["Stock"] = np.tile(trades["Stock"], 2)[keep]
+    fills["Direction"] = np.concatenate([-trades["Side"], trades["Side"]])[keep]
+    fills["Price"] = np.tile(trades["Price"], 2)[keep]
+    fills["Quantity"] = np.tile(trades["Quantity"], 2)[keep]
+    return fills
+
+
+class RemoteTraders:
+    """
+    stands in for the trader list of a shard interface. The traders live in the
+    coordinator process and get their fills from the gathered fills instead
+    """
+
+    def __getitem__(self, trader_id):
+        return self
+
+    def filled_order_info(self, stock, p, q, direction):
+        return None
+
+
+def shard_worker(conn, stocks, starting_prices, backend, algo):
+    """
+    runs the exchange of one shard and answers the commands of the coordinator.
+    Every answer is a tuple of the result and the new fills of non-random traders
+    """
+    interface = build_exchange(stocks, starting_prices, backend, algo)
+    interface.traders = RemoteTraders()
+    reported = 0
+    while True:
+        command, args = conn.recv()
+        if command == "close":
+            break
+        try:
+            if command == "batch":
+                result = interface.submit_batch(*args)
+            elif command == "cancel_many":
+                result = interface.cancel_many(args)
+            elif command == "end_period":
+                interface.trade_reporter.end_period()
+                result = interface.trade_reporter.last_prices.copy()
+            else:
+                raise ValueError("Unknown command %s."%command)
+            fills = collect_fills(interface, reported)
+            reported = interface.trade_reporter.tape.offset + len(interface.trade_reporter.tape)
+        except Exception as e:
+            result, fills = e, None
+        conn.send((result, fills))
+    conn.close()
+    return None
+
+
+class ShardedExchange:
+
+    def __init__(self, stocks, starting_prices, n_workers=None, backend="levels", algo="pro rata"):
+        """
+        starts one worker process per shard, stock i belongs to shard i % n_workers.
+        Order ids are unique over all shards: global id = local id * n_workers + shard
+        @param stocks: array-like: names of all traded stocks
+        @param starting_prices: array-like: price of each stock before the first trade
+        @param n_workers: int or None: number of worker processes, number of cpus if None
+        @param backend: string: orderbook backend of the workers
+        @param algo: string: matching algorithm of the workers
+        """
+        self.stock_list = list(stocks)
+        self.n_workers = max(1, min(n_workers or os.cpu_count(), len(self.stock_list)))
+        n = len(self.stock_list)
+        self.stock_names = np.asarray(self.stock_list)
+        self.sorter = np.argsort(self.stock_names)
+        self.shard_of = np.arange(n) % self.n_workers
+        self.shard_codes = [np.flatnonzero(self.shard_of == s) for s in range(self.n_workers)]
+        self.last_prices = np.array([float(p) for p in starting_prices])
+        self.closes = ColumnBuffer([("Close", np.float64, (n,))])
+        self.closes.append((self.last_prices,))
+        self.fills = ColumnBuffer(FILL_DTYPE)
+        self.traders = []
+        ctx = multiprocessing.get_context()
+        self.conns = []
+        self.workers = []
+        for codes in self.shard_codes:
+            conn, child = ctx.Pipe()
+            worker = ctx.Process(target=shard_worker,
+                                 args=(child, list(self.stock_names[codes]), self.last_prices[codes], backend, algo),
+                                 daemon=True)
+            worker.start()
+            child.close()
+            self.conns.append(conn)
+            self.workers.append(worker)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+    def close(self):
+        """
+        stops all worker processes
+        """
+        for conn, worker in zip(self.conns, self.workers):
+            if worker.is_alive():
+                conn.send(("close", None))
+                worker.join()
+            conn.close()
+        self.workers = []
+        self.conns = []
+        return None
+
+    def connect_trader(self, traders):
+        """
+        registers traders that receive their fills through filled_order_info
+        """
+        for trader in traders:
+            trader.get_trader_id(len(self.traders))
+            # the ledger is set up over all stocks, like Trader.connect_interface does for one exchange
+            trader.stocks = list(self.stock_list)
+            trader.stock_index = {s: i for i, s in enumerate(self.stock_list)}
+            trader.positions = np.zeros(len(self.stock_list), dtype=np.int64)
+            trader.marks = np.zeros(len(self.stock_list))
+            self.traders.append(trader)
+        print("Successfully connected %i traders to the exchange"%len(traders))
+        return None
+
+    def stock_codes(self, stocks):
+        """
+        returns the index of every stock name, -1 for unknown names
+        """
+        pos = self.sorter[np.searchsorted(self.stock_names, stocks, sorter=self.sorter).clip(0, len(self.sorter) - 1)]
+        return np.where(self.stock_names[pos] == stocks, pos, -1)
+
+    def request(self, messages):
+        """
+        sends one message to each shard of messages first and then collects the answers,
+        so all shards work in parallel. All answers are read before fills are delivered
+        or errors are raised, so no answer is left in a pipe for the next request
+        @param messages: dict: shard -> (command, args)
+        @return: dict: shard -> result
+        """
+        for shard, message in messages.items():
+            self.conns[shard].send(message)
+        answers = {shard: self.conns[shard].recv() for shard in messages}
+        results = {}
+        error = None
+        for shard, (result, fills) in answers.items():
+            if isinstance(result, Exception):
+                error = error or result
+                continue
+            results[shard] = result
+        for shard, (result, fills) in answers.items():
+            if fills is not None:
+                self.gather_fills(shard, fills)
+        if error is not None:
+            raise error
+        return results
+
+    def gather_fills(self, shard, fills):
+        """
+        translates shard fills to global order ids and stock indices, stores them
+        and sends them to the connected traders
+        """
+        if len(fills) == 0:
+            return None
+        fills["Order_ID"] = fills["Order_ID"]*self.n_workers + shard
+        fills["Stock"] = self.shard_codes[shard][fills["Stock"]]
+        self.fills.extend({name: fills[name] for name in fills.dtype.names})
+        for fill in fills:
+            if fill["Trader_ID"] < len(self.traders):
+                self.traders[fill["Trader_ID"]].filled_order_info(self.stock_list[fill["Stock"]],
+                                                                 fill["Price"],
+                                                                 fill["Quantity"],
+                                                                 "buy" if fill["Direction"] == 1 else "sell")
+        return None
+
+    def submit_batch(self, stocks, sides, types, prices, quantities, trader_ids=-1):
+        """
+        splits a batch of orders by shard and submits the parts in parallel,
+        see Interface.submit_batch for the columns
+        @return: tuple of np.arrays: global order ids (-1 for rejected orders),
+                 filled quantities and average fill prices of the orders
+        """
+        stocks = np.asarray(stocks)
+        n = len(stocks)
+        columns = [np.broadcast_to(sides, n),
+                   np.broadcast_to(types, n),
+                   np.broadcast_to(np.asarray(prices, dtype=float), n),
+                   np.broadcast_to(quantities, n),
+                   np.broadcast_to(np.asarray(trader_ids, dtype=np.int64), n)]
+        codes = self.stock_codes(stocks)
+        shards = np.where(codes >= 0, self.shard_of[codes], -1)
+        parts = {s: np.flatnonzero(shards == s) for s in range(self.n_workers)}
+        parts = {s: idx for s, idx in parts.items() if len(idx)}
+        results = self.request({s: ("batch", [stocks[idx]] + [c[idx] for c in columns])
+                                for s, idx in parts.items()})
+        order_ids = np.full(n, -1, dtype=np.int64)
+        filled = np.zeros(n)
+        avg_price = np.full(n, np.nan)
+        for s, idx in parts.items():
+            local_ids, filled[idx], avg_price[idx] = results[s]
+            order_ids[idx] = np.where(local_ids >= 0, local_ids*self.n_workers + s, -1)
+        return order_ids, filled, avg_price
+
+    def cancel_many(self, order_ids):
+        """
+        cancels global order ids on their shards
+        @return: np.array: unique order ids and np.array of bools, True where the order was cancelled
+        """
+        order_ids = np.unique(np.asarray(order_ids, dtype=np.int64))
+        shards = order_ids % self.n_workers
+        parts = {s: np.flatnonzero(shards == s) for s in range(self.n_workers)}
+        parts = {s: idx for s, idx in parts.items() if len(idx)}
+        results = self.request({s: ("cancel_many", order_ids[idx]//self.n_workers) for s, idx in parts.items()})
+        cancelled = np.zeros(len(order_ids), dtype=bool)
+        for s, idx in parts.items():
+            cancelled[idx] = results[s][1]
+        return order_ids, cancelled
+
+    def end_period(self):
+        """
+        closes the period on all shards
+        @return: np.array: last traded price of every stock
+        """
+        results = self.request({s: ("end_period", None) for s in range(self.n_workers)})
+        for s, prices in results.items():
+            self.last_prices[self.shard_codes[s]] = prices
+        self.closes.append((self.last_prices,))
+        return self.last_prices.copy()
+
+    def last_price(self, stock):
+        return self.last_prices[self.stock_list.index(stock)]
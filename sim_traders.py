@@ -8,15 +8,13 @@
 
 
 import numpy as np
-import pandas as pd
-import random
 
 
 
 
 class Random_Traders:
     
-    def __init__(self, n=25, p_market=0.2, p_limit=0.7, delete_factor=3, avg_ask_q=75, avg_bid_q=75):
+    def __init__(self, n=25, p_market=0.2, p_limit=0.7, delete_factor=3, avg_ask_q=75, avg_bid_q=75, vectorized=False, rng=None):
         self.n = n
         self.p_market = p_market
         self.p_limit = p_limit
@@ -26,6 +24,8 @@ class Random_Traders:
         self.asset_num = 0
         self.trade_prob = None
         self.momentum = None
+        self.vectorized = vectorized#draw all orders of a period as arrays and send them as one batch
+        self.rng = rng if rng is not None else np.random.default_rng()#np.random.Generator, pass a seeded one for reproducible runs
     
     def connect_interface(self, interface):
         try:
@@ -37,55 +37,120 @@ class Random_Traders:
             print("Could not connect to trader-exchange interface. Please try again.")
         return None
     
+    def draw_stocks(self, n, stock=None):
+        """
+        draws the stock index of n orders, all orders go to stock if it is given
+        """
+        if stock:
+            return np.full(n, self.interface.book.stock_list.index(stock))
+        return self.rng.integers(self.asset_num, size=n)
+    
+    def draw_sides(self, n, direction=None):
+        if direction:
+            return np.full(n, direction)
+        return np.where(self.rng.uniform(size=n) < 0.5, "bid", "ask")
+    
+    def market_orders_batch(self, vola_q=10, direction=None, dynamic=False):
+        """
+        draws stocks, sides and quantities of all market orders of a period at once
+        and sends them to the exchange as one batch
+        """
+        n = np.count_nonzero(self.rng.uniform(size=self.n) <= self.p_market)
+        stock_list = self.interface.book.stock_list
+        codes = self.draw_stocks(n)
+        sides = self.draw_sides(n, direction)
+        if dynamic:
+            prices = self.interface.trade_reporter.bars.last(5)
+            calc_q = (prices[-1]/prices[0])[codes]
+        else:
+            calc_q = np.ones(n)
+        avg_q = np.where(sides == "bid", self.avg_bid_q/calc_q, self.avg_ask_q*calc_q)
+        q = np.maximum(self.rng.normal(avg_q, vola_q).astype(int), 0)
+        self.interface.submit_batch(np.asarray(stock_list)[codes], sides, "market", np.nan, q, -1)
+        return None
+    
+    def limit_orders_batch(self, stock=None, avg_price=None, vola=2.5, dist="normal", direction=None, **kwargs):
+        """
+        draws stocks, sides, quantities and prices of all limit orders of a period at once
+        and sends them to the exchange as one batch
+        """
+        n = np.count_nonzero(self.rng.uniform(size=self.n) <= self.p_limit)
+        stock_list = self.interface.book.stock_list
+        codes = self.draw_stocks(n, stock)
+        sides = self.draw_sides(n, direction)
+        quantities = self.rng.integers(10, 1001, size=n)
+        if avg_price:
+            mid = np.full(n, float(avg_price))
+        else:
+            mid = self.interface.trade_reporter.last_prices[codes]
+        sign = np.where(sides == "bid", -1, 1)
+        if dist == "normal":
+            prices = self.rng.normal(mid + sign*vola/2, vola)
+        elif dist == "uniform":
+            prices = mid - sign*(self.rng.uniform(size=n) - 0.5)*vola + vola/2
+        elif dist == "t":
+            prices = self.rng.standard_t(kwargs["df"], size=n) + mid + sign*vola/2
+        else:
+            print("Invalid distribution %s. No orders have been placed."%dist)
+            return None
+        keep = prices > 0
+        self.interface.submit_batch(np.asarray(stock_list)[codes[keep]], sides[keep], "limit",
+                                    prices[keep], quantities[keep], -1)
+        return None
+    
     def market_orders(self, vola_q=10, direction=None, dynamic=False):
-        trade_checks = np.random.uniform(size=self.n)
+        if self.vectorized:
+            return self.market_orders_batch(vola_q, direction, dynamic)
+        trade_checks = self.rng.uniform(size=self.n)
         for i in range(self.n):
             if trade_checks[i] <= self.p_market:
-                stock = random.choice(self.interface.book.stock_list)
+                stock = self.interface.book.stock_list[self.rng.integers(self.asset_num)]
                 if not direction:
-                    direction = random.choice(["bid", "ask"])
+                    direction = "bid" if self.rng.random() < 0.5 else "ask"
                 if direction == "bid":
                     if dynamic:
                         calc_q = self.dynamic_q(stock)
                     else:
                         calc_q = 1
-                    q = max(int(np.random.normal(self.avg_bid_q/calc_q, vola_q)), 0)
+                    q = max(int(self.rng.normal(self.avg_bid_q/calc_q, vola_q)), 0)
                     self.interface.market_bid(stock, q, -1)
                 elif direction == "ask":
                     if dynamic:
                         calc_q = self.dynamic_q(stock)
                     else:
                         calc_q = 1
-                    q = max(int(np.random.normal(self.avg_ask_q*calc_q, vola_q)), 0)
+                    q = max(int(self.rng.normal(self.avg_ask_q*calc_q, vola_q)), 0)
                     self.interface.market_ask(stock, q, -1)
         return None
     
     def limit_orders(self, stock=None, avg_price=None, vola=2.5, dist="normal", direction=None, **kwargs):
-        trade_checks = np.random.uniform(size=self.n)
+        if self.vectorized:
+            return self.limit_orders_batch(stock, avg_price, vola, dist, direction, **kwargs)
+        trade_checks = self.rng.uniform(size=self.n)
         for i in range(self.n):
             if trade_checks[i] <= self.p_limit:
-                quantity = random.randint(10, 1000)
+                quantity = int(self.rng.integers(10, 1001))
                 if not stock:
-                    stock = random.choice(self.interface.book.stock_list)
+                    stock = self.interface.book.stock_list[self.rng.integers(self.asset_num)]
                 if not avg_price:
-                    avg_price = self.interface.trade_reporter.prices[stock][0]
+                    avg_price = self.interface.trade_reporter.last_price(stock)
                 if not direction:
-                    direction = random.choice(["bid", "ask"])
+                    direction = "bid" if self.rng.random() < 0.5 else "ask"
                 if dist == "normal":
                     if direction == "bid":
-                        price = np.random.normal(avg_price-vola/2, vola)
+                        price = self.rng.normal(avg_price-vola/2, vola)
                     else:
-                        price = np.random.normal(avg_price+vola/2, vola)
+                        price = self.rng.normal(avg_price+vola/2, vola)
                 elif dist == "uniform":
                     if direction == "bid":
-                        price = avg_price+(random.random()-0.5)*vola + vola/2
+                        price = avg_price+(self.rng.random()-0.5)*vola + vola/2
                     else:
-                        price = avg_price-(random.random()-0.5)*vola + vola/2
+                        price = avg_price-(self.rng.random()-0.5)*vola + vola/2
                 elif dist == "t":
                     if direction == "bid":
-                        price = np.random.standard_t(kwargs["df"])+avg_price-vola/2
+                        price = self.rng.standard_t(kwargs["df"])+avg_price-vola/2
                     else:
-                        price = np.random.standard_t(kwargs["df"])+avg_price+vola/2
+                        price = self.rng.standard_t(kwargs["df"])+avg_price+vola/2
                 if price <= 0:
                     continue
                 if direction == "ask":
@@ -93,23 +158,45 @@ class Random_Traders:
                 if direction == "bid":
                     self.interface.limit_bid(stock, price, quantity, -1)
     
+    def schedule_orders(self, scheduler, start, end, vola=2.5, vola_q=10, agent=None):
+        """
+        draws the limit and market orders of the period [start, end) with uniform send times,
+        i.e. as poisson arrivals, and adds them to the scheduler as one order flow. Limit
+        prices are offsets to the last price at the time the order arrives
+        @param scheduler: Scheduler: event scheduler of the exchange
+        @param agent: hashable or None: agent whose latency distribution delays the orders
+        """
+        n_limit = self.rng.binomial(self.n, self.p_limit)
+        n_market = self.rng.binomial(self.n, self.p_market)
+        n = n_limit + n_market
+        is_limit = np.arange(n) < n_limit
+        sides = self.draw_sides(n)
+        sign = np.where(sides == "bid", -1, 1)
+        offsets = np.where(is_limit, self.rng.normal(sign*vola/2, vola), np.nan)
+        avg_q = np.where(sides == "bid", self.avg_bid_q, self.avg_ask_q)
+        quantities = np.where(is_limit, self.rng.integers(10, 1001, size=n),
+                              np.maximum(self.rng.normal(avg_q, vola_q).astype(int), 0))
+        scheduler.add_flow(self.rng.uniform(start, end, size=n), self.draw_stocks(n), sides,
+                           np.where(is_limit, "limit", "market"), offsets, quantities, -1,
+                           agent=agent, relative=True)
+        return None
+
     def dynamic_q(self, stock):
-        prices = self.interface.trade_reporter.p_t[stock].tail().values
+        prices = self.interface.trade_reporter.last_bars(stock, 5)
         return prices[-1]/prices[0]
     
     def delete_order(self):
+        """
+        cancels a poisson distributed number of distinct random orders on both sides of every stock
+        """
         stocks = self.interface.book.stock_list
+        delete_orders = []
         for stock in stocks:
-            n0 = len(self.interface.book.book[stock]["bid"])
-            n1 = len(self.interface.book.book[stock]["ask"])
-            delete_num = np.random.poisson(self.del_factor, size=2)
-            if n0 >= delete_num[0]:
-                all_orders = self.interface.book.book[stock]["bid"].index[self.interface.book.book[stock]["bid"].index != -1]
-                if len(all_orders) > 0:
-                    delete_orders = np.random.choice(all_orders, delete_num[0])
-                    self.interface.book.book[stock]["bid"].drop(delete_orders, inplace=True)
-            if n1 >= delete_num[1]:
-                all_orders = self.interface.book.book[stock]["ask"].index[self.interface.book.book[stock]["ask"].index != -1]
-                if len(all_orders) > 0:
-                    delete_orders = np.random.choice(all_orders, delete_num[1])
-                    self.interface.book.book[stock]["ask"].drop(delete_orders, inplace=True)
\ No newline at end of file
+            delete_num = self.rng.poisson(self.del_factor, size=2)
+            for side, num in zip(["bid", "ask"], delete_num):
+                all_orders = self.interface.book.book[stock][side].order_ids()
+                if len(all_orders) >= num > 0:
+                    delete_orders.append(self.rng.choice(all_orders, num, replace=False))
+        if delete_orders:
+            self.interface.cancel_many(np.concatenate(delete_orders))
+        return None
\ No newline at end of file
@@ -0,0 +1,85 @@
+#####################################################################
+#
+# Stop book keeps pending stop and stop limit orders of every stock
+# sorted by trigger price and fires the ones crossed by a new price
+#
+#####################################################################
+
+from bisect import bisect_left, bisect_right
+from collections import deque, namedtuple
+
+
+StopOrder = namedtuple("StopOrder", ["Order_ID", "Stock", "Side", "Trigger", "Quantity", "Trader_ID", "Limit"])
+
+
+class StopBook:
+
+    def __init__(self, stocks):
+        """
+        buy stops fire once the last price rises to or above their trigger, sell stops
+        once it falls to or below. Per stock and side the triggers are kept in a sorted
+        list, so a price update finds all crossed stops with one binary search
+        @param stocks: array-like: names of all traded stocks
+        """
+        self.triggers = {s: {"bid": [], "ask": []} for s in stocks}
+        self.orders = {s: {"bid": [], "ask": []} for s in stocks}
+        self.index = {}
+        self.pending = deque()
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, order_id):
+        return order_id in self.index
+
+    def add(self, stop):
+        """
+        @param stop: StopOrder: stop order, Limit is None for stop market orders
+        """
+        triggers = self.triggers[stop.Stock][stop.Side]
+        i = bisect_right(triggers, stop.Trigger)
+        triggers.insert(i, stop.Trigger)
+        self.orders[stop.Stock][stop.Side].insert(i, stop)
+        self.index[stop.Order_ID] = stop
+        return None
+
+    def remove(self, order_id):
+        """
+        removes a pending stop order
+        @return: StopOrder or None if there is no such stop
+        """
+        stop = self.index.pop(order_id, None)
+        if stop is None:
+            return None
+        triggers = self.triggers[stop.Stock][stop.Side]
+        orders = self.orders[stop.Stock][stop.Side]
+        i = bisect_left(triggers, stop.Trigger)
+        while orders[i].Order_ID != order_id:
+            i += 1
+        del triggers[i]
+        del orders[i]
+        return stop
+
+    def trigger(self, stock, price):
+        """
+        moves all stops crossed by a new last price of a stock to the pending queue
+        """
+        triggers = self.triggers[stock]["bid"]
+        if triggers and triggers[0] <= price:
+            i = bisect_right(triggers, price)
+            self.fire(self.orders[stock]["bid"][:i])
+            del triggers[:i]
+            del self.orders[stock]["bid"][:i]
+        triggers = self.triggers[stock]["ask"]
+        if triggers and triggers[-1] >= price:
+            i = bisect_left(triggers, price)
+            self.fire(self.orders[stock]["ask"][i:][::-1])
+            del triggers[i:]
+            del self.orders[stock]["ask"][i:]
+        return None
+
+    def fire(self, stops):
+        for stop in stops:
+            del self.index[stop.Order_ID]
+        self.pending.extend(stops)
+        return None
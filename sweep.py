@@ -0,0 +1,147 @@
+#####################################################################
+#
+# Monte Carlo sweep runs the simulation loop of 'trading_sim_tests.py'
+# for many parameter sets and seeds in a process pool and returns a
+# compact price/return summary per run
+#
+#####################################################################
+
+import contextlib
+import io
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import sim_traders
+from exchange import build_exchange
+
+DEFAULT_CONFIG = {"backend": "levels",
+                  "algo": "pro rata",
+                  "periods": 500,
+                  # Random_Traders
+                  "n": 25,
+                  "p_market": 0.05,
+                  "p_limit": 0.08,
+                  "delete_factor": 3,
+                  "avg_ask_q": 75,
+                  "avg_bid_q": 75,
+                  "vectorized": True,
+                  # limit_orders
+                  "vola": 5,
+                  "dist": "normal",
+                  "df": 5,
+                  # market_orders
+                  "vola_q": 10,
+                  "dynamic": False}
+TRADER_PARAMS = ("n", "p_market", "p_limit", "delete_factor", "avg_ask_q", "avg_bid_q", "vectorized")
+LIMIT_PARAMS = ("vola", "dist", "df")
+MARKET_PARAMS = ("vola_q", "dynamic")
+
+
+def summary_dtype(n_stocks):
+    """
+    one row per run with one entry per stock in the price fields.
+    Returns are log returns of the closes of consecutive periods
+    """
+    return np.dtype([("Run", np.int64),
+                     ("Config", np.int64),
+                     ("Replication", np.int64),
+                     ("Last", np.float64, (n_stocks,)),
+                     ("Min", np.float64, (n_stocks,)),
+                     ("Max", np.float64, (n_stocks,)),
+                     ("Mean_Return", np.float64, (n_stocks,)),
+                     ("Volatility", np.float64, (n_stocks,)),
+                     ("Volume", np.int64, (n_stocks,)),
+                     ("Trades", np.int64, (n_stocks,))])
+
+
+def make_grid(base=None, **values):
+    """
+    returns one config per combination of the given parameter values
+    e.g. make_grid(base, p_market=[0.05, 0.1], vola=[2.5, 5]) gives 4 configs
+    @param base: dict or None: parameters that are the same for every config
+    @param values: lists of values per parameter
+    @return: list of dicts
+    """
+    base = dict(base or {})
+    names = list(values)
+    return [dict(base, **dict(zip(names, combination)))
+            for combination in itertools.product(*(values[name] for name in names))]
+
+
+def run_simulation(config, seed):
+    """
+    builds the full exchange from a config and runs the random traders for
+    config["periods"] periods
+    @param config: dict: stocks, starting_prices and any keys of DEFAULT_CONFIG
+    @param seed: int or np.random.SeedSequence: seed of the only random stream of the run
+    @return: tuple: Last, Min, Max, Mean_Return, Volatility, Volume, Trades per stock
+    """
+    config = dict(DEFAULT_CONFIG, **config)
+    rng = np.random.default_rng(seed)
+    interface = build_exchange(config["stocks"], config["starting_prices"], config["backend"], config["algo"])
+    trade_sim = sim_traders.Random_Traders(rng=rng, **{k: config[k] for k in TRADER_PARAMS})
+    with contextlib.redirect_stdout(io.StringIO()):
+        trade_sim.connect_interface(interface)
+    limit_kwargs = {k: config[k] for k in LIMIT_PARAMS}
+    market_kwargs = {k: config[k] for k in MARKET_PARAMS}
+    trade_rep = interface.trade_reporter
+    for _ in range(config["periods"]):
+        trade_sim.limit_orders(**limit_kwargs)
+        trade_sim.market_orders(**market_kwargs)
+        trade_sim.delete_order()
+        trade_rep.end_period()
+    bars = trade_rep.bars
+    close = bars.column("Close")
+    returns = np.diff(np.log(close), axis=0)
+    return (close[-1].copy(),
+            bars.column("Low").min(axis=0),
+            bars.column("High").max(axis=0),
+            returns.mean(axis=0),
+            returns.std(axis=0),
+            bars.column("Volume").sum(axis=0),
+            bars.column("Trades").sum(axis=0))
+
+
+def run_task(task):
+    return run_simulation(*task)
+
+
+def sweep(configs, replications=1, seed=0, n_workers=None, chunksize=1):
+    """
+    runs every config replications times. Run i gets the i-th child of
+    SeedSequence(seed), so the results do not depend on the number of workers
+    @param configs: dict or list of dicts: see run_simulation, all configs must trade the same stocks
+    @param replications: int: runs per config
+    @param seed: int: root seed of the sweep
+    @param n_workers: int or None: number of processes, number of cpus if None, 1 runs in this process
+    @param chunksize: int: runs sent to a worker at once
+    @return: np.array: structured array with one summary row per run, see summary_dtype
+    """
+    if isinstance(configs, dict):
+        configs = [configs]
+    n_stocks = len(configs[0]["stocks"])
+    if any(len(config["stocks"]) != n_stocks for config in configs):
+        raise ValueError("All configs of a sweep must trade the same number of stocks.")
+    runs = [(c, r) for c in range(len(configs)) for r in range(replications)]
+    seeds = np.random.SeedSequence(seed).spawn(len(runs))
+    tasks = [(configs[c], s) for (c, _), s in zip(runs, seeds)]
+    if n_workers == 1:
+        results = map(run_task, tasks)
+        return collect_summaries(runs, results, n_stocks)
+    with ProcessPoolExecutor(n_workers) as pool:
+        results = pool.map(run_task, tasks, chunksize=chunksize)
+        return collect_summaries(runs, results, n_stocks)
+
+
+def collect_summaries(runs, results, n_stocks):
+    summary = np.empty(len(runs), dtype=summary_dtype(n_stocks))
+    summary["Run"] = np.arange(len(runs))
+    summary["Config"] = [c for c, _ in runs]
+    summary["Replication"] = [r for _, r in runs]
+    fields = summary.dtype.names[3:]
+    for i, result in enumerate(results):
+        for name, values in zip(fields, result):
+            summary[name][i] = values
+    return summary
@@ -0,0 +1,99 @@
+#####################################################################
+#
+# Tests of saving and restoring the complete exchange state
+#
+# python -m pytest test_checkpoint.py
+#
+#####################################################################
+
+import contextlib
+import io
+import os
+import numpy as np
+
+import risk
+import trader
+from checkpoint import load_checkpoint, save_checkpoint
+from exchange import build_exchange
+
+STOCKS = ["A", "B"]
+
+
+def trade(interface, rng, n):
+    """
+    sends n random limit, market and stop orders, cancels and modifies of two traders
+    and random traders, prices have more decimals than the book keeps
+    """
+    stocks = interface.book.stock_list
+    for _ in range(n):
+        stock = stocks[rng.integers(len(stocks))]
+        side = ["bid", "ask"][rng.integers(2)]
+        trader_id = int(rng.integers(-1, 2))
+        p = round(100. + rng.normal(0, 2), 3)
+        q = int(rng.integers(1, 20))
+        kind = rng.random()
+        if kind < 0.6:
+            interface.send_order(stock, side, q, trader_id, p)
+        elif kind < 0.7:
+            interface.send_order(stock, side, q, trader_id)
+        elif kind < 0.8:
+            interface.stop_order(stock, side, p + (3 if side == "bid" else -3), q, trader_id)
+        elif kind < 0.9:
+            interface.cancel(int(rng.integers(len(interface.book.order_trader) + 1)))
+        else:
+            interface.replace(int(rng.integers(len(interface.book.order_trader) + 1)), p, q)
+        if rng.random() < 0.05:
+            interface.trade_reporter.end_period()
+    return None
+
+
+def state(interface):
+    """
+    everything that has to continue identically after a restore
+    """
+    book = interface.book
+    manager = interface.risk
+    return {"book": [book.book[s][side].resting_orders() for s in STOCKS for side in ["bid", "ask"]],
+            "decimals": [book.book[s][side].decimals for s in STOCKS for side in ["bid", "ask"]],
+            "trades": interface.trade_reporter.trades().tolist(),
+            "cash": [t.cash for t in interface.traders],
+            "positions": [t.positions.tolist() for t in interface.traders],
+            "risk": [getattr(manager, name).tolist() for name in ["positions", "open", "open_notional", "orders"]],
+            "live": sorted((k, tuple(v)) for k, v in manager.live.items())}
+
+
+def assert_same(a, b):
+    for key in a:
+        if key == "book":
+            for x, y in zip(a[key], b[key]):
+                for u, v in zip(x, y):
+                    np.testing.assert_array_equal(u, v)
+        else:
+            assert a[key] == b[key], key
+
+
+def test_round_trip_continues_identically(tmp_path):
+    with contextlib.redirect_stdout(io.StringIO()):
+        original = build_exchange(STOCKS, [100., 100.], traders=[trader.Trader(), trader.Trader()], decimals=2)
+        original.connect_risk(risk.RiskManager(STOCKS))
+        trade(original, np.random.default_rng(1), 2000)
+        path = str(tmp_path / "warm")
+        save_checkpoint(original, path)
+        assert os.listdir(tmp_path) == ["warm"]
+        restored = load_checkpoint(path)
+    assert restored.book.decimals == 2
+    assert_same(state(original), state(restored))
+    with contextlib.redirect_stdout(io.StringIO()):
+        trade(original, np.random.default_rng(2), 2000)
+        trade(restored, np.random.default_rng(2), 2000)
+    assert_same(state(original), state(restored))
+
+
+def test_restore_without_risk(tmp_path):
+    with contextlib.redirect_stdout(io.StringIO()):
+        original = build_exchange(STOCKS, [100., 100.])
+        original.send_order("A", "bid", 5, -1, 99.5)
+        save_checkpoint(original, str(tmp_path / "plain.npz"))
+        restored = load_checkpoint(str(tmp_path / "plain.npz"))
+    assert restored.risk is None
+    assert restored.resting_quantity("A", "bid", 0) == 5
@@ -0,0 +1,69 @@
+#####################################################################
+#
+# Tests of deferred fill delivery: traders hear of their fills only
+# after the order that caused them finished matching
+#
+# python -m pytest test_deferred_fills.py
+#
+#####################################################################
+
+import contextlib
+import io
+import pytest
+
+import trader
+from exchange import build_exchange
+
+
+class RecordingTrader(trader.Trader):
+    """
+    notes how many trades are on the tape whenever a fill arrives
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.seen = []
+
+    def filled_order_info(self, stock, p, q, direction):
+        super().filled_order_info(stock, p, q, direction)
+        self.seen.append((p, q, direction, len(self.interface.trade_reporter.trades())))
+        return None
+
+
+@pytest.fixture(params=["levels", "dataframe"])
+def market(request):
+    maker, taker = RecordingTrader(), RecordingTrader()
+    with contextlib.redirect_stdout(io.StringIO()):
+        interface = build_exchange(["A"], [100.], backend=request.param, traders=[maker, taker])
+    return interface, maker, taker
+
+
+def test_fills_arrive_after_the_sweep(market):
+    interface, maker, taker = market
+    for p in [100., 101., 102.]:
+        interface.send_order("A", "ask", 5, maker.trader_id, p)
+    interface.send_order("A", "bid", 12, taker.trader_id)
+    # all three levels were matched before the first fill was delivered
+    assert [s[3] for s in maker.seen] == [3, 3, 3]
+    assert [(p, q) for p, q, _, _ in taker.seen] == [(100., 5), (101., 5), (102., 2)]
+    assert not interface.pending_fills
+    assert maker.positions.tolist() == [-12] and taker.positions.tolist() == [12]
+
+
+def test_orderbook_entry_points_deliver_fills(market):
+    interface, maker, taker = market
+    book = interface.book
+    interface.send_order("A", "ask", 5, maker.trader_id, 100.)
+    interface.send_order("A", "ask", 5, maker.trader_id, 101.)
+    book.add_bid("A", 100., 3, taker.trader_id)
+    assert maker.positions.tolist() == [-3] and taker.positions.tolist() == [3]
+    bid = interface.send_order("A", "bid", 4, maker.trader_id, 99.)[0]
+    book.add_ask("A", 99., 2, taker.trader_id)
+    assert maker.positions.tolist() == [-1] and taker.positions.tolist() == [1]
+    assert interface.resting_quantity("A", "bid", bid) == 2
+    # a replace that crosses the book matches again and delivers its fills as well
+    order_id = interface.send_order("A", "bid", 3, taker.trader_id, 98.)[0]
+    book.replace_order(order_id, new_p=101.)
+    assert maker.positions.tolist() == [-4] and taker.positions.tolist() == [4]
+    assert not interface.pending_fills
+    assert [s[3] for s in taker.seen[-2:]] == [len(interface.trade_reporter.trades())]*2
@@ -0,0 +1,140 @@
+#####################################################################
+#
+# Tests of the order-entry gateway with local client stand-ins
+#
+# python -m pytest test_gateway.py
+#
+#####################################################################
+
+import asyncio
+import contextlib
+import io
+import math
+
+from exchange import build_exchange
+from gateway import Gateway, GatewayClient
+
+
+def run(test):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return asyncio.run(asyncio.wait_for(test(), 10))
+
+
+async def start_gateway():
+    interface = build_exchange(["A", "B"], [100., 50.])
+    gateway = Gateway(interface, batch_interval=0.0001)
+    server = await gateway.start()
+    return interface, gateway, server.sockets[0].getsockname()[1]
+
+
+def test_login_and_crossing_order():
+    async def test():
+        interface, gateway, port = await start_gateway()
+        maker, taker = GatewayClient(), GatewayClient()
+        assert await maker.connect(port=port) == 0
+        assert await taker.connect(port=port) == 1
+        assert taker.n_stocks == 2
+        order_id, q, p = await maker.order(0, "ask", 10, 100.)
+        assert order_id >= 0 and q == 0 and math.isnan(p)
+        order_id, q, p = await taker.order(0, "bid", 4, 101.)
+        assert (q, p) == (4, 100.)
+        assert await asyncio.wait_for(taker.fills.get(), 1) == (0, 1, 100., 4)
+        assert await asyncio.wait_for(maker.fills.get(), 1) == (0, -1, 100., 4)
+        assert interface.traders[1].positions.tolist() == [4, 0]
+        await maker.close()
+        await taker.close()
+        await gateway.close()
+    run(test)
+
+
+def test_cancel_of_other_session_is_refused():
+    async def test():
+        interface, gateway, port = await start_gateway()
+        owner, other = GatewayClient(), GatewayClient()
+        await owner.connect(port=port)
+        await other.connect(port=port)
+        order_id, q, p = await owner.order(1, "bid", 5, 49.)
+        assert tuple(await other.cancel(order_id)) == (order_id, 0)
+        assert interface.resting_quantity("B", "bid", order_id) == 5
+        assert tuple(await other.cancel(10**9)) == (10**9, 0)
+        assert tuple(await owner.cancel(order_id)) == (order_id, 1)
+        assert interface.resting_quantity("B", "bid", order_id) == 0
+        await owner.close()
+        await other.close()
+        await gateway.close()
+    run(test)
+
+
+def test_disconnect_cancels_resting_orders():
+    async def test():
+        interface, gateway, port = await start_gateway()
+        client = GatewayClient()
+        await client.connect(port=port)
+        resting = [(await client.order(0, "bid", 5, 90. + i))[0] for i in range(3)]
+        assert [interface.resting_quantity("A", "bid", i) for i in resting] == [5, 5, 5]
+        await client.close()
+        for _ in range(100):
+            if not gateway.sessions:
+                break
+            await asyncio.sleep(0.01)
+        assert [interface.resting_quantity("A", "bid", i) for i in resting] == [0, 0, 0]
+        await gateway.close()
+    run(test)
+
+
+def test_close_awaits_handlers():
+    async def test():
+        interface, gateway, port = await start_gateway()
+        clients = [GatewayClient() for _ in range(3)]
+        for client in clients:
+            await client.connect(port=port)
+        order_id = (await clients[0].order(0, "ask", 5, 110.))[0]
+        tasks = [session.task for session in gateway.sessions]
+        batcher = gateway.batcher
+        await gateway.close()
+        assert all(task.done() for task in tasks)
+        assert batcher.done() and gateway.batcher is None
+        assert not gateway.sessions
+        assert interface.resting_quantity("A", "ask", order_id) == 0
+        for client in clients:
+            await client.close()
+    run(test)
+
+
+def test_failed_batch_rejects_and_withdraws_orders():
+    async def test():
+        interface, gateway, port = await start_gateway()
+        client = GatewayClient()
+        await client.connect(port=port)
+        engine = interface.book.matching_engine
+        check_trades = engine.check_trades
+        def fail(stock=None):
+            raise RuntimeError("matching failed")
+        engine.check_trades = fail
+        first = len(interface.book.order_trader)
+        assert (await client.order(0, "bid", 5, 95.))[0] == -1
+        # the order entered the book before matching failed and was cancelled again
+        assert interface.resting_quantity("A", "bid", first) == 0
+        engine.check_trades = check_trades
+        order_id = (await client.order(0, "bid", 5, 95.))[0]
+        assert interface.resting_quantity("A", "bid", order_id) == 5
+        await client.close()
+        await gateway.close()
+    run(test)
+
+
+def test_session_orders_stay_bounded():
+    async def test():
+        interface, gateway, port = await start_gateway()
+        maker, taker = GatewayClient(), GatewayClient()
+        await maker.connect(port=port)
+        await taker.connect(port=port)
+        for _ in range(300):
+            await maker.order(0, "ask", 1, 100.)
+            await taker.order(0, "bid", 1, 100.)
+        session = next(s for s in gateway.sessions if s.trader.trader_id == maker.trader_id)
+        assert len(session.orders) <= 64
+        await maker.close()
+        await taker.close()
+        await gateway.close()
+    run(test)
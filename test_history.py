@@ -0,0 +1,89 @@
+#####################################################################
+#
+# Tests of the history sink: bounded memory and a contiguous history
+# across the segments on disk and the window in memory
+#
+# python -m pytest test_history.py
+#
+#####################################################################
+
+import contextlib
+import io
+import numpy as np
+
+import sim_traders
+import trader
+from exchange import build_exchange
+from history import HistorySink, iter_history, read_history, read_index
+
+STOCKS = ["A", "B", "C"]
+
+
+def run(periods, directory=None):
+    """
+    trades random traders and one Trader for a number of periods, with a history
+    sink in directory or with unbounded in-memory history if directory is None
+    """
+    t = trader.Trader()
+    with contextlib.redirect_stdout(io.StringIO()):
+        interface = build_exchange(STOCKS, [100., 50., 20.], traders=[t])
+        sink = None
+        if directory is not None:
+            sink = HistorySink(directory, window=200, chunk=300, bar_window=8, bar_chunk=16)
+            interface.connect_history(sink)
+        random_traders = sim_traders.Random_Traders(n=100, rng=np.random.default_rng(4))
+        random_traders.connect_interface(interface)
+        rng = np.random.default_rng(5)
+        for _ in range(periods):
+            random_traders.limit_orders(vola=3)
+            random_traders.market_orders()
+            random_traders.delete_order()
+            for _ in range(10):
+                stock = STOCKS[rng.integers(len(STOCKS))]
+                interface.send_order(stock, ["bid", "ask"][rng.integers(2)], 10, t.trader_id)
+            interface.trade_reporter.end_period()
+    return interface, t, sink
+
+
+def test_memory_stays_bounded(tmp_path):
+    interface, t, sink = run(60, str(tmp_path))
+    tape = interface.trade_reporter.tape
+    sizes = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        random_traders = sim_traders.Random_Traders(n=100, rng=np.random.default_rng(6))
+        random_traders.connect_interface(interface)
+        for _ in range(60):
+            random_traders.limit_orders(vola=3)
+            random_traders.market_orders()
+            interface.trade_reporter.end_period()
+            sizes.append(len(tape.data))
+    assert tape.offset > 0
+    assert max(sizes) == 200 + 300
+    assert len(interface.trade_reporter.bars.buffer.data) == 8 + 16
+    assert t.fills.offset > 0 and len(t.fills.data) == 200 + 300
+    assert interface.trade_reporter.bars.buffer.offset > 0
+
+
+def test_read_is_contiguous_across_disk_and_memory(tmp_path):
+    unbounded, t_unbounded, _ = run(60)
+    interface, t, sink = run(60, str(tmp_path))
+    full = unbounded.trade_reporter.trades()
+    tape = interface.trade_reporter.tape
+    assert 0 < tape.offset < len(full)
+    np.testing.assert_array_equal(sink.read("trades"), full)
+    boundary = tape.offset
+    for start, stop in [(0, 10), (boundary - 5, boundary + 5), (boundary, boundary + 1),
+                        (boundary - 1, boundary), (7, len(full)), (len(full) - 3, None)]:
+        np.testing.assert_array_equal(sink.read("trades", start, stop), full[start:stop])
+    # the segments on disk followed by the window in memory are the whole tape
+    spilled = list(iter_history(str(tmp_path), "trades"))
+    assert sum(len(part) for part in spilled) == boundary
+    np.testing.assert_array_equal(np.concatenate(spilled + [tape.view()]), full)
+    assert read_index(str(tmp_path), "trades")[0]["start"] == 0
+    np.testing.assert_array_equal(read_history(str(tmp_path), "trades", 3, 9), full[3:9])
+    np.testing.assert_array_equal(sink.read("bars"), unbounded.trade_reporter.bars.buffer.view())
+    name = "fills_%i"%t.trader_id
+    np.testing.assert_array_equal(sink.read(name), t_unbounded.fills.view())
+    # after close everything is on disk
+    sink.close()
+    np.testing.assert_array_equal(np.concatenate(list(iter_history(str(tmp_path), "trades"))), full)
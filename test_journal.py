@@ -0,0 +1,70 @@
+#####################################################################
+#
+# Tests of the binary event journal: replaying a recorded journal has
+# to reproduce the trade tape exactly
+#
+# python -m pytest test_journal.py
+#
+#####################################################################
+
+import contextlib
+import io
+import numpy as np
+import pytest
+
+import sim_traders
+from exchange import build_exchange
+from journal import FILL, EventJournal, read_journal, replay
+
+STOCKS = ["A", "B", "C"]
+STARTING_PRICES = [100., 50., 20.]
+
+
+def record(path, backend, periods):
+    """
+    runs random traders and every order type on an exchange that records a journal
+    """
+    with contextlib.redirect_stdout(io.StringIO()):
+        interface = build_exchange(STOCKS, STARTING_PRICES, backend=backend)
+        journal = EventJournal(path, len(STOCKS), buffer_size=256)
+        interface.book.connect_journal(journal)
+        random_traders = sim_traders.Random_Traders(n=100, rng=np.random.default_rng(3))
+        random_traders.connect_interface(interface)
+        for k in range(periods):
+            random_traders.limit_orders(vola=3)
+            random_traders.market_orders()
+            random_traders.delete_order()
+            stock = STOCKS[k % len(STOCKS)]
+            last = interface.trade_reporter.last_price(stock)
+            interface.stop_bid(stock, last + 1, 50, -1)
+            interface.stop_ask(stock, last - 1, 50, -1, last - 3)
+            order_id = interface.limit_bid(stock, last - 2, 100, -1)[0]
+            interface.replace(order_id, new_p=last - 1.5)
+            interface.replace(order_id, new_q=40)
+            interface.ioc_ask(stock, last - 1, 30, -1)
+            interface.fok_bid(stock, last + 1, 60, -1)
+            interface.book.add_ask(stock, last + 0.5, 20, -1)
+            interface.trade_reporter.end_period()
+        journal.close()
+    return interface
+
+
+@pytest.mark.parametrize("backend,periods", [("levels", 20), ("dataframe", 4)])
+@pytest.mark.parametrize("chunk_size", [65536, 7])
+def test_replay_reproduces_trade_tape(tmp_path, backend, periods, chunk_size):
+    path = str(tmp_path / "journal.bin")
+    original = record(path, backend, periods)
+    with contextlib.redirect_stdout(io.StringIO()):
+        replayed = build_exchange(STOCKS, STARTING_PRICES, backend=backend)
+        seen = []
+        assert replay(path, replayed, on_period=seen.append, chunk_size=chunk_size) == periods
+    assert seen == list(range(1, periods + 1))
+    trades = original.trade_reporter.trades()
+    assert len(trades) > 0
+    np.testing.assert_array_equal(replayed.trade_reporter.trades(), trades)
+    np.testing.assert_array_equal(replayed.trade_reporter.bars.buffer.view(), original.trade_reporter.bars.buffer.view())
+    # the recorded fills are the makers of the trade tape
+    fills = read_journal(path)
+    fills = fills[fills["Event"] == FILL]
+    np.testing.assert_array_equal(fills["Order_ID"], trades["Maker_ID"])
+    np.testing.assert_array_equal(fills["Quantity"], trades["Quantity"])
@@ -0,0 +1,106 @@
+#####################################################################
+#
+# Tests of the matching algorithms and of the single-pass sweep of
+# incoming orders in the matching engine
+#
+# python -m pytest test_matching.py
+#
+#####################################################################
+
+import contextlib
+import io
+import math
+import numpy as np
+import pytest
+
+from exchange import build_exchange
+from matching_algorithms import FIFO, ProRata, get_algorithm
+
+BACKENDS = ["levels", "dataframe"]
+ALGOS = ["pro rata", "fifo"]
+
+
+@pytest.mark.parametrize("algo", [FIFO(), ProRata()])
+def test_allocations_sum_to_q(algo):
+    rng = np.random.default_rng(0)
+    for _ in range(500):
+        quantities = rng.integers(1, 100, rng.integers(1, 20))
+        q = int(rng.integers(1, quantities.sum() + 1))
+        fills = algo.allocate(quantities, q)
+        assert fills.sum() == q
+        assert (fills >= 0).all() and (fills <= quantities).all()
+    quantities = np.array([3, 4])
+    np.testing.assert_array_equal(algo.allocate(quantities, 10), quantities)
+
+
+def test_fifo_fills_in_time_priority():
+    np.testing.assert_array_equal(FIFO().allocate(np.array([5, 3, 4]), 7), [5, 2, 0])
+
+
+def test_pro_rata_leftover_lots_in_time_priority():
+    # shares of 10 lots over 4, 4, 4 round down to 3, 3, 3, the leftover lot goes to the oldest order
+    np.testing.assert_array_equal(ProRata().allocate(np.array([4, 4, 4]), 10), [4, 3, 3])
+    np.testing.assert_array_equal(ProRata().allocate(np.array([2, 6, 2]), 5), [1, 3, 1])
+    # full orders are skipped when the leftover lots are handed out
+    np.testing.assert_array_equal(ProRata().allocate(np.array([1, 10, 10]), 4), [1, 2, 1])
+
+
+def test_get_algorithm():
+    assert isinstance(get_algorithm("fifo"), FIFO)
+    algo = ProRata()
+    assert get_algorithm(algo) is algo
+    with pytest.raises(ValueError):
+        get_algorithm("auction")
+
+
+def exchange(backend, algo="pro rata", decimals=4):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return build_exchange(["A"], [100.], backend=backend, algo=algo, decimals=decimals)
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+@pytest.mark.parametrize("algo", ALGOS)
+def test_sweep_returns_vwap(backend, algo):
+    interface = exchange(backend, algo)
+    for p, q in [(100., 5), (100., 5), (101., 10), (102., 10)]:
+        interface.send_order("A", "ask", q, -1, p)
+    order_id, executed, vwap = interface.send_order("A", "bid", 25, -1)
+    assert executed == 25
+    assert vwap == pytest.approx((10*100. + 10*101. + 5*102.)/25)
+    trades = interface.trade_reporter.trades()
+    assert trades["Quantity"].sum() == 25
+    assert (trades["Taker_ID"] == order_id).all()
+    assert interface.book.book["A"]["ask"].total_quantity() == 5
+    # a limit stops the sweep at its price and rests the rest
+    order_id, executed, vwap = interface.send_order("A", "bid", 10, -1, 101.)
+    assert executed == 0 and math.isnan(vwap)
+    assert interface.resting_quantity("A", "bid", order_id) == 10
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_market_order_rest_is_dropped(backend):
+    interface = exchange(backend)
+    interface.send_order("A", "ask", 5, -1, 100.)
+    order_id, executed, vwap = interface.send_order("A", "bid", 8, -1)
+    assert (executed, vwap) == (5, 100.)
+    assert len(interface.book.book["A"]["bid"]) == 0
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_limit_rests_at_rounded_price(backend):
+    interface = exchange(backend, decimals=2)
+    interface.send_order("A", "ask", 5, -1, 100.)
+    # 99.996 rounds to 100.00, so the bid trades instead of resting crossed below the ask
+    order_id, executed, vwap = interface.send_order("A", "bid", 8, -1, 99.996)
+    assert (executed, vwap) == (5, 100.)
+    assert interface.book.book["A"]["bid"].entry(order_id).Price == 100.
+    # 100.004 rounds to 100.00 as well, trades against the resting bid and rests the rest
+    ask = interface.send_order("A", "ask", 4, -1, 100.004)[0]
+    assert interface.resting_quantity("A", "bid", order_id) == 0
+    book = interface.book.book["A"]
+    assert tuple(book["ask"].entry(ask)) == (ask, 100., 1)
+    interface.send_order("A", "bid", 2, -1, 99.996)
+    assert len(book["ask"]) == 0 and book["bid"].best_price() == 100.
+    interface.send_order("A", "ask", 3, -1, 100.006)
+    assert book["bid"].best_price() < book["ask"].best_price() == 100.01
+    assert interface.book.matching_engine.available_quantity("A", "bid", 100.006) == 3
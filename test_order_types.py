@@ -0,0 +1,128 @@
+#####################################################################
+#
+# Tests of stop, immediate-or-cancel and fill-or-kill orders
+#
+# python -m pytest test_order_types.py
+#
+#####################################################################
+
+import contextlib
+import io
+import pytest
+
+from exchange import build_exchange
+from stop_orders import StopBook, StopOrder
+
+BACKENDS = ["levels", "dataframe"]
+
+
+def exchange(backend):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return build_exchange(["A"], [100.], backend=backend)
+
+
+def test_stop_book_fires_crossed_triggers_only():
+    stops = StopBook(["A"])
+    for order_id, side, trigger in [(0, "bid", 101.), (1, "bid", 103.), (2, "bid", 102.),
+                                    (3, "ask", 99.), (4, "ask", 97.), (5, "ask", 98.)]:
+        stops.add(StopOrder(order_id, "A", side, trigger, 1, -1, None))
+    stops.trigger("A", 100.)
+    assert not stops.pending
+    stops.trigger("A", 102.)
+    assert [stop.Order_ID for stop in stops.pending] == [0, 2]
+    stops.pending.clear()
+    stops.trigger("A", 98.)
+    # sell stops fire from the highest trigger down
+    assert [stop.Order_ID for stop in stops.pending] == [3, 5]
+    assert sorted(stops.index) == [1, 4]
+    assert stops.remove(4).Trigger == 97.
+    assert stops.remove(4) is None
+    stops.pending.clear()
+    stops.trigger("A", 50.)
+    assert not stops.pending
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_stop_triggers_on_trade_through_trigger(backend):
+    interface = exchange(backend)
+    interface.send_order("A", "ask", 5, -1, 100.)
+    interface.send_order("A", "ask", 5, -1, 101.)
+    interface.send_order("A", "ask", 5, -1, 102.)
+    stop = interface.stop_order("A", "bid", 101., 5, -1)
+    interface.send_order("A", "bid", 5, -1)
+    # the trade at 100 does not reach the trigger
+    assert stop in interface.book.stops
+    assert interface.book.book["A"]["ask"].total_quantity() == 10
+    interface.send_order("A", "bid", 3, -1)
+    # the trade at 101 fires the stop, it buys the remaining 2 at 101 and 3 at 102
+    assert stop not in interface.book.stops
+    trades = interface.trade_reporter.trades()
+    assert trades["Price"].tolist() == [100., 101., 101., 102.]
+    assert trades["Taker_ID"].tolist()[-2:] == [stop, stop]
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_stops_cascade(backend):
+    interface = exchange(backend)
+    for p in [99., 98., 97.]:
+        interface.send_order("A", "bid", 5, -1, p)
+    first = interface.stop_order("A", "ask", 99., 5, -1)
+    second = interface.stop_order("A", "ask", 98., 5, -1)
+    interface.send_order("A", "ask", 5, -1)
+    # the sell at 99 fires the first stop, its trade at 98 fires the second
+    trades = interface.trade_reporter.trades()
+    assert trades["Price"].tolist() == [99., 98., 97.]
+    assert trades["Taker_ID"].tolist()[1:] == [first, second]
+    assert len(interface.book.stops) == 0
+    assert len(interface.book.book["A"]["bid"]) == 0
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_stop_limit_rests_and_pending_stop_cancels(backend):
+    interface = exchange(backend)
+    interface.send_order("A", "ask", 5, -1, 100.)
+    interface.send_order("A", "ask", 5, -1, 101.)
+    # a stop whose trigger the last price already reached fires right away
+    fired = interface.stop_order("A", "ask", 100., 2, -1, 99.)
+    assert fired not in interface.book.stops
+    assert interface.resting_quantity("A", "ask", fired) == 2
+    interface.cancel(fired)
+    stop = interface.stop_order("A", "bid", 101., 8, -1, 101.5)
+    cancelled = interface.stop_order("A", "bid", 100.5, 8, -1)
+    assert interface.cancel(cancelled)
+    assert not interface.cancel(cancelled)
+    interface.send_order("A", "bid", 6, -1)
+    # the stop limit buys the remaining 4 at 101 and rests the rest at its limit
+    assert interface.resting_quantity("A", "bid", stop) == 4
+    assert interface.book.book["A"]["bid"].entry(stop).Price == 101.5
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_ioc_rest_is_dropped(backend):
+    interface = exchange(backend)
+    interface.send_order("A", "ask", 5, -1, 100.)
+    interface.send_order("A", "ask", 5, -1, 102.)
+    order_id, executed, vwap = interface.ioc_bid("A", 101., 8, -1)
+    assert (executed, vwap) == (5, 100.)
+    assert order_id not in interface.book.book["A"]["bid"]
+    assert len(interface.book.book["A"]["bid"]) == 0
+    order_id, executed, vwap = interface.ioc_ask("A", 99., 4, -1)
+    assert executed == 0
+    assert len(interface.book.book["A"]["ask"]) == 1
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_fok_is_killed_without_touching_the_book(backend):
+    interface = exchange(backend)
+    interface.send_order("A", "ask", 5, -1, 100.)
+    interface.send_order("A", "ask", 5, -1, 102.)
+    orders = len(interface.book.order_trader)
+    version = interface.book.book["A"]["ask"].version
+    assert interface.fok_bid("A", 101., 8, -1) is None
+    assert interface.fok_ask("A", 99., 1, -1) is None
+    assert len(interface.book.order_trader) == orders
+    assert interface.book.book["A"]["ask"].version == version
+    assert len(interface.trade_reporter.trades()) == 0
+    order_id, executed, vwap = interface.fok_bid("A", 102., 8, -1)
+    assert executed == 8 and vwap == pytest.approx((5*100. + 3*102.)/8)
+    assert order_id not in interface.book.book["A"]["bid"]
@@ -0,0 +1,167 @@
+#####################################################################
+#
+# Tests of the orderbook backends: cancel and replace with lazy
+# deletion, order id lookups and equal trades on both backends
+#
+# python -m pytest test_orderbook.py
+#
+#####################################################################
+
+import contextlib
+import io
+import os
+import subprocess
+import sys
+import numpy as np
+import pytest
+
+import trader
+from exchange import build_exchange
+from orderbook import backend_class
+
+BACKENDS = ["levels", "dataframe"]
+
+
+def exchange(backend, traders=()):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return build_exchange(["A", "B"], [100., 50.], backend=backend, traders=list(traders))
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_remove_keeps_queue_of_the_level(backend):
+    side = backend_class(backend)("bid")
+    for order_id in range(4):
+        side.add(order_id, 99., 10)
+    side.add(4, 98., 10)
+    assert side.remove(1).Quantity == 10
+    assert side.remove(1) is None
+    assert 1 not in side and len(side) == 4
+    assert side.level_orders(99.)[0] == [0, 2, 3]
+    assert side.best_level_quantity() == 30
+    side.remove(0)
+    assert side.best().Order_ID == 2
+    side.remove(2)
+    side.remove(3)
+    assert side.best_price() == 98.
+    assert side.total_quantity() == 10
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_replace_priority(backend):
+    interface = exchange(backend)
+    book = interface.book
+    first = interface.send_order("A", "bid", 10, -1, 99.)[0]
+    second = interface.send_order("A", "bid", 10, -1, 99.)[0]
+    # less quantity keeps the place in the queue
+    assert book.replace_order(first, new_q=5) == first
+    assert book.book["A"]["bid"].level_orders(99.)[0] == [first, second]
+    assert interface.resting_quantity("A", "bid", first) == 5
+    # more quantity goes to the end of the queue
+    book.replace_order(first, new_q=8)
+    assert book.book["A"]["bid"].level_orders(99.)[0] == [second, first]
+    # a new price goes to the end of the queue of the new level
+    book.replace_order(second, new_p=98.)
+    book.replace_order(second, new_p=99.)
+    assert book.book["A"]["bid"].level_orders(99.)[0] == [first, second]
+    # a price that crosses the book is matched right away
+    ask = interface.send_order("A", "ask", 4, -1, 101.)[0]
+    book.replace_order(first, new_p=101.)
+    assert interface.resting_quantity("A", "ask", ask) == 0
+    assert interface.resting_quantity("A", "bid", first) == 4
+    # quantity 0 cancels, unknown orders are not replaced
+    book.replace_order(first, new_q=0)
+    assert first not in book.book["A"]["bid"]
+    assert book.replace_order(first, new_q=3) is None
+    assert book.replace_order(10**9, new_q=3) is None
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_alter_bid_and_ask(backend):
+    interface = exchange(backend)
+    book = interface.book
+    bid = interface.send_order("B", "bid", 10, -1, 49.)[0]
+    ask = interface.send_order("B", "ask", 10, -1, 51.)[0]
+    assert book.alter_bid("B", bid, new_q=7) == bid
+    assert book.alter_ask("B", ask, new_p=52.) == ask
+    assert interface.resting_quantity("B", "bid", bid) == 7
+    assert book.book["B"]["ask"].entry(ask).Price == 52.
+    assert book.alter_ask("B", ask, new_q=6, new_p=53.) == ask
+    assert tuple(book.book["B"]["ask"].entry(ask))[1:] == (53., 6)
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_cancel_many_cancels_duplicates_once(backend):
+    interface = exchange(backend)
+    ids = [interface.send_order("A", "ask", 5, -1, 101. + i)[0] for i in range(3)]
+    order_ids, cancelled = interface.cancel_many([ids[0], ids[2], ids[0], 10**9])
+    assert order_ids.tolist() == [ids[0], ids[2], 10**9]
+    assert cancelled.tolist() == [True, True, False]
+    assert interface.book.book["A"]["ask"].order_ids() == [ids[1]]
+    order_ids, cancelled = interface.cancel_many([ids[0]])
+    assert cancelled.tolist() == [False]
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_unknown_order_ids(backend):
+    t = trader.Trader()
+    interface = exchange(backend, [t])
+    order_id = interface.send_order("A", "bid", 5, -1, 99.)[0]
+    book = interface.book
+    assert book.locate_order(order_id) == ("A", "bid")
+    for unknown in [-1, -2, order_id + 1, 10**9]:
+        assert book.locate_order(unknown) is None
+        assert book.cancel_order(unknown) is None
+        assert book.replace_order(unknown, new_q=1) is None
+        assert interface.cancel(unknown) is False
+        with contextlib.redirect_stdout(io.StringIO()):
+            assert t.cancel(unknown) is False
+    # ids that exist but belong to someone else are refused as well
+    with contextlib.redirect_stdout(io.StringIO()):
+        assert t.cancel(order_id) is False
+    assert interface.resting_quantity("A", "bid", order_id) == 5
+
+
+def random_flow(interface, rng, n):
+    """
+    sends n random limit and market orders, cancels and modifies
+    """
+    for _ in range(n):
+        stock = ["A", "B"][rng.integers(2)]
+        side = ["bid", "ask"][rng.integers(2)]
+        mid = 100. if stock == "A" else 50.
+        kind = rng.random()
+        if kind < 0.7:
+            interface.send_order(stock, side, int(rng.integers(1, 30)), -1, round(mid + rng.normal(0, 1), 2))
+        elif kind < 0.8:
+            interface.send_order(stock, side, int(rng.integers(1, 30)), -1)
+        elif kind < 0.9:
+            interface.cancel(int(rng.integers(len(interface.book.order_trader))))
+        else:
+            interface.replace(int(rng.integers(len(interface.book.order_trader))),
+                              round(mid + rng.normal(0, 1), 2), int(rng.integers(1, 30)))
+    return None
+
+
+@pytest.mark.parametrize("algo", ["pro rata", "fifo"])
+def test_backends_give_the_same_trades(algo):
+    results = []
+    for backend in BACKENDS:
+        with contextlib.redirect_stdout(io.StringIO()):
+            interface = build_exchange(["A", "B"], [100., 50.], backend=backend, algo=algo)
+        interface.send_order("A", "bid", 10, -1, 99.)
+        random_flow(interface, np.random.default_rng(7), 800)
+        book = interface.book
+        results.append((interface.trade_reporter.trades().tolist(),
+                        [sorted(zip(*[a.tolist() for a in book.book[s][side].resting_orders()]))
+                         for s in ["A", "B"] for side in ["bid", "ask"]]))
+    assert len(results[0][0]) > 100
+    assert results[0] == results[1]
+
+
+def test_default_backend_does_not_import_pandas():
+    code = ("import sys, orderbook, exchange, inspect; "
+            "orderbook.Orderbook(['A']); "
+            "assert inspect.signature(exchange.build_exchange).parameters['backend'].default == "
+            "inspect.signature(orderbook.Orderbook).parameters['backend'].default == 'levels'; "
+            "assert 'pandas' not in sys.modules")
+    subprocess.run([sys.executable, "-c", code], check=True, cwd=os.path.dirname(os.path.abspath(__file__)))
@@ -0,0 +1,107 @@
+#####################################################################
+#
+# Tests of the pre-trade risk checks: the exposure cache has to stay
+# equal to a recomputation from the books, the stops and the ledgers
+#
+# python -m pytest test_risk.py
+#
+#####################################################################
+
+import contextlib
+import io
+import numpy as np
+import pytest
+
+import risk
+import trader
+from exchange import build_exchange
+
+STOCKS = ["A", "B"]
+SIDES = ["bid", "ask"]
+N_TRADERS = 3
+
+
+def recompute(interface):
+    """
+    positions, open quantities, open notional and live orders of every trader from scratch
+    """
+    book = interface.book
+    positions = np.array([t.positions for t in interface.traders])
+    open_q = np.zeros((2, N_TRADERS, len(STOCKS)), dtype=np.int64)
+    notional = np.zeros(N_TRADERS)
+    live = set()
+    for code, stock in enumerate(STOCKS):
+        for s, side in enumerate(SIDES):
+            for order_id, p, q in zip(*[a.tolist() for a in book.book[stock][side].resting_orders()]):
+                trader_id = book.order_trader[order_id]
+                if trader_id >= 0:
+                    open_q[s, trader_id, code] += q
+                    notional[trader_id] += p*q
+                    live.add(order_id)
+            for stop in book.stops.orders[stock][side]:
+                if stop.Trader_ID >= 0:
+                    open_q[s, stop.Trader_ID, code] += stop.Quantity
+                    notional[stop.Trader_ID] += 0. if stop.Limit is None else stop.Limit*stop.Quantity
+                    live.add(stop.Order_ID)
+    return positions, open_q, notional, live
+
+
+def assert_cache(interface, orders):
+    manager = interface.risk
+    positions, open_q, notional, live = recompute(interface)
+    np.testing.assert_array_equal(manager.positions[:N_TRADERS], positions)
+    np.testing.assert_array_equal(manager.open[:, :N_TRADERS], open_q)
+    np.testing.assert_allclose(manager.open_notional[:N_TRADERS], notional, atol=1e-6)
+    np.testing.assert_array_equal(manager.orders[:N_TRADERS], orders)
+    assert set(manager.live) == live
+
+
+@pytest.mark.parametrize("backend", ["levels", "dataframe"])
+def test_exposure_cache_matches_recomputation(backend):
+    rng = np.random.default_rng(11)
+    traders = [trader.Trader() for _ in range(N_TRADERS)]
+    with contextlib.redirect_stdout(io.StringIO()):
+        interface = build_exchange(STOCKS, [100., 50.], backend=backend, traders=traders)
+    manager = risk.RiskManager(STOCKS)
+    interface.connect_risk(manager)
+    manager.set_limits(1, max_position=60)
+    manager.set_limits(2, short_selling=False, max_open_notional=20000., max_orders=40)
+    orders = np.zeros(N_TRADERS, dtype=np.int64)
+    periods = 80 if backend == "levels" else 15
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(periods):
+            for _ in range(60):
+                code = int(rng.integers(len(STOCKS)))
+                stock, side = STOCKS[code], SIDES[rng.integers(2)]
+                mid = 100. if code == 0 else 50.
+                p = round(mid + rng.normal(0, 1), 2)
+                q = int(rng.integers(1, 15))
+                trader_id = int(rng.integers(-1, N_TRADERS))
+                kind = rng.random()
+                if kind < 0.45:
+                    accepted = interface.send_order(stock, side, q, trader_id, p) is not None
+                elif kind < 0.55:
+                    accepted = interface.send_order(stock, side, q, trader_id) is not None
+                elif kind < 0.65:
+                    accepted = interface.ioc_bid(stock, p, q, trader_id) is not None
+                elif kind < 0.75:
+                    trigger = p + (1.5 if side == "bid" else -1.5)
+                    accepted = interface.stop_order(stock, side, trigger, q, trader_id,
+                                                    p + 2 if rng.random() < 0.5 else None) is not None
+                elif kind < 0.85:
+                    interface.cancel(int(rng.integers(len(interface.book.order_trader))))
+                    accepted = False
+                else:
+                    order_id = int(rng.integers(len(interface.book.order_trader)))
+                    trader_id = interface.book.order_trader[order_id]
+                    new_p = p if rng.random() < 0.5 else None
+                    accepted = (order_id in manager.live
+                                and interface.replace(order_id, new_p, q) is not None)
+                if accepted and trader_id >= 0:
+                    orders[trader_id] += 1
+            assert_cache(interface, orders)
+            interface.trade_reporter.end_period()
+            orders[:] = 0
+            assert_cache(interface, orders)
+    assert manager.rejected > 0
+    assert len(interface.trade_reporter.trades()) > 100
@@ -0,0 +1,111 @@
+#####################################################################
+#
+# Tests of the discrete-event scheduler: timestamp batching, agent
+# latencies and the order flow fast path
+#
+# python -m pytest test_scheduler.py
+#
+#####################################################################
+
+import contextlib
+import io
+import numpy as np
+
+import scheduler
+from exchange import build_exchange
+
+
+def exchange():
+    with contextlib.redirect_stdout(io.StringIO()):
+        return build_exchange(["A", "B"], [100., 50.])
+
+
+def test_orders_within_one_tick_are_one_batch():
+    interface = exchange()
+    s = scheduler.Scheduler(interface, tick=1.)
+    acks = []
+    s.now = 0.1
+    s.submit("a", "A", "ask", 5, 99., on_ack=lambda *ack: acks.append(ack))
+    s.now = 0.6
+    s.submit("b", "A", "bid", 5, 101., on_ack=lambda *ack: acks.append(ack))
+    s.now = 0.
+    assert s.run() == 2
+    assert s.batches == 1 and s.now == 1.
+    # both orders rest first and are matched in one pass, each ack sees its own fill
+    assert [(q, p) for _, q, p in acks] == [(5, 99.), (5, 99.)]
+
+
+def test_orders_without_tick_are_matched_one_by_one():
+    interface = exchange()
+    s = scheduler.Scheduler(interface)
+    s.now = 0.1
+    s.submit("a", "A", "ask", 5, 99.)
+    s.now = 0.6
+    s.submit("b", "A", "bid", 5, 101.)
+    s.now = 0.
+    s.run()
+    assert s.batches == 2
+    assert interface.trade_reporter.trades()["Price"].tolist() == [99.]
+
+
+def test_flow_orders_of_one_timestamp_are_one_batch():
+    interface = exchange()
+    s = scheduler.Scheduler(interface)
+    s.add_flow([1., 1., 1., 2.], [0, 0, 1, 0], ["ask", "bid", "bid", "bid"], "limit", [99., 101., 49., 98.], 5)
+    assert s.run() == 4
+    assert s.batches == 2
+    assert interface.trade_reporter.trades()["Quantity"].tolist() == [5]
+
+
+def test_latency_orders_arrivals():
+    interface = exchange()
+    interface.send_order("A", "ask", 5, -1, 100.)
+    interface.send_order("A", "ask", 5, -1, 101.)
+    s = scheduler.Scheduler(interface)
+    s.set_latency("slow", scheduler.constant(0.5))
+    s.set_latency("fast", scheduler.constant(0.1))
+    acks = {}
+    s.submit("slow", "A", "bid", 5, order_type="market", on_ack=lambda *ack: acks.setdefault("slow", (s.now,) + ack))
+    s.submit("fast", "A", "bid", 5, order_type="market", on_ack=lambda *ack: acks.setdefault("fast", (s.now,) + ack))
+    s.run()
+    # the order sent first arrives last and gets the worse price
+    assert acks["fast"][0] == 0.1 and acks["fast"][-1] == 100.
+    assert acks["slow"][0] == 0.5 and acks["slow"][-1] == 101.
+
+
+def test_cancels_first_callbacks_last():
+    interface = exchange()
+    order_id = interface.send_order("A", "ask", 5, -1, 100.)[0]
+    s = scheduler.Scheduler(interface)
+    seen = []
+    s.schedule(1., lambda: seen.append(len(interface.trade_reporter.trades())))
+    s.add_flow([1.], [0], "bid", "market", np.nan, 5)
+    s.push(1., scheduler.CANCEL, order_id)
+    s.run()
+    # the cancel empties the book before the market order, the callback sees no trade
+    assert seen == [0]
+    assert interface.resting_quantity("A", "ask", order_id) == 0
+
+
+def test_flow_fast_path_matches_heap_path():
+    rng = np.random.default_rng(3)
+    n = 3000
+    times = np.round(rng.random(n)*10, 2)
+    codes = rng.integers(0, 2, n)
+    sides = np.where(rng.random(n) < 0.5, "bid", "ask")
+    types = np.where(rng.random(n) < 0.2, "market", "limit")
+    prices = np.round(np.array([100., 50.])[codes] + rng.normal(0, 1, n), 2)
+    quantities = rng.integers(1, 20, n)
+    fast, slow = exchange(), exchange()
+    a = scheduler.Scheduler(fast)
+    a.add_flow(times, codes, sides, types, prices, quantities)
+    a.every(1., fast.trade_reporter.end_period, end=10)
+    b = scheduler.Scheduler(slow)
+    for i in np.argsort(times, kind="stable").tolist():
+        b.push(times[i], scheduler.ORDER, (slow.book.stock_list[codes[i]], sides[i], types[i],
+                                           prices[i], quantities[i], -1, None))
+    b.every(1., slow.trade_reporter.end_period, end=10)
+    assert a.run(until=4.) + a.run() == b.run()
+    assert a.batches == b.batches
+    assert fast.trade_reporter.trades().tolist() == slow.trade_reporter.trades().tolist()
+    np.testing.assert_array_equal(fast.trade_reporter.bars.buffer.view(), slow.trade_reporter.bars.buffer.view())
@@ -0,0 +1,29 @@
+#####################################################################
+#
+# Tests of the sharded exchange with real Trader ledgers
+#
+# python -m pytest test_sharded_exchange.py
+#
+#####################################################################
+
+import contextlib
+import io
+import numpy as np
+
+import trader
+from sharded_exchange import ShardedExchange
+
+
+def test_trader_receives_sharded_fill():
+    t = trader.Trader(start_capital=10000)
+    with ShardedExchange(["A", "B", "C"], [100., 50., 20.], n_workers=2) as exchange:
+        with contextlib.redirect_stdout(io.StringIO()):
+            exchange.connect_trader([t])
+        exchange.submit_batch(["A", "B"], ["ask", "ask"], "limit", [100., 50.], [10, 5], -1)
+        order_ids, filled, avg_price = exchange.submit_batch(["A", "B"], ["bid", "bid"], "market",
+                                                             np.nan, [4, 5], t.trader_id)
+        assert filled.tolist() == [4, 5]
+        assert t.positions.tolist() == [4, 5, 0]
+        assert t.cash == 10000 - 4*100. - 5*50.
+        # every shard answer was read, the next request gets its own answers
+        assert exchange.end_period().tolist() == [100., 50., 20.]
@@ -3,21 +3,41 @@
 # Trade Reporter keeps track of all completed activities in the 
 # exchange and makes the information available to the traders
 #
-# TODO 1 create price ts
-#
 #####################################################################
 
 import numpy as np
-import pandas as pd
-import matplotlib.pyplot as plt
+import math
+from time import perf_counter_ns
+
+from columnar import ColumnBuffer
+from price_history import BarStore
+from journal import FILL, END_PERIOD
+import instrumentation
+
+# one row per trade, Side is the side of the aggressor (1 buy, -1 sell)
+TRADE_DTYPE = [("Seq", np.int64),
+               ("Stock", np.int32),
+               ("Price", np.float64),
+               ("Quantity", np.int64),
+               ("Side", np.int8),
+               ("Maker_ID", np.int64),
+               ("Taker_ID", np.int64)]
+SIDE_CODES = {"buy": 1, "bid": 1, "sell": -1, "ask": -1}
 
 class TradeReporter:
     
-    def __init__(self, stocks, starting_prices):
-        self.completed_trades = pd.DataFrame(columns = ["Stock", "Price", "Quantity"])
+    def __init__(self, stocks, starting_prices, capacity=4096):
+        """
+        @param stocks: array-like: names of all traded stocks
+        @param starting_prices: array-like: price of each stock before the first trade
+        @param capacity: int: number of trades the tape allocates up front
+        """
         self.stocks = stocks
-        self.prices = pd.DataFrame([[float(p) for p in starting_prices]], columns = stocks)
-        self.p_t = pd.DataFrame([[float(p) for p in starting_prices]], columns = stocks)
+        self.stock_index = {s: i for i, s in enumerate(stocks)}
+        self.tape = ColumnBuffer(TRADE_DTYPE, capacity)
+        self.bars = BarStore(stocks, starting_prices)
+        # the close of the running bar is the last traded price
+        self.last_prices = self.bars.close
         
     def connect_interface(self, interface):
         try:
@@ -32,25 +52,113 @@ class TradeReporter:
         get the bid/ask spread of a certain stock from the orderbook
         @param stock: string: name of the stock of interest
         """
-        ask = self.interface.book.book[stock]["ask"].Price.min()
-        bid = self.interface.book.book[stock]["bid"].Price.max()
+        ask = self.interface.book.book[stock]["ask"].best_price()
+        bid = self.interface.book.book[stock]["bid"].best_price()
         spread = ask - bid
         if abs(spread) == math.inf:
             return None
         else:
             return spread
         
+    @property
+    def prices(self):
+        """
+        last traded price of every stock as one row DataFrame
+        """
+        import pandas as pd
+        return pd.DataFrame([self.last_prices], columns = self.stocks)
+    
+    @property
+    def completed_trades(self):
+        """
+        copy of the trade tape as DataFrame with stock names
+        """
+        trades = self.tape.to_frame()
+        trades["Stock"] = np.asarray(self.stocks)[trades.Stock.values]
+        return trades[["Stock", "Price", "Quantity", "Side", "Maker_ID", "Taker_ID", "Seq"]]
+    
+    @property
+    def p_t(self):
+        """
+        closing price of every stock per period as DataFrame
+        """
+        return self.bars.to_frame("Close")
+    
+    def last_price(self, stock):
+        return self.last_prices[self.stock_index[stock]]
+    
+    def last_bars(self, stock, k=5, field="Close"):
+        """
+        returns one field of the last k bars of a stock without copying
+        """
+        return self.bars.last(k, field)[:, self.stock_index[stock]]
+    
+    def trades(self):
+        """
+        returns the trade tape as structured NumPy array without copying. With a
+        HistorySink only the newest trades are in memory, the first one is trade tape.offset
+        """
+        return self.tape.view()
+    
     def end_period(self):
-        self.p_t = pd.concat([self.p_t, self.prices], ignore_index=True)
+        journal = self.interface.book.journal
+        if journal is not None:
+            journal.record(END_PERIOD)
+        self.bars.end_period()
+        if self.interface.book.metrics is not None:
+            self.interface.book.metrics.end_period(self.interface.book)
+        if self.interface.risk is not None:
+            self.interface.risk.end_period()
+        return None
         
-    def new_filled_order(self, stock, price, quantity):
-        self.prices.loc[0, stock] = price
-        self.completed_trades = pd.concat([self.completed_trades,
-                                           pd.DataFrame([[stock, price, quantity]],
-                                                        columns = ["Stock", "Price", "Quantity"])])
+    def new_filled_order(self, stock, price, quantity, side=0, maker_id=-1, taker_id=-1):
+        """
+        records one trade on the tape, updates the last price of the stock and
+        fires the stop orders crossed by the new price
+        @param side: string or int: side of the aggressor ("buy"/"sell" or 1/-1), 0 if unknown
+        @param maker_id: order id of the resting order
+        @param taker_id: order id of the aggressive order
+        """
+        code = self.stock_index[stock]
+        self.bars.update(code, price, quantity)
+        self.tape.append((self.tape.offset + len(self.tape), code, price, quantity,
+                          SIDE_CODES.get(side, side), int(maker_id), int(taker_id)))
+        journal = self.interface.book.journal
+        if journal is not None:
+            journal.record(FILL, code, side, int(maker_id), price=price, quantity=quantity, taker_id=int(taker_id))
+        self.interface.book.stops.trigger(stock, price)
+        return None
+    
+    def new_filled_orders(self, stock, price, quantities, side, maker_ids, taker_id):
+        """
+        records all trades of one aggressive order against one price level at once
+        @param quantities: np.array: traded quantity per resting order
+        @param maker_ids: array-like: order ids of the resting orders
+        """
+        metrics = self.interface.book.metrics
+        if metrics is not None:
+            start = perf_counter_ns()
+        code = self.stock_index[stock]
+        n = len(quantities)
+        self.bars.update(code, price, int(quantities.sum()), n)
+        seq = self.tape.offset + len(self.tape)
+        self.tape.extend({"Seq": np.arange(seq, seq + n),
+                          "Stock": code,
+                          "Price": price,
+                          "Quantity": quantities,
+                          "Side": SIDE_CODES.get(side, side),
+                          "Maker_ID": np.asarray(maker_ids, dtype=np.int64),
+                          "Taker_ID": int(taker_id)}, n)
+        journal = self.interface.book.journal
+        if journal is not None:
+            journal.record_fills(code, price, quantities, side, maker_ids, int(taker_id))
+        self.interface.book.stops.trigger(stock, price)
+        if metrics is not None:
+            metrics.record(instrumentation.REPORT, code, perf_counter_ns() - start)
         return None
     
     def show_asset_prices(self, hight=15, width=None):
+        import matplotlib.pyplot as plt
         n = len(self.stocks)
         height = 15
         if n%3 == 0:
@@ -72,6 +180,6 @@ class TradeReporter:
         plt.figure(figsize=(hight, width))
         for i in range(n):
             plt.subplot(rows, columns, i+1)
-            plt.plot(self.p_t[self.stocks[i]].values)
+            plt.plot(self.bars.column("Close")[:, i])
             plt.title("Price of asset %s"%self.stocks[i])
         plt.show()
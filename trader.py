@@ -4,29 +4,54 @@
 # stores all information for the trader
 #
 # TODO1 are trader_ids unique
-# TODO2 delete limit order
 #
 #####################################################################
 
-import pandas as pd
 import numpy as np
 
+from columnar import ColumnBuffer
+
+# one row per fill, Direction is 1 for buy and -1 for sell
+FILL_DTYPE = [("Stock", np.int32),
+              ("Direction", np.int8),
+              ("Price", np.float64),
+              ("Quantity", np.int64)]
+DIRECTIONS = {"buy": 1, "sell": -1}
+
 
 class Trader:
     
     def __init__(self, start_capital=1000000):
         self.start_capital = start_capital
-        self.capital = pd.DataFrame([[start_capital, 0, start_capital]],
-                                    columns = ["Cash", "Stocks", "Total Assets"])
-        self.waiting_orders = pd.DataFrame([], columns = ["Stock", "Direction", "Entry Price", "Quantity"])
-        self.filled_orders = pd.DataFrame([], columns = ["Stock", "Direction", "Price", "Quantity"])
-        self.shares_owned = None
+        self.cash = float(start_capital)
+        # value of all positions, each position is valued at the price in marks
+        self.stock_value = 0.0
+        self.positions = None
+        self.marks = None
+        self.stocks = None
+        self.stock_index = None
+        self.fills = ColumnBuffer(FILL_DTYPE, 256)
+        self._waiting_orders = None
+    
+    @property
+    def waiting_orders(self):
+        if self._waiting_orders is None:
+            import pandas as pd
+            self._waiting_orders = pd.DataFrame([], columns = ["Stock", "Direction", "Entry Price", "Quantity"])
+        return self._waiting_orders
+    
+    @waiting_orders.setter
+    def waiting_orders(self, frame):
+        self._waiting_orders = frame
     
     def connect_interface(self, interface):
         try:
             self.interface = interface
             try:
-                self.shares_owned = pd.DataFrame({s: [0] for s in interface.book.stock_list})
+                self.stocks = list(interface.book.stock_list)
+                self.stock_index = {s: i for i, s in enumerate(self.stocks)}
+                self.positions = np.zeros(len(self.stocks), dtype=np.int64)
+                self.marks = np.zeros(len(self.stocks))
             except:
                 print("Interface did not connect to an orderbook yet. Trader reporter cannot be linked.")
                 return None
@@ -55,25 +80,50 @@ class Trader:
             print("%s side of the orderbook of stock "%sides[side]+stock)
             return self.interface.show_orderbook(stock)[side]
     
+    def depth(self, stock, levels=5):
+        """
+        aggregated price levels of a stock, see Interface.depth
+        """
+        return self.interface.depth(stock, levels)
+    
     def limit(self, stock, p, q, direction, verbose=0):
         """
         sends limit order to exchange, where entry is checked and sent to orderbook is proper.
+        @return: int: order id that can be used to cancel or replace the order
         """
         if verbose not in [0,1]:
             print("Got unexpected value for verbose. No order has been sent to the exchange.")
             return None
         if direction == "ask":
-            if self.interface.limit_ask(stock, p, q, self.trader_id):
+            result = self.interface.limit_ask(stock, p, q, self.trader_id)
+            if result:
                 # TODO1
                 if verbose:
                     print("Sell limit order successfully sent.")
-                return None
+                return result[0]
         elif direction == "bid":
-            if self.interface.limit_bid(stock, p, q, self.trader_id):
+            result = self.interface.limit_bid(stock, p, q, self.trader_id)
+            if result:
                 # TODO1
                 if verbose:
                     print("Buy limit order successfully sent.")
-                return None
+                return result[0]
+    
+    def cancel(self, order_id, verbose=0):
+        """
+        cancels a resting limit order or pending stop order of the trader
+        """
+        order_trader = self.interface.book.order_trader
+        if not 0 <= order_id < len(order_trader):
+            print("Order %i does not exist. No order has been cancelled."%order_id)
+            return False
+        if order_trader[order_id] != self.trader_id:
+            print("Order %i was not sent by this trader. No order has been cancelled."%order_id)
+            return False
+        cancelled = self.interface.cancel(order_id)
+        if verbose:
+            print("Order %i cancelled."%order_id if cancelled else "Order %i is not live anymore."%order_id)
+        return cancelled
     
     def market(self, stock, q, direction, verbose=0):
         """
@@ -95,33 +145,59 @@ class Trader:
                     print("Buy market order successfully sent.")
                 return None
     
-    def filled_order_info(self, stock, p, q, direction):
-        self.filled_orders = pd.concat([self.filled_orders,
-                                        pd.DataFrame([[stock, direction, p, q]],
-                                                     columns = ["Stock", "Direction", "Price", "Quantity"])])
-        self.alter_capital_allocation(stock, p, q, direction)
-        return None
+    @property
+    def capital(self):
+        """
+        cash, value of the positions at their last marks and total assets as DataFrame
+        """
+        import pandas as pd
+        return pd.DataFrame([[self.cash, self.stock_value, self.cash + self.stock_value]],
+                            columns = ["Cash", "Stocks", "Total Assets"])
     
-    def alter_capital_allocation(self, stock, p, q, direction):
-        if direction == "buy":
-            self.capital.Cash -= p*q
-            self.shares_owned.loc[0, stock] += q
-        elif direction == "sell":
-            self.capital.Cash += p*q
-            self.shares_owned.loc[0, stock] -= q
-        else:
+    @property
+    def shares_owned(self):
+        import pandas as pd
+        if self.positions is None:
+            return None
+        return pd.DataFrame([self.positions], columns = self.stocks)
+    
+    @property
+    def filled_orders(self):
+        fills = self.fills.to_frame()
+        fills["Stock"] = np.asarray(self.stocks, dtype=object)[fills.Stock.values]
+        fills["Direction"] = np.where(fills.Direction.values == 1, "buy", "sell")
+        return fills
+    
+    def filled_order_info(self, stock, p, q, direction):
+        if direction not in DIRECTIONS:
             print("Invalid direction. Capital was not altered.")
             return None
-        current_prices = self.get_prices().loc[0]
-        self.capital.Stocks = np.dot(np.array(current_prices, dtype=float), self.shares_owned.loc[0])
-        self.capital.loc[0, "Total Assets"] = (self.capital.Cash + self.capital.Stocks).values[0]
+        code = self.stock_index[stock]
+        sign = DIRECTIONS[direction]
+        self.fills.append((code, sign, p, q))
+        self.alter_capital_allocation(code, p, sign*q)
+        return None
+    
+    def alter_capital_allocation(self, code, p, q):
+        """
+        books a fill into cash and position and marks the traded stock to the fill price
+        @param code: int: index of the stock
+        @param q: int: signed quantity, positive for buys
+        """
+        old_value = self.positions[code]*self.marks[code]
+        self.cash -= p*q
+        self.positions[code] += q
+        self.marks[code] = p
+        self.stock_value += self.positions[code]*p - old_value
         return None
     
     def get_prices(self):
         return self.interface.trade_reporter.prices
     
     def get_capital(self):
-        current_prices = self.get_prices().loc[0]
-        self.capital.Stocks = np.dot(np.array(current_prices, dtype=float), self.shares_owned.loc[0])
-        self.capital.loc[0, "Total Assets"] = (self.capital.Cash + self.capital.Stocks).values[0]
+        """
+        marks all positions to the last traded prices and returns the capital
+        """
+        self.marks[:] = self.interface.trade_reporter.last_prices
+        self.stock_value = float(np.dot(self.marks, self.positions))
         return self.capital
\ No newline at end of file